@@ -0,0 +1,241 @@
+"""
+Admission control for the gateway: load is shed with 429 and Retry-After before any upstream call.
+
+- global concurrency limit: at most ``max_in_flight`` requests are handled at once; requests over
+  the limit are rejected at once instead of queueing (long-lived streams can be exempted)
+- token buckets per route, keyed by the logged-in user (``session['username']``) and by client IP;
+  each route prefix has its own rate/burst, the longest matching prefix wins, ``default`` otherwise
+- bucket state lives in a pluggable backend (``register_backend``): ``memory`` (per process, the
+  default) or ``redis`` to share the limits across gateway replicas. A failing backend lets
+  requests through rather than taking the gateway down with it.
+"""
+import math
+import time
+import logging
+import threading
+from collections import OrderedDict
+from starlette.requests import Request
+from starlette.responses import JSONResponse
+import log_pipeline
+
+logger = logging.getLogger('basicLogger')
+request_logger = log_pipeline.request_logger()
+
+
+# --- Token bucket backends ---
+
+class InMemoryTokenBuckets:
+    """Buckets of this gateway process, least recently used ones evicted beyond ``max_keys``."""
+
+    def __init__(self, max_keys=100000, **kwargs):
+        self.max_keys = max_keys
+        self._lock = threading.Lock()
+        self._buckets = OrderedDict()
+
+    async def take(self, key, rate, burst):
+        """Takes one token; returns (allowed, seconds until a token is available)."""
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.pop(key, (burst, now))
+            tokens = min(burst, tokens + (now - updated) * rate)
+            if tokens >= 1:
+                allowed, wait = True, 0.0
+                tokens -= 1
+            else:
+                allowed, wait = False, (1 - tokens) / rate
+            self._buckets[key] = (tokens, now)
+            if len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        return allowed, wait
+
+    def size(self):
+        return len(self._buckets)
+
+
+# 在 Redis 中原子地补充并取走令牌；使用 Redis 的时间，避免各副本时钟不一致
+REDIS_TAKE_SCRIPT = """
+local rate = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local t = redis.call('TIME')
+local now = tonumber(t[1]) + tonumber(t[2]) / 1000000
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(state[1]) or burst
+local ts = tonumber(state[2]) or now
+tokens = math.min(burst, tokens + math.max(0, now - ts) * rate)
+local allowed = 0
+local wait = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+    allowed = 1
+else
+    wait = (1 - tokens) / rate
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'ts', tostring(now))
+redis.call('EXPIRE', KEYS[1], math.ceil(burst / rate) + 1)
+return {allowed, tostring(wait)}
+"""
+
+
+class RedisTokenBuckets:
+    """Buckets shared by all gateway replicas, kept in Redis (needs the redis package)."""
+
+    def __init__(self, redis_url='redis://localhost:6379/0', key_prefix='gateway:ratelimit:', **kwargs):
+        import redis.asyncio
+        self.client = redis.asyncio.Redis.from_url(redis_url)
+        self.key_prefix = key_prefix
+        self._take = self.client.register_script(REDIS_TAKE_SCRIPT)
+
+    async def take(self, key, rate, burst):
+        allowed, wait = await self._take(keys=[self.key_prefix + key], args=[rate, burst])
+        return allowed == 1, float(wait)
+
+    def size(self):
+        return None
+
+
+BACKENDS = {'memory': InMemoryTokenBuckets, 'redis': RedisTokenBuckets}
+
+
+def register_backend(name, backend_class):
+    """Makes ``backend: <name>`` in the admission config build ``backend_class(**conf)``."""
+    BACKENDS[name] = backend_class
+
+
+# --- Admission controller ---
+
+class AdmissionController:
+
+    def __init__(self, backend, routes, max_in_flight=200, overload_retry_after=1, exempt=(),
+                 concurrency_exempt=(), trust_forwarded_for=False):
+        self.backend = backend
+        self.default_rule = routes.get('default', {})
+        # 最长前缀优先
+        self.routes = sorted(((prefix, rule) for prefix, rule in routes.items() if prefix != 'default'),
+                             key=lambda item: len(item[0]), reverse=True)
+        self.max_in_flight = max_in_flight
+        self.overload_retry_after = overload_retry_after
+        self.exempt = tuple(exempt)
+        self.concurrency_exempt = tuple(concurrency_exempt)
+        self.trust_forwarded_for = trust_forwarded_for
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self.admitted = 0
+        self.rejected = {'overload': 0, 'user_rate': 0, 'ip_rate': 0}
+        self.backend_errors = 0
+
+    def rule_for(self, path):
+        for prefix, rule in self.routes:
+            if path.startswith(prefix):
+                return prefix, rule
+        return 'default', self.default_rule
+
+    def is_exempt(self, path):
+        return path.startswith(self.exempt)
+
+    def client_ip(self, scope, headers):
+        if self.trust_forwarded_for and 'x-forwarded-for' in headers:
+            return headers['x-forwarded-for'].split(',')[0].strip()
+        client = scope.get('client')
+        return client[0] if client else 'unknown'
+
+    def try_enter(self, path):
+        """Reserves a concurrency slot; False if the gateway is at ``max_in_flight``."""
+        if path.startswith(self.concurrency_exempt):
+            return True
+        if self.in_flight >= self.max_in_flight:
+            self.rejected['overload'] += 1
+            return False
+        self.in_flight += 1
+        self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+        return True
+
+    def leave(self, path):
+        if not path.startswith(self.concurrency_exempt):
+            self.in_flight -= 1
+
+    async def _take(self, key, rate, burst):
+        try:
+            return await self.backend.take(key, rate, burst)
+        except Exception as e:
+            self.backend_errors += 1
+            logger.warning(f"Admission: rate limit backend failed, letting the request through: {e}")
+            return True, 0.0
+
+    async def check_rate(self, route, rule, username, ip):
+        """Returns None if the request is within its limits, otherwise the Retry-After seconds."""
+        if username and rule.get('user_rate'):
+            allowed, wait = await self._take(f"{route}|user|{username}", rule['user_rate'], rule.get('user_burst', rule['user_rate']))
+            if not allowed:
+                self.rejected['user_rate'] += 1
+                return wait
+        if rule.get('ip_rate'):
+            allowed, wait = await self._take(f"{route}|ip|{ip}", rule['ip_rate'], rule.get('ip_burst', rule['ip_rate']))
+            if not allowed:
+                self.rejected['ip_rate'] += 1
+                return wait
+        return None
+
+    def stats(self):
+        return {'max_in_flight': self.max_in_flight, 'in_flight': self.in_flight,
+                'peak_in_flight': self.peak_in_flight, 'admitted': self.admitted,
+                'rejected': dict(self.rejected), 'backend': type(self.backend).__name__,
+                'buckets': self.backend.size(), 'backend_errors': self.backend_errors}
+
+
+def too_many_requests(retry_after, message):
+    return JSONResponse({"message": message}, status_code=429,
+                        headers={'Retry-After': str(max(1, math.ceil(retry_after)))})
+
+
+class AdmissionMiddleware:
+    """Outermost ASGI middleware: sheds load before routing, the proxy, the stream or any Flask view."""
+
+    def __init__(self, app, controller, sessions):
+        self.app = app
+        self.controller = controller
+        self.sessions = sessions
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http' or self.controller.is_exempt(scope['path']):
+            await self.app(scope, receive, send)
+            return
+
+        path = scope['path']
+        if not self.controller.try_enter(path):
+            logger.warning(f"Admission: gateway at {self.controller.max_in_flight} concurrent requests, shedding {path}.")
+            response = too_many_requests(self.controller.overload_retry_after, "Too Many Requests: gateway overloaded")
+            await response(scope, receive, send)
+            return
+
+        try:
+            request = Request(scope)
+            route, rule = self.controller.rule_for(path)
+            username = self.sessions.load(request).get('username') if rule.get('user_rate') else None
+            retry_after = await self.controller.check_rate(route, rule, username, self.controller.client_ip(scope, request.headers))
+            if retry_after is not None:
+                request_logger.info("Admission: rate limit of %s exceeded (user=%s, path=%s).", route, username, path)
+                response = too_many_requests(retry_after, "Too Many Requests: rate limit exceeded")
+                await response(scope, receive, send)
+                return
+            self.controller.admitted += 1
+            await self.app(scope, receive, send)
+        finally:
+            self.controller.leave(path)
+
+
+def controller_from_config(conf):
+    """Builds the AdmissionController from the ``admission`` section of app_conf.yml (None if disabled)."""
+    conf = dict(conf or {})
+    if not conf.get('enabled', True):
+        return None
+    backend_conf = dict(conf.get('backend_options') or {})
+    backend = BACKENDS[conf.get('backend', 'memory')](**backend_conf)
+    logger.info(f"Admission: {type(backend).__name__} rate limits, at most {conf.get('max_in_flight', 200)} concurrent requests.")
+    return AdmissionController(
+        backend, conf.get('routes') or {},
+        max_in_flight=conf.get('max_in_flight', 200),
+        overload_retry_after=conf.get('overload_retry_after_seconds', 1),
+        exempt=conf.get('exempt') or (),
+        concurrency_exempt=conf.get('concurrency_exempt') or (),
+        trust_forwarded_for=conf.get('trust_forwarded_for', False)
+    )
@@ -1,8 +1,23 @@
-import connexion, yaml, logging, logging.config, json
-from flask import render_template_string
+import connexion, yaml, logging, logging.config, json, time, hashlib
+from contextlib import asynccontextmanager
+from flask import render_template, render_template_string
 import httpx 
 from flask import request, Response, redirect, session, url_for, g 
-from urllib.parse import urljoin 
+from connexion.middleware import MiddlewarePosition
+from connexion.resolver import Resolver
+from upstreams import UpstreamClient, client_settings
+from proxy import DataEntryProxyMiddleware, FlaskSessionReader
+from microcache import MicroCache
+from live_stats import StatsBroadcaster, StatsStreamMiddleware
+from static_pages import StaticPage
+import metrics
+import tracing
+import serving
+import health
+import log_pipeline
+from admission import controller_from_config, AdmissionMiddleware
+from ingest import StorageIngest
+from resilience import BREAKER_STATE_VALUES
 
 # --- Configuration Loading and Logging Setup ---
 try:
@@ -15,12 +30,16 @@ except FileNotFoundError:
 try:
     with open("log_conf.yml", "r") as f:
         LOG_CONFIG = yaml.safe_load(f.read())
-        logging.config.dictConfig(LOG_CONFIG)
 except FileNotFoundError:
     print("WARNING: log_conf.yml not found. Using default logging.")
-    logging.basicConfig(level=logging.INFO)
+    LOG_CONFIG = None
+
+# Records are written by a background thread (log_pipeline.py), not by the request threads or the event loop
+LOG_PIPELINE = log_pipeline.pipeline_from_config(LOG_CONFIG, app_config.get('logging'))
 
 logger = logging.getLogger('basicLogger')
+# Per-request logs, sampled under load
+request_logger = log_pipeline.request_logger()
 
 # Service configuration details for proxying
 ANALYTICS_HOST = app_config['analytics_service']['host']
@@ -31,11 +50,59 @@ DATA_ENTRY_HOST = app_config['data_entry_service']['host']
 DATA_ENTRY_PORT = app_config['data_entry_service']['port']
 AUTH_SERVICE_HOST = app_config['auth_service']['host']
 AUTH_SERVICE_PORT = app_config['auth_service']['port']
+# Storage Service, used directly by the JSON ingest API
+STORAGE_HOST = app_config['storage_service']['host']
+STORAGE_PORT = app_config['storage_service']['port']
 
 # URL construction
 AUTH_SERVICE_URL = f'http://{AUTH_SERVICE_HOST}:{AUTH_SERVICE_PORT}'
 DATA_ENTRY_WEB_URL = f'http://{DATA_ENTRY_HOST}:{DATA_ENTRY_PORT}'
 ANALYTICS_SERVICE_URL = f'http://{ANALYTICS_HOST}:{ANALYTICS_PORT}'
+STORAGE_SERVICE_URL = f'http://{STORAGE_HOST}:{STORAGE_PORT}'
+
+# Long-lived pooled clients, one per upstream (limits and timeouts from app_conf.yml)
+HTTP_CLIENT_CONF = app_config.get('http_client', {})
+auth_client = UpstreamClient('auth_service', AUTH_SERVICE_URL, client_settings(HTTP_CLIENT_CONF, app_config['auth_service']))
+data_entry_client = UpstreamClient('data_entry_service', DATA_ENTRY_WEB_URL, client_settings(HTTP_CLIENT_CONF, app_config['data_entry_service']))
+analytics_client = UpstreamClient('analytics_service', ANALYTICS_SERVICE_URL, client_settings(HTTP_CLIENT_CONF, app_config['analytics_service']))
+storage_client = UpstreamClient('storage_service', STORAGE_SERVICE_URL, client_settings(HTTP_CLIENT_CONF, app_config['storage_service']))
+UPSTREAM_CLIENTS = [auth_client, data_entry_client, analytics_client, storage_client]
+
+# Micro-cache for /analytics/stats (short TTL, request coalescing, stale-while-revalidate)
+STATS_CACHE_CONF = app_config.get('stats_cache', {})
+stats_cache = None
+if STATS_CACHE_CONF.get('enabled', True):
+    stats_cache = MicroCache(
+        ttl=STATS_CACHE_CONF.get('ttl_seconds', 2),
+        stale_while_revalidate=STATS_CACHE_CONF.get('stale_while_revalidate_seconds', 10),
+        stale_if_error=STATS_CACHE_CONF.get('stale_if_error_seconds', 300),
+        cacheable=lambda result: result[1] == 200
+    )
+
+# Server-Sent Events push of the stats (/analytics/stream): one poll loop per gateway process
+LIVE_STATS_CONF = app_config.get('live_stats', {})
+stats_broadcaster = StatsBroadcaster(
+    analytics_client, f"{ANALYTICS_SERVICE_URL}/stats",
+    poll_interval=LIVE_STATS_CONF.get('poll_interval_seconds', 2),
+    heartbeat_seconds=LIVE_STATS_CONF.get('heartbeat_seconds', 15),
+    retry_ms=LIVE_STATS_CONF.get('retry_ms', 5000)
+)
+
+
+# Trace context propagation on the write path (gateway proxy -> data entry web -> storage)
+tracer = tracing.tracer_from_config('api_gateway', app_config.get('tracing'))
+
+
+# JSON ingest API (/api/v1/grades, /api/v1/activities) straight to the Storage Service
+INGEST_CONF = app_config.get('ingest_api', {})
+storage_ingest = StorageIngest(storage_client, STORAGE_SERVICE_URL, tracer,
+                               batch_concurrency=INGEST_CONF.get('batch_concurrency', 8))
+# sha256(username:password) -> expiry of Basic credentials verified by the Auth Service
+API_CREDENTIALS = {}
+API_CREDENTIALS_TTL = INGEST_CONF.get('credentials_cache_seconds', 60)
+
+# Admission control: global concurrency limit and per-route token buckets per user and per IP
+admission_controller = controller_from_config(app_config.get('admission'))
 
 
 # --- Dashboard HTML Content (Restored) ---
@@ -94,6 +161,7 @@ DASHBOARD_HTML_CONTENT = """
             <div class="stat-card bg-white p-6 shadow-md border-l-4 border-green-500">
                 <p class="text-sm font-medium text-gray-500">Average Score</p>
                 <p id="avg-grade" class="mt-2 text-4xl font-bold text-green-600">--</p>
+                <p class="mt-1 text-sm text-gray-500">Std Dev: <span id="std-grade">--</span></p>
             </div>
 
             <div class="stat-card bg-white p-6 shadow-md border-l-4 border-green-500">
@@ -115,6 +183,7 @@ DASHBOARD_HTML_CONTENT = """
             <div class="stat-card bg-white p-6 shadow-md border-l-4 border-blue-500">
                 <p class="text-sm font-medium text-gray-500">Average Activity Hours</p>
                 <p id="avg-activity" class="mt-2 text-4xl font-bold text-blue-600">--</p>
+                <p class="mt-1 text-sm text-gray-500">Std Dev: <span id="std-activity">--</span></p>
             </div>
             
             <div class="stat-card bg-white p-6 shadow-md border-l-4 border-blue-500">
@@ -127,6 +196,18 @@ DASHBOARD_HTML_CONTENT = """
                 <p id="max-activity" class="mt-2 text-4xl font-bold text-gray-900">--</p>
             </div>
         </div>
+
+        <!-- Distributions (fixed-bin histograms from the Analytics Service) -->
+        <div id="histograms-container" class="grid grid-cols-1 md:grid-cols-2 gap-6 mt-8 hidden">
+            <div class="stat-card bg-white p-6 shadow-md border-l-4 border-green-500">
+                <p class="text-sm font-medium text-gray-500 mb-4">Score Distribution</p>
+                <div id="grade-histogram" class="space-y-1"></div>
+            </div>
+            <div class="stat-card bg-white p-6 shadow-md border-l-4 border-blue-500">
+                <p class="text-sm font-medium text-gray-500 mb-4">Activity Hours Distribution</p>
+                <div id="activity-histogram" class="space-y-1"></div>
+            </div>
+        </div>
         
         <footer class="mt-8 p-6 bg-white rounded-xl shadow-xl">
             <h2 class="text-xl font-bold text-gray-700 mb-4 border-b pb-2">Update Information</h2>
@@ -141,6 +222,7 @@ DASHBOARD_HTML_CONTENT = """
     <script>
         // API Gateway Proxy Route
         const API_URL = '/analytics/stats'; 
+        const STREAM_URL = '/analytics/stream';
         const REFRESH_INTERVAL_MS = 10000; // 10 seconds refresh interval
         
         function formatTimestamp(ms) {
@@ -153,6 +235,58 @@ DASHBOARD_HTML_CONTENT = """
             });
         }
 
+        function renderHistogram(elementId, histogram, colorClass) {
+            const container = document.getElementById(elementId);
+            container.innerHTML = '';
+            if (!histogram || !histogram.counts) return;
+
+            const maxCount = Math.max(1, ...histogram.counts);
+            histogram.counts.forEach((count, i) => {
+                const isLast = i === histogram.counts.length - 1;
+                const label = `${histogram.edges[i]}${isLast ? '+' : '–' + histogram.edges[i + 1]}`;
+                const row = document.createElement('div');
+                row.className = 'flex items-center text-xs text-gray-600';
+                row.innerHTML = `<span class="w-16 shrink-0">${label}</span>` +
+                    `<div class="flex-1 bg-gray-100 rounded h-3 mx-2"><div class="${colorClass} h-3 rounded" style="width: ${(count / maxCount * 100).toFixed(1)}%"></div></div>` +
+                    `<span class="w-12 text-right">${count}</span>`;
+                container.appendChild(row);
+            });
+        }
+
+        function displayStats(stats) {
+            // Populate data cards
+            document.getElementById('grade-count').textContent = stats.num_grade_readings;
+            document.getElementById('avg-grade').textContent = stats.avg_grade_readings !== undefined ? stats.avg_grade_readings.toFixed(2) : '--';
+            document.getElementById('min-grade').textContent = stats.min_grade_readings !== undefined ? stats.min_grade_readings.toFixed(1) : '--';
+            document.getElementById('max-grade').textContent = stats.max_grade_readings !== undefined ? stats.max_grade_readings.toFixed(1) : '--';
+            
+            document.getElementById('activity-count').textContent = stats.num_activity_readings;
+            document.getElementById('avg-activity').textContent = stats.avg_activity_hours !== undefined ? stats.avg_activity_hours.toFixed(2) : '--';
+            document.getElementById('min-activity').textContent = stats.min_activity_hours !== undefined ? stats.min_activity_hours.toFixed(1) : '--';
+            document.getElementById('max-activity').textContent = stats.max_activity_hours !== undefined ? stats.max_activity_hours.toFixed(1) : '--';
+            document.getElementById('std-grade').textContent = stats.std_grade_readings !== undefined ? stats.std_grade_readings.toFixed(2) : '--';
+            document.getElementById('std-activity').textContent = stats.std_activity_hours !== undefined ? stats.std_activity_hours.toFixed(2) : '--';
+
+            // Populate distributions
+            renderHistogram('grade-histogram', stats.grade_histogram, 'bg-green-500');
+            renderHistogram('activity-histogram', stats.activity_histogram, 'bg-blue-500');
+
+            // Populate footer information
+            document.getElementById('last-updated-time').textContent = formatTimestamp(stats.last_updated);
+            
+            document.getElementById('loading').classList.add('hidden');
+            document.getElementById('error-message').classList.add('hidden');
+            document.getElementById('stats-container').classList.remove('hidden');
+            document.getElementById('histograms-container').classList.remove('hidden');
+        }
+
+        function displayError() {
+            document.getElementById('loading').classList.add('hidden');
+            document.getElementById('stats-container').classList.add('hidden');
+            document.getElementById('histograms-container').classList.add('hidden');
+            document.getElementById('error-message').classList.remove('hidden');
+        }
+
         async function fetchAndDisplayStats() {
             document.getElementById('loading').classList.remove('hidden');
             document.getElementById('error-message').classList.add('hidden');
@@ -175,25 +309,7 @@ DASHBOARD_HTML_CONTENT = """
                         throw new Error(`HTTP error! status: ${response.status}`);
                     }
                     
-                    const stats = await response.json();
-                    
-                    // Populate data cards
-                    document.getElementById('grade-count').textContent = stats.num_grade_readings;
-                    document.getElementById('avg-grade').textContent = stats.avg_grade_readings !== undefined ? stats.avg_grade_readings.toFixed(2) : '--';
-                    document.getElementById('min-grade').textContent = stats.min_grade_readings !== undefined ? stats.min_grade_readings.toFixed(1) : '--';
-                    document.getElementById('max-grade').textContent = stats.max_grade_readings !== undefined ? stats.max_grade_readings.toFixed(1) : '--';
-                    
-                    document.getElementById('activity-count').textContent = stats.num_activity_readings;
-                    document.getElementById('avg-activity').textContent = stats.avg_activity_hours !== undefined ? stats.avg_activity_hours.toFixed(2) : '--';
-                    document.getElementById('min-activity').textContent = stats.min_activity_hours !== undefined ? stats.min_activity_hours.toFixed(1) : '--';
-                    document.getElementById('max-activity').textContent = stats.max_activity_hours !== undefined ? stats.max_activity_hours.toFixed(1) : '--';
-
-                    // Populate footer information
-                    document.getElementById('last-updated-time').textContent = formatTimestamp(stats.last_updated);
-                    
-                    document.getElementById('loading').classList.add('hidden');
-                    document.getElementById('stats-container').classList.remove('hidden');
-                    
+                    displayStats(await response.json());
                     success = true;
                     break; 
 
@@ -207,9 +323,7 @@ DASHBOARD_HTML_CONTENT = """
             }
             
             if (!success) {
-                document.getElementById('loading').classList.add('hidden');
-                document.getElementById('stats-container').classList.add('hidden');
-                document.getElementById('error-message').classList.remove('hidden');
+                displayError();
             }
         }
         
@@ -224,6 +338,28 @@ DASHBOARD_HTML_CONTENT = """
             updateNextRefreshTime(); 
         }
 
+        // Live updates pushed by the gateway over Server-Sent Events; polling is the fallback
+        // when EventSource is unsupported or the stream is refused (e.g. 401 after logout).
+        function startLiveUpdates() {
+            if (!window.EventSource) {
+                startAutoRefresh();
+                return;
+            }
+            const source = new EventSource(STREAM_URL);
+            source.onopen = () => {
+                document.getElementById('next-refresh').textContent = 'Live (server push)';
+            };
+            source.addEventListener('stats', (event) => displayStats(JSON.parse(event.data)));
+            source.addEventListener('unavailable', () => displayError());
+            source.onerror = () => {
+                // CONNECTING: the browser reconnects by itself; CLOSED: the stream was refused
+                if (source.readyState === EventSource.CLOSED) {
+                    console.warn("Live stats stream closed. Falling back to polling.");
+                    startAutoRefresh();
+                }
+            };
+        }
+
         function updateNextRefreshTime() {
             const nextRefreshElement = document.getElementById('next-refresh');
             let remaining = REFRESH_INTERVAL_MS / 1000;
@@ -241,7 +377,7 @@ DASHBOARD_HTML_CONTENT = """
             }, 1000);
         }
 
-        window.onload = startAutoRefresh;
+        window.onload = startLiveUpdates;
 
     </script>
 </body>
@@ -267,39 +403,42 @@ def login_required(f):
 
 # --- UI/Frontend Routes ---
 
+# HTML for the service selection page (static, pre-rendered at startup)
+SELECTION_HTML = """
+<!doctype html>
+<html lang="en">
+<head>
+    <title>Microservice Selector</title>
+    <style>
+        body { font-family: sans-serif; margin: 20px; text-align: center; background-color: #f4f4f9; }
+        .container { max-width: 400px; margin: auto; background: white; padding: 30px; border-radius: 12px; box-shadow: 0 6px 10px rgba(0,0,0,0.15); }
+        h1 { color: #007bff; }
+        .link-btn { display: block; padding: 15px; margin: 15px 0; background-color: #007bff; color: white; text-decoration: none; border-radius: 8px; font-size: 1.2em; transition: background-color 0.3s; }
+        .link-btn:hover { background-color: #0056b3; }
+        .logout-link { display: block; margin-top: 30px; font-size: 0.9em; }
+    </style>
+</head>
+<body>
+    <div class="container">
+        <h1>Service Access Portal</h1>
+        <a href="/data_entry_web" class="link-btn">Data Entry Web App</a>
+        <a href="/dashboard" class="link-btn">Analytics Dashboard</a>
+        <a href="/logout" class="logout-link">Logout</a>
+    </div>
+</body>
+</html>
+"""
+
 @login_required
 def get_selection_page():
-    """Renders the main service selection page (e.g., after login)."""
-    logger.info("Serving selection page to user.")
-    return render_template_string("""
-        <!doctype html>
-        <html lang="en">
-        <head>
-            <title>Microservice Selector</title>
-            <style>
-                body { font-family: sans-serif; margin: 20px; text-align: center; background-color: #f4f4f9; }
-                .container { max-width: 400px; margin: auto; background: white; padding: 30px; border-radius: 12px; box-shadow: 0 6px 10px rgba(0,0,0,0.15); }
-                h1 { color: #007bff; }
-                .link-btn { display: block; padding: 15px; margin: 15px 0; background-color: #007bff; color: white; text-decoration: none; border-radius: 8px; font-size: 1.2em; transition: background-color 0.3s; }
-                .link-btn:hover { background-color: #0056b3; }
-                .logout-link { display: block; margin-top: 30px; font-size: 0.9em; }
-            </style>
-        </head>
-        <body>
-            <div class="container">
-                <h1>Service Access Portal</h1>
-                <a href="/data_entry_web" class="link-btn">Data Entry Web App</a>
-                <a href="/dashboard" class="link-btn">Analytics Dashboard</a>
-                <a href="/logout" class="logout-link">Logout</a>
-            </div>
-        </body>
-        </html>
-    """)
+    """Serves the main service selection page (e.g., after login), pre-rendered at startup."""
+    request_logger.info("Serving selection page to user.")
+    return PAGES['selection'].response()
 
 @login_required
 def get_dashboard_page():
-    """Renders the dashboard page by returning the full HTML content with embedded JS."""
-    return render_template_string(DASHBOARD_HTML_CONTENT)
+    """Serves the dashboard page (full HTML content with embedded JS), pre-rendered at startup."""
+    return PAGES['dashboard'].response()
 
 
 def login():
@@ -312,9 +451,8 @@ def login():
         password = request.form.get('password')
         
         try:
-            auth_response = httpx.post(f"{AUTH_SERVICE_URL}/authenticate", 
-                                        json={'username': username, 'password': password}, 
-                                        timeout=5)
+            auth_response = auth_client.post(f"{AUTH_SERVICE_URL}/authenticate", 
+                                             json={'username': username, 'password': password})
             
             if auth_response.status_code == 200:
                 try:
@@ -322,7 +460,7 @@ def login():
                 except json.JSONDecodeError:
                     # Case 1: 200 OK but response is not valid JSON
                     logger.error(f"AUTH DEBUG: 200 OK but response is not valid JSON. RAW Response: {auth_response.text}")
-                    return render_template_string(LOGIN_HTML, error="Authentication response invalid (not JSON). Check Auth Service logs.")
+                    return render_template(LOGIN_TEMPLATE, error="Authentication response invalid (not JSON). Check Auth Service logs.")
                 
                 # Case 2: 200 OK and valid JSON, attempt to find a token
                 found_token = None
@@ -344,7 +482,7 @@ def login():
                     # CRITICAL LOGGING: Log the received data when 'token' is missing
                     logger.error(f"AUTH DEBUG: 200 OK but NO expected token key found. Keys checked: {TOKEN_KEYS}. Received JSON: {json.dumps(token_data)}")
                     error_message = f"Authentication succeeded (200 OK), but Auth Service did not return an expected Token key ({', '.join(TOKEN_KEYS)}). Check Auth Service response body."
-                    return render_template_string(LOGIN_HTML, error=error_message)
+                    return render_template(LOGIN_TEMPLATE, error=error_message)
             else:
                 # Authentication failed (e.g., HTTP 401)
                 logger.warning(f"Login failed for user {username}: {auth_response.status_code}. Response: {auth_response.text}")
@@ -352,13 +490,13 @@ def login():
                     error_message = auth_response.json().get('message', f"Authentication failed with status {auth_response.status_code}.")
                 except json.JSONDecodeError:
                     error_message = f"Authentication failed, status code {auth_response.status_code}."
-                return render_template_string(LOGIN_HTML, error=error_message)
+                return render_template(LOGIN_TEMPLATE, error=error_message)
 
         except httpx.RequestError as e:
             logger.error(f"Authentication service connection error: {e}")
-            return render_template_string(LOGIN_HTML, error="Authentication service unavailable.")
+            return render_template(LOGIN_TEMPLATE, error="Authentication service unavailable.")
             
-    return render_template_string(LOGIN_HTML, error=None)
+    return PAGES['login'].response()
 
 def logout():
     """Handles user logout."""
@@ -404,129 +542,215 @@ LOGIN_HTML = """
 """
 
 # --- Proxy Functions ---
+# The Data Entry Web App routes are proxied by DataEntryProxyMiddleware (proxy.py).
 
-@login_required
-def proxy_data_entry_web(path):
-    """Proxies requests for the Data Entry Web App."""
-    
-    # 1. Construct Target URL
-    target_url = urljoin(DATA_ENTRY_WEB_URL, path)
-    
-    # Preserve original query string
-    if request.query_string:
-        target_url += '?' + request.query_string.decode()
-        
-    logger.info(f"Proxying Data Entry Web request ({request.method}) from {request.path} to TARGET: {target_url}")
-    
-    try:
-        # 2. Request Preparation
-        headers = {}
-        if is_authenticated():
-            # Pass the token in the Authorization header
-            headers['Authorization'] = f"Bearer {session.get('auth_token')}"
-            
-        
-        # 3. Send Request
-        if request.method == 'GET':
-            response = httpx.get(target_url, headers=headers, timeout=10)
-        elif request.method == 'POST':
-            # Use content=request.get_data() and pass the original content type
-            response = httpx.post(target_url, content=request.get_data(), headers={**headers, 'Content-Type': request.content_type}, timeout=10)
-        else:
-            return Response("Method not allowed", status=405)
-
-        logger.info(f"Proxy received status {response.status_code} from Data Entry Web for path '{path}'. Content length: {len(response.content)}.")
-
-        # 4. Handle Redirects (Status 3xx)
-        location = response.headers.get('location')
-        if location and response.status_code in (301, 302, 303, 307, 308):
-            
-            # Web App typically redirects POST /submit to GET /?status=... (its own root path /)
-            
-            # Case A: Redirect to internal root path '/' (Data Entry Web App's root)
-            if location.startswith('/'):
-                
-                if location == '/' or location.startswith('/?'):
-                    # The redirect is going to the web app's homepage.
-                    
-                    # Remove leading slash from location to avoid double slashes 
-                    # when joining with the gateway's base path /data_entry_web/
-                    if location.startswith('/'):
-                        location = location[1:] 
+def fetch_analytics_stats(headers):
+    """Calls the Analytics Service /stats endpoint and returns (content, status, headers) for the micro-cache."""
+    target_url = f"{ANALYTICS_SERVICE_URL}/stats"
+    request_logger.info("Proxying Analytics Service request (GET) to TARGET: %s", target_url)
+    response = analytics_client.get(target_url, headers=headers)
 
-                    redirect_path = f"/data_entry_web/{location}" # e.g. /data_entry_web/?status=...
-                    
-                    logger.info(f"Internal redirect to Web App Root ('/') detected. Correcting client redirect path to: {redirect_path}")
-                    return redirect(redirect_path, code=response.status_code)
-                    
-                # Case B: Redirect to other internal Web App path (e.g., /favicon.ico, /submit?...)
-                elif location.startswith('/'):
-                    # This handles /submit?__debugger__ and any other internal path
-                    redirect_path = f"/data_entry_web{location}"
-                    logger.info(f"Internal path redirect to {location} detected. Correcting client redirect path to: {redirect_path}")
-                    return redirect(redirect_path, code=response.status_code)
-            
-            # Case C: External URL, keep as is (no correction needed)
-            
-        # 5. Return Response
-        
-        # Filter out hop-by-hop headers
-        response_headers = [(name, value) for name, value in response.headers.items() 
-                            if name.lower() not in ('content-encoding', 'transfer-encoding', 'content-length', 'connection')]
-        
-        return Response(response.content, response.status_code, response_headers)
+    # NOTE: Do NOT use response.json() here. Proxy raw content.
+    if response.status_code == 200:
+        request_logger.info("Analytics Service response status 200. Content length: %d.", len(response.content))
+    else:
+        logger.error(f"Analytics Service returned status {response.status_code}. Response: {response.text}")
+    response_headers = [(name, value) for name, value in response.headers.items()
+                        if name.lower() not in ('content-encoding', 'transfer-encoding', 'content-length', 'connection')]
+    return response.content, response.status_code, response_headers
 
-    except httpx.RequestError as e:
-        logger.error(f"Failed to proxy request to Data Entry Web: {e}")
-        return Response(f"Service Unavailable: Data Entry Web is currently unreachable at {DATA_ENTRY_WEB_URL}.", 
-                        status=503, 
-                        mimetype='text/plain')
 
 @login_required
 def proxy_analytics_stats():
-    """Proxies GET requests for the Analytics Service /stats endpoint."""
-    target_url = f"{ANALYTICS_SERVICE_URL}/stats"
-    logger.info(f"Proxying Analytics Service request (GET) to TARGET: {target_url}")
+    """
+    Proxies GET requests for the Analytics Service /stats endpoint through the micro-cache:
+    the stats only change once per scheduler interval, so concurrent dashboards share one upstream call.
+    """
+    # CRITICAL: Prepare headers to pass the token to downstream services
+    headers = {}
+    if is_authenticated():
+        # Pass the token in the Authorization header
+        headers['Authorization'] = f"Bearer {session.get('auth_token')}"
 
     try:
-        # CRITICAL: Prepare headers to pass the token to downstream services
-        headers = {}
-        if is_authenticated():
-            # Pass the token in the Authorization header
-            headers['Authorization'] = f"Bearer {session.get('auth_token')}"
+        if stats_cache is None:
+            content, status, response_headers = fetch_analytics_stats(headers)
+            return Response(content, status, response_headers)
 
-        response = httpx.get(target_url, headers=headers, timeout=10)
-        
-        # NOTE: Do NOT use response.json() here. Proxy raw content.
-        
-        if response.status_code == 200:
-            logger.info(f"Analytics Service response status 200. Content length: {len(response.content)}.")
-            return Response(response.content, response.status_code, response.headers)
-        else:
-            logger.error(f"Analytics Service returned status {response.status_code}. Response: {response.text}")
-            return Response(response.content, response.status_code, response.headers)
+        (content, status, response_headers), cache_state, age = stats_cache.get('stats', lambda: fetch_analytics_stats(headers))
+        return Response(content, status, response_headers + [('X-Cache', cache_state), ('Age', str(int(age)))])
 
     except httpx.RequestError as e:
         logger.error(f"Failed to proxy request to Analytics Service: {e}")
         # Return a 503 JSON response for the frontend to handle gracefully
         return Response(json.dumps({"message": "Service Unavailable: Analytics Service"}), 503, {'Content-Type': 'application/json'})
 
-# --- SHIM FUNCTION FOR /submit POST ---
+# --- JSON Ingest API (ingest_api.yaml) ---
 
-@login_required
-def proxy_submit_shim():
+def authenticate_api_request():
     """
-    Shim function to catch POST requests coming to the root /submit path.
-    This is necessary because the Data Entry Web App's HTML form action is hardcoded to "/submit".
-    It redirects the request internally to the correct Data Entry Web App's '/submit' path.
+    Returns the user of an ingest request: the logged-in session user, or the user of HTTP Basic
+    credentials accepted by the Auth Service (cached for API_CREDENTIALS_TTL seconds). None otherwise.
     """
-    # The 'submit' argument is the path component for the downstream service
-    return proxy_data_entry_web('submit') 
+    if is_authenticated():
+        return session.get('username')
+    credentials = request.authorization
+    if credentials is None or credentials.type != 'basic' or not credentials.username:
+        return None
+
+    key = hashlib.sha256(f"{credentials.username}:{credentials.password}".encode()).hexdigest()
+    if API_CREDENTIALS.get(key, 0) > time.monotonic():
+        return credentials.username
+    try:
+        auth_response = auth_client.post(f"{AUTH_SERVICE_URL}/authenticate",
+                                         json={'username': credentials.username, 'password': credentials.password})
+    except httpx.RequestError as e:
+        logger.error(f"Ingest: Auth Service unreachable: {e}")
+        return None
+    if auth_response.status_code != 200:
+        logger.warning(f"Ingest: Basic credentials of {credentials.username} rejected ({auth_response.status_code}).")
+        return None
+    if len(API_CREDENTIALS) > 10000:
+        API_CREDENTIALS.clear()
+    API_CREDENTIALS[key] = time.monotonic() + API_CREDENTIALS_TTL
+    return credentials.username
+
+
+def ingest_events(event_type, body):
+    user = authenticate_api_request()
+    if user is None:
+        return {"message": "Unauthorized"}, 401, {'WWW-Authenticate': 'Basic realm="api"'}
+    respond_async = 'respond-async' in request.headers.get('Prefer', '')
+    parent = tracing.parse_traceparent(request.headers.get(tracing.TRACEPARENT_HEADER))
+    result, status = storage_ingest.ingest(event_type, body, parent=parent, respond_async=respond_async)
+    request_logger.info("Ingest: %s submitted %s %s events, status %s.",
+                        user, result.get('accepted', len(body) if isinstance(body, list) else 1), event_type, status)
+    if respond_async:
+        return result, status, {'Preference-Applied': 'respond-async'}
+    return result, status
+
+
+def ingest_grades(body):
+    """POST /api/v1/grades: one grade or an array of grades."""
+    return ingest_events('grade', body)
+
+
+def ingest_activities(body):
+    """POST /api/v1/activities: one activity or an array of activities."""
+    return ingest_events('activity', body)
+
+
+INGEST_OPERATIONS = {'ingest_grades': ingest_grades, 'ingest_activities': ingest_activities}
+
+# --- Gateway Metrics ---
+
+def get_upstream_metrics():
+    """Returns request counters and connection pool utilisation of every upstream client."""
+    return json.dumps({'upstreams': [upstream.stats() for upstream in UPSTREAM_CLIENTS]}), 200, {'Content-Type': 'application/json'}
+
+
+def get_cache_metrics():
+    """Returns hit, miss and coalescing counters of the /analytics/stats micro-cache."""
+    cache = stats_cache.stats() if stats_cache is not None else {'enabled': False}
+    return json.dumps({'analytics_stats': cache}), 200, {'Content-Type': 'application/json'}
+
+
+def get_stream_metrics():
+    """Returns the number of connected /analytics/stream subscribers and the state of the poll loop."""
+    return json.dumps(stats_broadcaster.stats()), 200, {'Content-Type': 'application/json'}
+
+
+def get_ingest_metrics():
+    """Returns the events accepted, stored and failed by the JSON ingest API."""
+    return json.dumps(storage_ingest.stats()), 200, {'Content-Type': 'application/json'}
+
+
+def get_admission_metrics():
+    """Returns in-flight requests and the requests shed by the concurrency limit and the rate limits."""
+    admission = admission_controller.stats() if admission_controller is not None else {'enabled': False}
+    return json.dumps(admission), 200, {'Content-Type': 'application/json'}
+
+
+def upstream_gauges():
+    """Scrape-time Prometheus values of the upstream pools, breakers and bulkheads."""
+    for upstream in UPSTREAM_CLIENTS:
+        stats = upstream.stats()
+        name = upstream.name
+        yield (name, 'open_connections'), stats['open_connections']
+        yield (name, 'idle_connections'), stats['idle_connections']
+        yield (name, 'max_connections'), stats['max_connections']
+        yield (name, 'in_flight'), stats['in_flight']
+        yield (name, 'bulkhead_active'), stats['bulkhead_active']
+        yield (name, 'breaker_state'), BREAKER_STATE_VALUES[stats['breaker']['state']]
+        yield (name, 'read_timeout_seconds'), stats['read_timeout_seconds']
+
+
+def upstream_rejections():
+    for upstream in UPSTREAM_CLIENTS:
+        yield (upstream.name, 'breaker_open'), upstream.breaker.rejected
+        yield (upstream.name, 'bulkhead_full'), upstream.bulkhead.rejected
+        yield (upstream.name, 'retry_budget_exhausted'), upstream.retry_budget.exhausted
+
+
+def cache_counters():
+    if stats_cache is not None:
+        for name, value in stats_cache.stats().items():
+            if name in stats_cache.counters:
+                yield (name,), value
+
+
+def admission_rejections():
+    if admission_controller is not None:
+        for reason, count in admission_controller.rejected.items():
+            yield (reason,), count
+
+
+metrics.register_gauges('gateway_upstream', 'Upstream pool, breaker (0 closed, 1 half open, 2 open) and bulkhead state',
+                        ['upstream', 'field'], upstream_gauges)
+metrics.register_gauges('gateway_upstream_rejected', 'Upstream calls failed fast or not retried',
+                        ['upstream', 'reason'], upstream_rejections, kind='counter')
+metrics.register_gauges('gateway_stats_cache', 'Micro-cache counters of /analytics/stats',
+                        ['event'], cache_counters, kind='counter')
+metrics.register_gauges('gateway_admission_rejected', 'Requests shed with 429 by the admission controller',
+                        ['reason'], admission_rejections, kind='counter')
+metrics.register_gauges('gateway_stream_subscribers', 'Connected /analytics/stream clients',
+                        [], lambda: [((), len(stats_broadcaster.subscribers))])
+metrics.register_gauges('log_records', 'Log records queued, dropped on a full queue or sampled out',
+                        ['event'], LOG_PIPELINE.counters, kind='counter')
+
+
+# Probes: the gateway has no required dependency (a failing upstream is handled by its breaker),
+# so /readyz answers 200 as soon as the worker serves
+health_monitor = health.monitor_from_config(app_config.get('health'))
+
+
+# Multi-process serving (gunicorn.conf.py): the app is imported in the gunicorn master, then forked
+SERVING_CONF = serving.settings(app_config.get('serving'))
+
+
+def post_fork():
+    """Per-worker setup after the fork: own upstream connection pools, span export and log writer threads."""
+    for upstream in UPSTREAM_CLIENTS:
+        upstream.after_fork()
+    tracer.after_fork()
+    LOG_PIPELINE.after_fork()
+
+
+@asynccontextmanager
+async def lifespan(app):
+    """Sizes the sync view thread pool and starts the health checks; stops the live stats poll loop and closes the upstream pools on shutdown."""
+    await serving.limit_threadpool(SERVING_CONF['threads'])
+    health_monitor.start()
+    yield
+    health_monitor.stop()
+    await stats_broadcaster.stop()
+    for upstream in UPSTREAM_CLIENTS:
+        await upstream.aclose()
 
 
 # --- Main App Execution ---
 
-app = connexion.FlaskApp(__name__, specification_dir='')
+app = connexion.FlaskApp(__name__, specification_dir='', lifespan=lifespan)
 
 # CRITICAL: Set secret key for session management on the underlying Flask app
 app.app.secret_key = 'a_very_secure_secret_key_for_api_gateway_456789' 
@@ -542,22 +766,54 @@ app.app.add_url_rule('/dashboard', 'get_dashboard_page', get_dashboard_page, met
 # Proxy route for the dashboard's internal API call
 app.app.add_url_rule('/analytics/stats', 'proxy_analytics_stats', proxy_analytics_stats, methods=['GET'])
 
-# --- DATA ENTRY WEB APP PROXY ROUTES ---
-
-# 1. Base /data_entry_web GET/POST (handles the main page itself, path='')
-app.app.add_url_rule('/data_entry_web', 'proxy_data_entry_web_base', login_required(proxy_data_entry_web), methods=['GET', 'POST'], defaults={'path': ''})
+# Upstream connection pool metrics
+app.app.add_url_rule('/gateway/upstreams', 'get_upstream_metrics', get_upstream_metrics, methods=['GET'])
+app.app.add_url_rule('/gateway/cache', 'get_cache_metrics', get_cache_metrics, methods=['GET'])
+app.app.add_url_rule('/gateway/stream', 'get_stream_metrics', get_stream_metrics, methods=['GET'])
+app.app.add_url_rule('/gateway/admission', 'get_admission_metrics', get_admission_metrics, methods=['GET'])
+app.app.add_url_rule('/gateway/ingest', 'get_ingest_metrics', get_ingest_metrics, methods=['GET'])
+
+# JSON ingest API, validated against the Storage Service schemas. Operations resolve to this
+# module's functions directly, so Connexion does not import gateway.py a second time.
+app.add_api('ingest_api.yaml', strict_validation=True,
+            resolver=Resolver(function_resolver=lambda operation_id: INGEST_OPERATIONS[operation_id]))
+
+# Liveness and readiness probes
+app.app.add_url_rule('/healthz', 'healthz', health_monitor.healthz, methods=['GET'])
+app.app.add_url_rule('/readyz', 'readyz', health_monitor.readyz, methods=['GET'])
+
+# Prometheus metrics (request counts and latency per route, upstream latency, pool usage)
+app.app.add_url_rule('/metrics', 'get_prometheus_metrics', metrics.metrics_view, methods=['GET'])
+metrics.instrument_flask(app.app)
+
+# Admission control runs first, so shed requests never reach the proxy, the stream or a Flask view
+if admission_controller is not None:
+    app.add_middleware(AdmissionMiddleware, position=MiddlewarePosition.BEFORE_EXCEPTION,
+                       controller=admission_controller, sessions=FlaskSessionReader(app.app))
+
+# Server-Sent Events stream of the stats for the dashboard, served on the event loop
+app.add_middleware(StatsStreamMiddleware, position=MiddlewarePosition.BEFORE_SWAGGER,
+                   broadcaster=stats_broadcaster, sessions=FlaskSessionReader(app.app))
+
+# --- Pre-rendered Pages ---
+# Templates are compiled once at startup. Static pages are also rendered once and served with
+# precomputed gzip/brotli variants, strong ETags and Cache-Control (see static_pages.py).
+STATIC_PAGES_CONF = app_config.get('static_pages', {})
+LOGIN_TEMPLATE = app.app.jinja_env.from_string(LOGIN_HTML)
+with app.app.test_request_context():
+    # / and /dashboard need a session: browsers revalidate them on every visit (ETag, 304)
+    PAGES = {
+        'selection': StaticPage(render_template_string(SELECTION_HTML)),
+        'dashboard': StaticPage(render_template_string(DASHBOARD_HTML_CONTENT)),
+        'login': StaticPage(render_template(LOGIN_TEMPLATE, error=None), max_age=STATIC_PAGES_CONF.get('max_age_seconds', 86400)),
+    }
 
-# 1.5. CRITICAL FIX: Add base path with trailing slash for redirects with query strings.
-# This fixes the 404 seen when the client follows the redirect to /data_entry_web/?status=...
-app.app.add_url_rule('/data_entry_web/', 'proxy_data_entry_web_base_slash', login_required(proxy_data_entry_web), methods=['GET', 'POST'], defaults={'path': ''})
-
-
-# 2. Paths under /data_entry_web/<path:path> 
-app.app.add_url_rule('/data_entry_web/<path:path>', 'proxy_data_entry_web_path', login_required(proxy_data_entry_web), methods=['GET', 'POST'])
+# --- DATA ENTRY WEB APP PROXY ROUTES ---
 
-# 3. CRITICAL SHIM: Route for POST /submit
-# This catches the hardcoded form action from the Data Entry Web App and proxies it.
-app.app.add_url_rule('/submit', 'proxy_submit_shim', proxy_submit_shim, methods=['POST']) 
+# /data_entry_web, /data_entry_web/, /data_entry_web/<path> and the POST /submit shim are
+# served by the async streaming proxy before requests reach the Flask app.
+app.add_middleware(DataEntryProxyMiddleware, position=MiddlewarePosition.BEFORE_SWAGGER,
+                   upstream=data_entry_client, flask_app=app.app, base_url=DATA_ENTRY_WEB_URL, tracer=tracer)
 
 
 if __name__ == '__main__':
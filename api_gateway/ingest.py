@@ -0,0 +1,101 @@
+"""
+Direct JSON ingest: POST /api/v1/grades and /api/v1/activities forward events straight to the
+Storage Service over the gateway's pooled client, without the form, redirect and re-render round
+trips of the Data Entry Web App.
+
+- the body is one event or an array of events; it is validated by Connexion against
+  ingest_api.yaml (the Storage Service schemas, trace_id excluded)
+- every event is stamped with the trace id of the request's trace, and the traceparent is passed
+  to storage so its spans join the trace
+- a batch is forwarded with at most ``batch_concurrency`` storage calls at a time
+- ``201``: all events stored, with one result per event
+- ``202``: with ``Prefer: respond-async`` the events are forwarded in the background
+- ``502``: some events of a batch were not stored; the per-event results say which ones to resend
+  (a single event answers with the storage status instead)
+"""
+import logging
+import threading
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+import httpx
+
+logger = logging.getLogger('basicLogger')
+
+STORAGE_PATHS = {'grade': '/store/grade', 'activity': '/store/activity'}
+
+
+class StorageIngest:
+
+    def __init__(self, storage_client, storage_url, tracer, batch_concurrency=8, background_workers=2):
+        self.storage_client = storage_client
+        self.storage_url = storage_url
+        self.tracer = tracer
+        self.executor = ThreadPoolExecutor(max_workers=batch_concurrency, thread_name_prefix='ingest')
+        # 异步请求单独的线程池：它们会等待 executor 中的任务，共用一个池可能死锁
+        self.background = ThreadPoolExecutor(max_workers=background_workers, thread_name_prefix='ingest-async')
+        self._lock = threading.Lock()
+        self.counters = {'accepted': 0, 'stored': 0, 'failed': 0, 'async_failed': 0}
+
+    def _count(self, **increments):
+        with self._lock:
+            for name, value in increments.items():
+                self.counters[name] += value
+
+    def store_event(self, event_type, event, trace_id):
+        """Sends one event to storage; returns the per-event result."""
+        payload = dict(event, trace_id=trace_id)
+        url = f"{self.storage_url}{STORAGE_PATHS[event_type]}"
+        with self.tracer.start_span('storage http', kind='client', attributes={'http.method': 'POST', 'http.url': url}) as span:
+            try:
+                response = self.storage_client.post(url, json=payload, headers=self.tracer.inject({}))
+            except httpx.RequestError as e:
+                logger.error(f"Ingest: failed to store {event_type} event: {e}")
+                return {'status': 503, 'error': 'Storage Service unavailable'}
+            span.set_attribute('http.status_code', response.status_code)
+        if response.status_code != 201:
+            logger.warning(f"Ingest: storage rejected {event_type} event ({response.status_code}): {response.text[:200]}")
+            return {'status': response.status_code, 'error': response.text[:200]}
+        return {'status': 201}
+
+    def store_events(self, event_type, events, trace_id):
+        """Stores the events concurrently (each task runs in a copy of the caller's trace context)."""
+        if len(events) == 1:
+            results = [self.store_event(event_type, events[0], trace_id)]
+        else:
+            futures = [self.executor.submit(contextvars.copy_context().run, self.store_event, event_type, event, trace_id)
+                       for event in events]
+            results = [future.result() for future in futures]
+        stored = sum(1 for result in results if result['status'] == 201)
+        self._count(stored=stored, failed=len(results) - stored)
+        return results
+
+    def _store_in_background(self, event_type, events, trace_id):
+        results = self.store_events(event_type, events, trace_id)
+        failed = sum(1 for result in results if result['status'] != 201)
+        if failed:
+            self._count(async_failed=failed)
+            logger.error(f"Ingest: {failed} of {len(events)} accepted {event_type} events (trace {trace_id}) were not stored.")
+
+    def ingest(self, event_type, body, parent=None, respond_async=False):
+        """Returns (response body, status) for a single event or a batch; ``parent`` is the caller's trace context."""
+        events = body if isinstance(body, list) else [body]
+        with self.tracer.start_span('api ingest', parent=parent, kind='server',
+                                    attributes={'event.type': event_type, 'event.count': len(events)}) as span:
+            trace_id = span.trace_id
+            self._count(accepted=len(events))
+            if respond_async:
+                self.background.submit(contextvars.copy_context().run, self._store_in_background, event_type, events, trace_id)
+                return {'trace_id': trace_id, 'accepted': len(events)}, 202
+
+            results = self.store_events(event_type, events, trace_id)
+            stored = sum(1 for result in results if result['status'] == 201)
+            status = 201 if stored == len(events) else 502
+            span.set_attribute('http.status_code', status)
+            if not isinstance(body, list):
+                return {'trace_id': trace_id, **results[0]}, results[0]['status']
+            return {'trace_id': trace_id, 'stored': stored, 'failed': len(events) - stored,
+                    'results': [{'index': index, **result} for index, result in enumerate(results)]}, status
+
+    def stats(self):
+        with self._lock:
+            return dict(self.counters)
@@ -0,0 +1,145 @@
+"""
+Server-Sent Events push of the analytics stats to open dashboards.
+
+Instead of every dashboard polling /analytics/stats, each gateway process runs one poll loop
+against the Analytics Service and fans the latest stats out to all browsers connected to
+/analytics/stream:
+
+- the loop starts with the first subscriber and stops when the last one disconnects
+- a ``stats`` event is pushed only when the stats changed; new subscribers get the latest
+  stats immediately
+- an ``unavailable`` event is pushed once when the Analytics Service cannot be reached
+- a comment line is sent every ``heartbeat_seconds`` so idle connections are not cut by proxies
+- the stats are re-serialized as compact single-line JSON, whatever formatting the Analytics
+  Service uses: an SSE ``data:`` field ends at the first newline
+
+Each subscriber keeps only the newest undelivered event, so a slow browser never makes the
+gateway buffer a backlog.
+"""
+import json
+import asyncio
+import logging
+import httpx
+from starlette.requests import Request
+from starlette.responses import JSONResponse, StreamingResponse
+import metrics
+
+logger = logging.getLogger('basicLogger')
+
+STREAM_PATH = '/analytics/stream'
+
+
+class StatsBroadcaster:
+
+    def __init__(self, upstream, stats_url, poll_interval=2, heartbeat_seconds=15, retry_ms=5000):
+        self.upstream = upstream
+        self.stats_url = stats_url
+        self.poll_interval = poll_interval
+        self.heartbeat_seconds = heartbeat_seconds
+        self.retry_ms = retry_ms
+        self.subscribers = set()
+        self.latest = None
+        self.available = True
+        self.events_sent = 0
+        self._task = None
+
+    def subscribe(self):
+        queue = asyncio.Queue(maxsize=1)
+        if self.latest is not None:
+            queue.put_nowait(('stats', self.latest))
+        self.subscribers.add(queue)
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._poll_loop())
+        return queue
+
+    def unsubscribe(self, queue):
+        self.subscribers.discard(queue)
+
+    def publish(self, event, data):
+        for queue in self.subscribers:
+            if queue.full():
+                # 只保留最新的事件
+                queue.get_nowait()
+            queue.put_nowait((event, data))
+            self.events_sent += 1
+
+    async def _poll_loop(self):
+        logger.info(f"Live stats: starting poll loop against {self.stats_url} every {self.poll_interval}s.")
+        try:
+            while self.subscribers:
+                await self._poll_once()
+                await asyncio.sleep(self.poll_interval)
+        finally:
+            logger.info("Live stats: no subscribers left, poll loop stopped.")
+
+    async def _poll_once(self):
+        try:
+            response = await self.upstream.aget(self.stats_url)
+            if response.status_code != 200:
+                raise httpx.HTTPStatusError(f"status {response.status_code}", request=response.request, response=response)
+            payload = json.dumps(response.json(), separators=(',', ':'))
+        except (httpx.HTTPError, ValueError) as e:
+            if self.available:
+                logger.error(f"Live stats: Analytics Service unavailable: {e}")
+                self.available = False
+                self.publish('unavailable', json.dumps({"message": "Service Unavailable: Analytics Service"}))
+            return
+
+        self.available = True
+        if payload != self.latest:
+            self.latest = payload
+            self.publish('stats', payload)
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+    async def stream(self, queue):
+        try:
+            yield f"retry: {self.retry_ms}\n\n"
+            while True:
+                try:
+                    event, data = await asyncio.wait_for(queue.get(), timeout=self.heartbeat_seconds)
+                except asyncio.TimeoutError:
+                    yield ": keep-alive\n\n"
+                    continue
+                # 多行数据的每一行都要有自己的 data: 前缀
+                data_lines = ''.join(f"data: {line}\n" for line in data.split('\n'))
+                yield f"event: {event}\n{data_lines}\n"
+        finally:
+            self.unsubscribe(queue)
+
+    def stats(self):
+        return {'subscribers': len(self.subscribers), 'poll_interval_seconds': self.poll_interval,
+                'upstream_available': self.available, 'events_sent': self.events_sent,
+                'polling': self._task is not None and not self._task.done()}
+
+
+class StatsStreamMiddleware:
+    """ASGI middleware serving GET /analytics/stream for logged-in users; other paths pass through."""
+
+    def __init__(self, app, broadcaster, sessions):
+        self.app = app
+        self.broadcaster = broadcaster
+        self.sessions = sessions
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http' or scope['path'] != STREAM_PATH or scope['method'] != 'GET':
+            await self.app(scope, receive, send)
+            return
+
+        request = Request(scope, receive)
+        if 'auth_token' not in self.sessions.load(request):
+            # EventSource 无法读取状态码：返回 401 后前端会回退到轮询并显示登录提示
+            response = JSONResponse({"message": "Unauthorized"}, status_code=401)
+        else:
+            queue = self.broadcaster.subscribe()
+            response = StreamingResponse(self.broadcaster.stream(queue), media_type='text/event-stream',
+                                         headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+        # 长连接：只计数，不计入延迟直方图（连接时长不是请求延迟）
+        metrics.HTTP_REQUESTS.labels(STREAM_PATH, 'GET', str(response.status_code)).inc()
+        await response(scope, receive, send)
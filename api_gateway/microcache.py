@@ -0,0 +1,111 @@
+"""
+In-process micro-cache with request coalescing for idempotent upstream GETs.
+
+Used for /analytics/stats, whose answer only changes once per processing scheduler interval:
+
+- fresh entries (younger than ``ttl``) are served without calling the upstream
+- concurrent misses for the same key are coalesced (singleflight): one request calls the
+  upstream, the others wait for its result
+- stale-while-revalidate: for ``stale_while_revalidate`` seconds after expiry the stale entry
+  is served immediately while a single background refresh runs
+- stale-if-error: if the upstream fails or returns an uncacheable response, an entry up to
+  ``stale_if_error`` seconds past expiry is served instead of the error
+
+The cache is shared by all requests of one gateway process (each pod keeps its own copy).
+"""
+import time
+import logging
+import threading
+
+logger = logging.getLogger('basicLogger')
+
+
+class _Call:
+    """One in-flight upstream load that other requests for the same key can wait on."""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class MicroCache:
+
+    def __init__(self, ttl, stale_while_revalidate=0, stale_if_error=0, cacheable=None):
+        self.ttl = ttl
+        self.stale_while_revalidate = stale_while_revalidate
+        self.stale_if_error = stale_if_error
+        self.cacheable = cacheable or (lambda value: True)
+        self._lock = threading.Lock()
+        self._entries = {}  # key -> (value, stored_at)
+        self._in_flight = {}  # key -> _Call
+        self.counters = {'hits': 0, 'misses': 0, 'coalesced': 0, 'stale_served': 0,
+                         'stale_on_error': 0, 'refreshes': 0, 'errors': 0}
+
+    def get(self, key, loader):
+        """
+        Returns (value, state, age_seconds) where state is one of HIT, MISS, COALESCED, STALE
+        or STALE-IF-ERROR. Exceptions from ``loader`` are re-raised when no stale entry can be served.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            age = time.monotonic() - entry[1] if entry else None
+            if entry and age < self.ttl:
+                self.counters['hits'] += 1
+                return entry[0], 'HIT', age
+            if entry and age < self.ttl + self.stale_while_revalidate:
+                self.counters['stale_served'] += 1
+                if key not in self._in_flight:
+                    self.counters['refreshes'] += 1
+                    call = self._in_flight[key] = _Call()
+                    threading.Thread(target=self._load, args=(key, call, loader), daemon=True).start()
+                return entry[0], 'STALE', age
+
+            call = self._in_flight.get(key)
+            leader = call is None
+            if leader:
+                self.counters['misses'] += 1
+                call = self._in_flight[key] = _Call()
+            else:
+                self.counters['coalesced'] += 1
+
+        if leader:
+            self._load(key, call, loader)
+        else:
+            call.done.wait()
+
+        if call.error is None and self.cacheable(call.value):
+            return call.value, 'MISS' if leader else 'COALESCED', 0.0
+
+        # 上游失败或返回不可缓存的响应：在 stale_if_error 窗口内返回旧值
+        with self._lock:
+            entry = self._entries.get(key)
+            age = time.monotonic() - entry[1] if entry else None
+            if entry and age < self.ttl + self.stale_if_error:
+                self.counters['stale_on_error'] += 1
+                return entry[0], 'STALE-IF-ERROR', age
+        if call.error is not None:
+            raise call.error
+        return call.value, 'MISS' if leader else 'COALESCED', 0.0
+
+    def _load(self, key, call, loader):
+        try:
+            call.value = loader()
+            if self.cacheable(call.value):
+                with self._lock:
+                    self._entries[key] = (call.value, time.monotonic())
+        except Exception as e:
+            call.error = e
+            logger.warning(f"Micro-cache load for '{key}' failed: {e}")
+        finally:
+            with self._lock:
+                if call.error is not None or not self.cacheable(call.value):
+                    self.counters['errors'] += 1
+                del self._in_flight[key]
+            call.done.set()
+
+    def stats(self):
+        with self._lock:
+            return {'ttl_seconds': self.ttl, 'stale_while_revalidate_seconds': self.stale_while_revalidate,
+                    'stale_if_error_seconds': self.stale_if_error, 'entries': len(self._entries),
+                    'in_flight': len(self._in_flight), **self.counters}
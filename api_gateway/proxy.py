@@ -0,0 +1,172 @@
+"""
+Async streaming reverse proxy for the Data Entry Web App.
+
+Runs as ASGI middleware in front of the Flask app, so proxied requests are handled on the
+event loop with the async upstream client instead of pinning a Flask worker thread for the
+whole upstream round trip. Request and response bodies are streamed chunk by chunk in both
+directions and never buffered, so memory stays flat for large bodies.
+
+Behaviour matches the former Flask proxy routes:
+- /data_entry_web, /data_entry_web/ and /data_entry_web/<path> (GET, POST) and POST /submit
+- the user must be logged in (Flask session with an auth_token), otherwise redirect to /login
+- the session token is passed upstream as a Bearer Authorization header
+- redirects to the web app's own paths are rewritten under /data_entry_web
+- hop-by-hop headers are not forwarded
+- each proxied request is recorded as a ``gateway proxy`` span whose traceparent is passed upstream
+"""
+import time
+import logging
+from urllib.parse import urljoin, urlencode
+import httpx
+from starlette.requests import Request
+from starlette.responses import PlainTextResponse, RedirectResponse, StreamingResponse
+from starlette.background import BackgroundTask
+import metrics
+import tracing
+import log_pipeline
+
+logger = logging.getLogger('basicLogger')
+request_logger = log_pipeline.request_logger()
+
+MOUNT_PATH = '/data_entry_web'
+SUBMIT_PATH = '/submit'
+ALLOWED_METHODS = ('GET', 'POST')
+REDIRECT_STATUSES = (301, 302, 303, 307, 308)
+# RFC 7230 hop-by-hop headers, only meaningful for a single connection
+HOP_BY_HOP_HEADERS = {'connection', 'keep-alive', 'proxy-authenticate', 'proxy-authorization',
+                      'te', 'trailer', 'trailers', 'transfer-encoding', 'upgrade'}
+
+
+def upstream_path(method, path):
+    """Maps a gateway path to the Data Entry Web App path, or None if the path is not proxied."""
+    if path in (MOUNT_PATH, MOUNT_PATH + '/'):
+        return ''
+    if path.startswith(MOUNT_PATH + '/'):
+        return path[len(MOUNT_PATH) + 1:]
+    # The web app's form action is hardcoded to /submit
+    if path == SUBMIT_PATH and method == 'POST':
+        return 'submit'
+    return None
+
+
+def rewrite_location(location):
+    """
+    Rewrites a redirect to one of the web app's own paths so the browser stays under /data_entry_web.
+    External URLs are returned unchanged.
+    """
+    if location == '/' or location.startswith('/?'):
+        # e.g. POST /submit -> /?status=... becomes /data_entry_web/?status=...
+        return f"{MOUNT_PATH}/{location[1:]}"
+    if location.startswith('/'):
+        return f"{MOUNT_PATH}{location}"
+    return location
+
+
+class FlaskSessionReader:
+    """Reads the signed Flask session cookie outside of a Flask request context."""
+
+    def __init__(self, flask_app):
+        self.flask_app = flask_app
+
+    def load(self, request):
+        value = request.cookies.get(self.flask_app.config['SESSION_COOKIE_NAME'])
+        serializer = self.flask_app.session_interface.get_signing_serializer(self.flask_app)
+        if not value or serializer is None:
+            return {}
+        max_age = int(self.flask_app.permanent_session_lifetime.total_seconds())
+        try:
+            return serializer.loads(value, max_age=max_age)
+        except Exception:
+            return {}
+
+
+class DataEntryProxyMiddleware:
+    """ASGI middleware that proxies the Data Entry Web App routes and passes everything else on."""
+
+    def __init__(self, app, upstream, flask_app, base_url, tracer):
+        self.app = app
+        self.upstream = upstream
+        self.sessions = FlaskSessionReader(flask_app)
+        self.base_url = base_url
+        self.tracer = tracer
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+        path = upstream_path(scope['method'], scope['path'])
+        if path is None:
+            await self.app(scope, receive, send)
+            return
+
+        started = time.perf_counter()
+        metrics.HTTP_IN_FLIGHT.inc()
+        status = 500
+        route = SUBMIT_PATH if scope['path'] == SUBMIT_PATH else MOUNT_PATH + '/<path>'
+        request = Request(scope, receive)
+        parent = tracing.parse_traceparent(request.headers.get(tracing.TRACEPARENT_HEADER))
+        try:
+            with self.tracer.start_span('gateway proxy', parent=parent, kind='server',
+                                        attributes={'http.method': scope['method'], 'http.route': route}) as span:
+                response = await self.proxy(request, path)
+                status = response.status_code
+                span.set_attribute('http.status_code', status)
+                await response(scope, receive, send)
+        finally:
+            metrics.HTTP_IN_FLIGHT.dec()
+            metrics.observe_request(route, scope['method'], status, time.perf_counter() - started)
+
+    async def proxy(self, request, path):
+        if request.method not in ALLOWED_METHODS:
+            return PlainTextResponse("Method not allowed", status_code=405)
+
+        session = self.sessions.load(request)
+        if 'auth_token' not in session:
+            logger.warning("Access denied: User not logged in. Redirecting to login.")
+            return RedirectResponse(f"/login?{urlencode({'next': str(request.url)})}", status_code=302)
+
+        # 1. Construct Target URL, preserving the original query string
+        target_url = urljoin(self.base_url, path)
+        if request.url.query:
+            target_url += '?' + request.url.query
+        request_logger.info("Proxying Data Entry Web request (%s) from %s to TARGET: %s", request.method, request.url.path, target_url)
+
+        # 2. Request Preparation: pass the token and stream the body as it arrives
+        headers = self.tracer.inject({'Authorization': f"Bearer {session['auth_token']}"})
+        # Let the web app pick the encoding and answer 304s; the raw body is passed back unchanged
+        headers['accept-encoding'] = request.headers.get('accept-encoding', 'identity')
+        if 'if-none-match' in request.headers:
+            headers['if-none-match'] = request.headers['if-none-match']
+        content = None
+        if request.method == 'POST':
+            for name in ('content-type', 'content-length'):
+                if name in request.headers:
+                    headers[name] = request.headers[name]
+            content = request.stream()
+
+        # 3. Send Request, reading only the response headers for now
+        upstream_request = self.upstream.async_client.build_request(request.method, target_url, headers=headers, content=content)
+        try:
+            response = await self.upstream.send_stream(upstream_request)
+        except httpx.RequestError as e:
+            logger.error(f"Failed to proxy request to Data Entry Web: {e}")
+            return PlainTextResponse(f"Service Unavailable: Data Entry Web is currently unreachable at {self.base_url}.", status_code=503)
+        request_logger.info("Proxy received status %d from Data Entry Web for path '%s'.", response.status_code, path)
+
+        # 4. Handle Redirects (Status 3xx) to the web app's own paths
+        location = response.headers.get('location')
+        if location and response.status_code in REDIRECT_STATUSES and location.startswith('/'):
+            await response.aclose()
+            redirect_path = rewrite_location(location)
+            request_logger.info("Internal redirect to %s detected. Correcting client redirect path to: %s", location, redirect_path)
+            return RedirectResponse(redirect_path, status_code=response.status_code)
+
+        # 5. Stream the raw (still encoded) body back, without hop-by-hop headers
+        streaming_response = StreamingResponse(response.aiter_raw(), status_code=response.status_code,
+                                               background=BackgroundTask(response.aclose))
+        streaming_response.raw_headers = [
+            (name.lower().encode('latin-1'), value.encode('latin-1'))
+            for name, value in response.headers.multi_items()
+            if name.lower() not in HOP_BY_HOP_HEADERS
+        ]
+        return streaming_response
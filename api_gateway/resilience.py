@@ -0,0 +1,176 @@
+"""
+Failure isolation for the gateway's upstream calls (used by upstreams.UpstreamClient).
+
+- CircuitBreaker: opens after ``failure_threshold`` consecutive failures (connection errors,
+  timeouts, 5xx) and rejects calls for ``open_seconds``; then lets ``half_open_probes`` calls
+  through, closing again on success and re-opening on failure.
+- AdaptiveTimeout: read timeout derived from recent successful latencies,
+  ``percentile`` x ``multiplier`` clamped to [min_timeout, max_timeout].
+- Bulkhead: caps concurrent calls per upstream; calls over the cap are rejected at once
+  instead of queueing behind a slow upstream.
+- RetryBudget: retries are allowed only while they stay below ``ratio`` of recent requests
+  (plus ``min_per_second``), so retries cannot multiply load on a struggling upstream.
+
+Everything is non-blocking and guarded by a threading lock, so the same objects serve the
+sync Flask routes and the async proxy on the event loop.
+"""
+import time
+import threading
+from collections import deque
+import httpx
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+BREAKER_STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+
+class UpstreamRejected(httpx.RequestError):
+    """Raised instead of calling the upstream when its breaker is open or its bulkhead is full."""
+
+    def __init__(self, upstream, reason):
+        super().__init__(f"Upstream '{upstream}' rejected the call: {reason}")
+        self.upstream = upstream
+        self.reason = reason
+
+
+class CircuitBreaker:
+
+    def __init__(self, failure_threshold=5, open_seconds=10, half_open_probes=1):
+        self.failure_threshold = failure_threshold
+        self.open_seconds = open_seconds
+        self.half_open_probes = half_open_probes
+        self._lock = threading.Lock()
+        self.state = CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self.probes_in_flight = 0
+        self.times_opened = 0
+        self.rejected = 0
+
+    def allow(self):
+        """Returns True if a call may go out now; reserves a probe slot when half-open."""
+        with self._lock:
+            if self.state == OPEN:
+                if time.monotonic() - self.opened_at < self.open_seconds:
+                    self.rejected += 1
+                    return False
+                self.state = HALF_OPEN
+                self.probes_in_flight = 0
+            if self.state == HALF_OPEN:
+                if self.probes_in_flight >= self.half_open_probes:
+                    self.rejected += 1
+                    return False
+                self.probes_in_flight += 1
+            return True
+
+    def record(self, success):
+        with self._lock:
+            if self.state == HALF_OPEN:
+                self.probes_in_flight = max(0, self.probes_in_flight - 1)
+            if success:
+                self.consecutive_failures = 0
+                self.state = CLOSED
+                return
+            self.consecutive_failures += 1
+            if self.state == HALF_OPEN or self.consecutive_failures >= self.failure_threshold:
+                if self.state != OPEN:
+                    self.times_opened += 1
+                self.state = OPEN
+                self.opened_at = time.monotonic()
+
+    def stats(self):
+        with self._lock:
+            return {'state': self.state, 'consecutive_failures': self.consecutive_failures,
+                    'times_opened': self.times_opened, 'rejected': self.rejected}
+
+
+class AdaptiveTimeout:
+
+    def __init__(self, min_timeout, max_timeout, percentile=99, multiplier=3, window=200, min_samples=20):
+        self.min_timeout = min_timeout
+        self.max_timeout = max_timeout
+        self.percentile = percentile
+        self.multiplier = multiplier
+        self.min_samples = min_samples
+        self._lock = threading.Lock()
+        self._samples = deque(maxlen=window)
+
+    def observe(self, seconds):
+        with self._lock:
+            self._samples.append(seconds)
+
+    def latency_percentile(self):
+        with self._lock:
+            if len(self._samples) < self.min_samples:
+                return None
+            ordered = sorted(self._samples)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * self.percentile / 100))]
+
+    def current(self):
+        """Read timeout for the next call; the configured maximum until enough samples exist."""
+        observed = self.latency_percentile()
+        if observed is None:
+            return self.max_timeout
+        return min(self.max_timeout, max(self.min_timeout, observed * self.multiplier))
+
+
+class Bulkhead:
+
+    def __init__(self, max_concurrency):
+        self.max_concurrency = max_concurrency
+        self._lock = threading.Lock()
+        self.active = 0
+        self.rejected = 0
+
+    def try_acquire(self):
+        with self._lock:
+            if self.active >= self.max_concurrency:
+                self.rejected += 1
+                return False
+            self.active += 1
+            return True
+
+    def release(self):
+        with self._lock:
+            self.active -= 1
+
+
+class RetryBudget:
+
+    def __init__(self, ratio=0.1, min_per_second=1, window_seconds=10):
+        self.ratio = ratio
+        self.min_per_second = min_per_second
+        self.window_seconds = window_seconds
+        self._lock = threading.Lock()
+        self._requests = deque()
+        self._retries = deque()
+        self.exhausted = 0
+
+    def _trim(self, now):
+        for events in (self._requests, self._retries):
+            while events and now - events[0] > self.window_seconds:
+                events.popleft()
+
+    def record_request(self):
+        with self._lock:
+            now = time.monotonic()
+            self._trim(now)
+            self._requests.append(now)
+
+    def try_retry(self):
+        with self._lock:
+            now = time.monotonic()
+            self._trim(now)
+            allowed = self.min_per_second * self.window_seconds + self.ratio * len(self._requests)
+            if len(self._retries) >= allowed:
+                self.exhausted += 1
+                return False
+            self._retries.append(now)
+            return True
+
+    def stats(self):
+        with self._lock:
+            self._trim(time.monotonic())
+            return {'requests_in_window': len(self._requests), 'retries_in_window': len(self._retries),
+                    'exhausted': self.exhausted}
@@ -0,0 +1,269 @@
+"""
+Long-lived, pooled HTTP clients for the gateway's upstream services.
+
+One client per upstream keeps connections alive between requests instead of opening a new
+TCP connection for every proxied call. Each upstream has a sync pool for the Flask routes and
+an async pool for the streaming proxy (proxy.py), which runs on the event loop.
+
+Pool limits, keep-alive expiry and timeouts come from the ``http_client`` section of
+app_conf.yml; any of these keys can be overridden per upstream in that upstream's own section
+(e.g. ``auth_service: {timeout: 5}``).
+
+HTTP/2 is optional: it needs the ``h2`` package and an upstream that negotiates HTTP/2.
+Without ``h2`` the client falls back to HTTP/1.1 keep-alive and logs a warning.
+
+Every call also goes through the upstream's bulkhead and circuit breaker, and idempotent GETs
+are retried once within a retry budget (see resilience.py). Only buffered GETs use a read
+timeout adapted to their observed latency; POSTs and streamed requests keep the configured
+``timeout``, as a write cut off early may still be applied upstream and an upload is slow by
+nature. Rejected calls raise UpstreamRejected, an httpx.RequestError, so callers answer them
+with their usual fast 503.
+"""
+import time
+import logging
+import threading
+import httpx
+import metrics
+from resilience import UpstreamRejected, CircuitBreaker, AdaptiveTimeout, Bulkhead, RetryBudget
+
+try:
+    import h2  # noqa: F401  (only needed for http2: true)
+except ImportError:
+    h2 = None
+
+logger = logging.getLogger('basicLogger')
+
+DEFAULT_SETTINGS = {
+    'max_connections': 100,
+    'max_keepalive_connections': 20,
+    'keepalive_expiry': 30,
+    'connect_timeout': 2,
+    'timeout': 10,
+    'http2': False,
+    # 熔断、自适应超时、隔舱和重试预算
+    'breaker_failure_threshold': 5,
+    'breaker_open_seconds': 10,
+    'breaker_half_open_probes': 1,
+    'adaptive_timeout': True,
+    'min_timeout': 0.5,
+    'timeout_percentile': 99,
+    'timeout_multiplier': 3,
+    'max_concurrency': 50,
+    'retry_budget_ratio': 0.1,
+    'retry_min_per_second': 1,
+}
+
+# Only failures where the upstream certainly did not process the request are retried
+RETRYABLE_ERRORS = (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout)
+RETRYABLE_STATUSES = (502, 503)
+
+
+def client_settings(defaults, upstream_conf):
+    """Merges the shared http_client settings with the per-upstream overrides."""
+    settings = dict(DEFAULT_SETTINGS)
+    settings.update({key: value for key, value in (defaults or {}).items() if key in DEFAULT_SETTINGS})
+    settings.update({key: value for key, value in (upstream_conf or {}).items() if key in DEFAULT_SETTINGS})
+    return settings
+
+
+class UpstreamClient:
+    """A pooled keep-alive client for one upstream, with request and pool utilisation counters."""
+
+    def __init__(self, name, base_url, settings):
+        self.name = name
+        self.base_url = base_url
+        self.settings = settings
+        self.timeout = httpx.Timeout(settings['timeout'], connect=settings['connect_timeout'])
+        self.limits = httpx.Limits(
+            max_connections=settings['max_connections'],
+            max_keepalive_connections=settings['max_keepalive_connections'],
+            keepalive_expiry=settings['keepalive_expiry'],
+        )
+        self.http2 = bool(settings['http2'])
+        if self.http2 and h2 is None:
+            logger.warning(f"HTTP/2 requested for upstream '{name}' but the h2 package is not installed. Using HTTP/1.1.")
+            self.http2 = False
+
+        self._open_pools()
+
+        self.breaker = CircuitBreaker(settings['breaker_failure_threshold'], settings['breaker_open_seconds'],
+                                      settings['breaker_half_open_probes'])
+        self.adaptive_timeout = AdaptiveTimeout(settings['min_timeout'], settings['timeout'],
+                                                settings['timeout_percentile'], settings['timeout_multiplier'])
+        self.bulkhead = Bulkhead(settings['max_concurrency'])
+        self.retry_budget = RetryBudget(settings['retry_budget_ratio'], settings['retry_min_per_second'])
+        self.retries_total = 0
+
+        self._lock = threading.Lock()
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self.requests_total = 0
+        self.errors_total = 0
+        self.latency_seconds_total = 0.0
+
+    def _open_pools(self):
+        self._transport = httpx.HTTPTransport(limits=self.limits, http2=self.http2)
+        self.client = httpx.Client(transport=self._transport, timeout=self.timeout)
+        self._async_transport = httpx.AsyncHTTPTransport(limits=self.limits, http2=self.http2)
+        self.async_client = httpx.AsyncClient(transport=self._async_transport, timeout=self.timeout)
+
+    def after_fork(self):
+        """Gives a forked gateway worker its own connection pools."""
+        self._open_pools()
+
+    def _admit(self):
+        """Reserves a bulkhead slot and asks the breaker; raises UpstreamRejected for a fast failure."""
+        if not self.bulkhead.try_acquire():
+            raise UpstreamRejected(self.name, f"more than {self.bulkhead.max_concurrency} concurrent calls")
+        if not self.breaker.allow():
+            self.bulkhead.release()
+            raise UpstreamRejected(self.name, "circuit breaker open")
+        self.retry_budget.record_request()
+
+    def _call_timeout(self, method):
+        if method != 'GET' or not self.settings['adaptive_timeout']:
+            return self.timeout
+        return httpx.Timeout(self.adaptive_timeout.current(), connect=self.settings['connect_timeout'])
+
+    def _begin(self):
+        with self._lock:
+            self.in_flight += 1
+            self.requests_total += 1
+            self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+        return time.perf_counter()
+
+    def _end(self, started, response, error, adaptive):
+        """
+        Records the outcome of one call: counters, breaker, the bulkhead slot and, for ``adaptive``
+        calls (buffered GETs), the latency sample of the adaptive timeout.
+        """
+        elapsed = time.perf_counter() - started
+        success = error is None and response.status_code < 500
+        with self._lock:
+            self.in_flight -= 1
+            self.latency_seconds_total += elapsed
+            if error is not None:
+                self.errors_total += 1
+        self.breaker.record(success)
+        if success and adaptive:
+            self.adaptive_timeout.observe(elapsed)
+        self.bulkhead.release()
+        outcome = 'error' if error is not None else f"{response.status_code // 100}xx"
+        metrics.UPSTREAM_LATENCY.labels(self.name, outcome).observe(elapsed)
+
+    def _should_retry(self, method, attempt, response, error):
+        if method != 'GET' or attempt > 0:
+            return False
+        if error is not None and not isinstance(error, RETRYABLE_ERRORS):
+            return False
+        if error is None and response.status_code not in RETRYABLE_STATUSES:
+            return False
+        if not self.retry_budget.try_retry():
+            logger.warning(f"Retry budget of upstream '{self.name}' exhausted. Not retrying.")
+            return False
+        with self._lock:
+            self.retries_total += 1
+        return True
+
+    def request(self, method, url, **kwargs):
+        for attempt in range(2):
+            self._admit()
+            started = self._begin()
+            response = error = None
+            try:
+                response = self.client.request(method, url, timeout=self._call_timeout(method), **kwargs)
+            except httpx.RequestError as e:
+                error = e
+            finally:
+                self._end(started, response, error, method == 'GET')
+            if not self._should_retry(method, attempt, response, error):
+                break
+        if error is not None:
+            raise error
+        return response
+
+    async def aget(self, url, **kwargs):
+        """GET on the async pool, reading the whole (small) response body."""
+        for attempt in range(2):
+            self._admit()
+            started = self._begin()
+            response = error = None
+            try:
+                response = await self.async_client.get(url, timeout=self._call_timeout('GET'), **kwargs)
+            except httpx.RequestError as e:
+                error = e
+            finally:
+                self._end(started, response, error, True)
+            if not self._should_retry('GET', attempt, response, error):
+                break
+        if error is not None:
+            raise error
+        return response
+
+    async def send_stream(self, request):
+        """
+        Sends a request built with ``async_client.build_request`` and returns once the response
+        headers arrived; the caller streams the body and must close the response.
+        Latency, breaker outcome and the bulkhead slot cover the wait for the response headers.
+        Streamed requests are never retried, as their body can only be sent once, and use the
+        configured timeout: their latency depends on the body size, not on the upstream's health.
+        """
+        self._admit()
+        request.extensions['timeout'] = self.timeout.as_dict()
+        started = self._begin()
+        response = error = None
+        try:
+            response = await self.async_client.send(request, stream=True)
+            return response
+        except httpx.RequestError as e:
+            error = e
+            raise
+        finally:
+            self._end(started, response, error, False)
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request('POST', url, **kwargs)
+
+    def pool_connections(self):
+        """Returns (open, idle) connection counts of the sync and async pools, or (None, None) if unavailable."""
+        open_connections = idle_connections = 0
+        for transport in (self._transport, self._async_transport):
+            connections = getattr(getattr(transport, '_pool', None), 'connections', None)
+            if connections is None:
+                return None, None
+            open_connections += len(connections)
+            idle_connections += sum(1 for connection in connections if connection.is_idle())
+        return open_connections, idle_connections
+
+    def stats(self):
+        open_connections, idle_connections = self.pool_connections()
+        with self._lock:
+            return {
+                'upstream': self.name,
+                'base_url': self.base_url,
+                'http2': self.http2,
+                'max_connections': self.limits.max_connections,
+                'max_keepalive_connections': self.limits.max_keepalive_connections,
+                'open_connections': open_connections,
+                'idle_connections': idle_connections,
+                'in_flight': self.in_flight,
+                'peak_in_flight': self.peak_in_flight,
+                'requests_total': self.requests_total,
+                'errors_total': self.errors_total,
+                'avg_latency_ms': round(self.latency_seconds_total / self.requests_total * 1000, 1) if self.requests_total else 0.0,
+                'retries_total': self.retries_total,
+                'breaker': self.breaker.stats(),
+                'bulkhead_active': self.bulkhead.active,
+                'bulkhead_max_concurrency': self.bulkhead.max_concurrency,
+                'bulkhead_rejected': self.bulkhead.rejected,
+                'retry_budget': self.retry_budget.stats(),
+                'read_timeout_seconds': round(self._call_timeout('GET').read, 3),
+            }
+
+    async def aclose(self):
+        self.client.close()
+        await self.async_client.aclose()
+        logger.info(f"Closed HTTP client pools for upstream '{self.name}'.")
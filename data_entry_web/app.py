@@ -1,10 +1,20 @@
-import os, logging
+import os, io, logging
+import sqlite3
 import httpx
 import time
 import uuid
 import json,yaml
-from datetime import datetime
-from flask import Flask, request, render_template_string, redirect, url_for
+from datetime import datetime, timezone
+from dateutil import parser
+from flask import Flask, request, render_template, redirect, url_for, Response, stream_with_context
+from static_pages import StaticPage
+import metrics
+import tracing
+import health
+import log_pipeline
+import bulk_upload
+from storage_client import StorageClient, client_settings
+from spool import SubmissionSpool
 
 # Initialize Flask App
 app = Flask(__name__)
@@ -17,27 +27,100 @@ except FileNotFoundError:
     print("FATAL: app_conf.yml not found. Exiting.")
     exit(1)
 
+with open("log_conf.yml", "r") as f:
+    LOG_CONFIG = yaml.safe_load(f.read())
+
+# Records are written by a background thread (log_pipeline.py), not by the request threads
+LOG_PIPELINE = log_pipeline.pipeline_from_config(LOG_CONFIG, app_config.get('logging'))
+logger = logging.getLogger('basicLogger')
+
 STORAGE_HOST = app_config['storage']['host']
 STORAGE_PORT = app_config['storage']['port']
 # --- Microservice Configuration ---
 STORAGE_SERVICE_URL = f'http://{STORAGE_HOST}:{STORAGE_PORT}' # Storage Service Base URL
 PORT = 8071 # Data Entry Web App running port
 
+# CSV/NDJSON bulk upload: rows per storage batch, batches in flight, per-row errors reported
+UPLOAD_CONF = app_config.get('bulk_upload', {})
+
+# Asynchronous submissions: spooled to local disk and sent to storage in the background
+SPOOL_CONF = app_config.get('spool', {})
+
+# Trace spans of form handling and the storage call, continuing the gateway's trace
+tracer = tracing.tracer_from_config('data_entry_web', app_config.get('tracing'))
+
+# Pooled keep-alive client for the Storage Service (http_client section, overridable under storage)
+storage = StorageClient(STORAGE_SERVICE_URL, tracer, client_settings(app_config.get('http_client'), app_config['storage']))
+
 # --- Helper Functions ---
 
-def generate_base_payload(form_data):
-    """Generates common fields required by the Storage Service API from form data and current time"""
+def date_field(form_data, name, now):
+    """reporting_date of the data (YYYY-MM-DD), today if it has none. Raises ValueError if malformed."""
+    value = form_data.get(name)
+    if value in (None, ''):
+        return now.strftime("%Y-%m-%d")
+    try:
+        return datetime.strptime(str(value).strip(), "%Y-%m-%d").strftime("%Y-%m-%d")
+    except ValueError:
+        raise ValueError(f"{name} must be a date (YYYY-MM-DD), got '{value}'.")
+
+def timestamp_field(form_data, name, now):
+    """timestamp of the data (ISO 8601), now if it has none. Raises ValueError if malformed."""
+    value = form_data.get(name)
+    if value in (None, ''):
+        return now.isoformat()
+    try:
+        timestamp = parser.isoparse(str(value).strip())
+    except ValueError:
+        raise ValueError(f"{name} must be an ISO 8601 date and time, got '{value}'.")
+    if timestamp.tzinfo is not None:
+        # storage 的 DATETIME 列不带时区：统一转换为 UTC
+        timestamp = timestamp.astimezone(timezone.utc).replace(tzinfo=None)
+    return timestamp.isoformat()
+
+def generate_base_payload(form_data, trace_id=None):
+    """
+    Generates common fields required by the Storage Service API from form data. reporting_date and
+    timestamp come from the data when present (columns of an uploaded file), otherwise the current time.
+    """
     now = datetime.now()
     return {
         "school_id": form_data.get("school_id"),
         "school_name": form_data.get("school_name", "Unspecified School"), 
-        "reporting_date": datetime.now().strftime("%Y-%m-%d"), 
+        "reporting_date": date_field(form_data, "reporting_date", now),
         "student_id": form_data.get("student_id"),
         "student_name": form_data.get("student_name"),
-        "timestamp": now.isoformat(),
-        "trace_id": str(uuid.uuid4())
+        "timestamp": timestamp_field(form_data, "timestamp", now),
+        "trace_id": trace_id or str(uuid.uuid4())
     }
 
+# Storage endpoint, text fields and numeric field of each data type
+DATA_TYPES = {
+    'grade': {'api_path': '/store/grade', 'fields': ('course', 'assignment'), 'number': 'score', 'label': 'Score'},
+    'activity': {'api_path': '/store/activity', 'fields': ('activity_type', 'activity_name'), 'number': 'hours', 'label': 'Hours'},
+}
+
+def build_payload(data_type, form_data, trace_id=None):
+    """
+    Validates one submission (a form post or an uploaded row) and returns (api_path, payload).
+    Raises ValueError with the message shown to the user.
+    """
+    spec = DATA_TYPES.get(data_type)
+    if spec is None:
+        raise ValueError(f"Invalid data type: {data_type}")
+    try:
+        number = float(form_data.get(spec['number']))
+    except (TypeError, ValueError):
+        raise ValueError(f"{spec['label']} must be a number.")
+
+    payload = generate_base_payload(form_data, trace_id)
+    payload.update({field: form_data.get(field) for field in spec['fields']})
+    payload[spec['number']] = number
+    missing = [field for field, value in payload.items() if value in (None, '')]
+    if missing:
+        raise ValueError(f"Missing field(s): {', '.join(missing)}")
+    return spec['api_path'], payload
+
 # --- HTML Template (Functional Design) ---
 
 DATA_ENTRY_HTML = """
@@ -127,6 +210,22 @@ DATA_ENTRY_HTML = """
             <input type="submit" value="Submit Activity">
         </form>
 
+        <h2>Bulk Upload</h2>
+        <p>CSV (with a header row) or NDJSON, one record per row, with the same fields as the forms.
+           A <code>data_type</code> column overrides the type selected here.</p>
+        <form id="upload-form">
+            <label for="upload_type">Data Type:</label>
+            <select id="upload_type" name="data_type">
+                <option value="grade">Grade Scores</option>
+                <option value="activity">Extracurricular Activity</option>
+            </select>
+            <label for="upload_file">File (.csv, .ndjson):</label>
+            <input type="file" id="upload_file" name="file" accept=".csv,.ndjson,.jsonl" required>
+            <input type="submit" value="Upload">
+        </form>
+        <div id="upload-status"></div>
+        <ul id="upload-errors"></ul>
+
     </div>
 
     <script>
@@ -142,6 +241,47 @@ DATA_ENTRY_HTML = """
                 activityForm.style.display = 'block';
             }
         }
+
+        // Bulk upload: posts the file and shows the NDJSON progress events as they arrive
+        document.getElementById('upload-form').addEventListener('submit', async (e) => {
+            e.preventDefault();
+            const status = document.getElementById('upload-status');
+            const errors = document.getElementById('upload-errors');
+            errors.innerHTML = '';
+            status.className = 'message';
+            status.textContent = 'Uploading...';
+            // Relative to this page, so it also works behind the gateway's /data_entry_web/ prefix
+            const base = location.href.split(/[?#]/)[0];
+            const url = new URL('upload', base.endsWith('/') ? base : base + '/');
+            const response = await fetch(url, { method: 'POST', body: new FormData(e.target) });
+            if (!response.ok) {
+                status.className = 'message error';
+                status.textContent = `Upload failed (${response.status}).`;
+                return;
+            }
+            const reader = response.body.getReader();
+            const decoder = new TextDecoder();
+            let buffered = '';
+            while (true) {
+                const { value, done } = await reader.read();
+                if (done) break;
+                buffered += decoder.decode(value, { stream: true });
+                const lines = buffered.split('\\n');
+                buffered = lines.pop();
+                for (const line of lines) {
+                    if (!line) continue;
+                    const event = JSON.parse(line);
+                    if (event.event === 'error') {
+                        const item = document.createElement('li');
+                        item.textContent = `Row ${event.row}: ${event.error}`;
+                        errors.appendChild(item);
+                    } else if (event.event === 'progress' || event.event === 'done') {
+                        status.className = 'message ' + (event.failed ? 'error' : 'success');
+                        status.textContent = `${event.event === 'done' ? 'Finished' : 'Uploading'}: ${event.rows} rows read, ${event.stored} stored, ${event.failed} rejected.`;
+                    }
+                }
+            }
+        });
     </script>
 </body>
 </html>
@@ -151,71 +291,220 @@ DATA_ENTRY_HTML = """
 
 @app.route('/', methods=['GET'])
 def data_entry_home():
-    """Renders the main data entry form page."""
+    """Renders the main data entry form page. Without a status message the pre-rendered page is served."""
     status_message = request.args.get('status')
-    return render_template_string(DATA_ENTRY_HTML, status=status_message)
+    if not status_message:
+        return DATA_ENTRY_PAGE.response()
+    return render_template(DATA_ENTRY_TEMPLATE, status=status_message)
 
 
 @app.route('/submit', methods=['POST'])
 def submit_data():
-    """Handles form submission, constructs payload, and calls Storage Service."""
-    form_data = request.form
+    """Handles form submission in a span that continues the gateway's trace (traceparent header)."""
+    parent = tracing.parse_traceparent(request.headers.get(tracing.TRACEPARENT_HEADER))
+    with tracer.start_span('submit_data', parent=parent, kind='server') as span:
+        response = handle_submission(request.form, span.trace_id)
+        span.set_attribute('http.status_code', response.status_code)
+        return response
+
+
+def handle_submission(form_data, trace_id):
+    """Constructs the payload from the form and calls the Storage Service. The trace id is stored with the event."""
     data_type = form_data.get('data_type')
     
-    # 1. Prepare base payload (common fields)
-    payload = generate_base_payload(form_data)
-    api_path = None
-    
-    # 2. Add data-type specific fields
-    if data_type == 'grade':
-        # Corrected keys to match Storage Service (course and assignment)
-        try:
-            score = float(form_data.get('score'))
-        except ValueError:
-             return redirect(url_for('data_entry_home', status="Error: Score must be a number."))
-
-        payload.update({
-            "course": form_data.get('course'),
-            "assignment": form_data.get('assignment'), 
-            "score": score
-        })
-        api_path = '/store/grade' 
+    # 1. Validate the form and prepare the payload
+    try:
+        api_path, payload = build_payload(data_type, form_data, trace_id)
+    except ValueError as e:
+        return redirect(url_for('data_entry_home', status=f"Error: {e}"))
         
-    elif data_type == 'activity':
+    # 2. Async mode: spool the payload and answer at once; the sender stores it later
+    if spool is not None:
         try:
-            hours = float(form_data.get('hours'))
-        except ValueError:
-            return redirect(url_for('data_entry_home', status="Error: Hours must be a number."))
-
-        payload.update({
-            "activity_type": form_data.get('activity_type'),
-            "activity_name": form_data.get('activity_name'),
-            "hours": hours
-        })
-        api_path = '/store/activity' 
-        
-    else:
-        return redirect(url_for('data_entry_home', status=f"Error: Invalid data type: {data_type}")) 
-        
+            spool.enqueue(api_path, payload)
+            message = f"{data_type.capitalize()} data accepted and queued for storage! Trace ID: {payload['trace_id']}"
+            return redirect(url_for('data_entry_home', status=message))
+        except sqlite3.Error as e:
+            logger.error(f"Spool unavailable, storing synchronously: {e}")
+
     # 3. Call Storage Service
     try:
-        url = f"{STORAGE_SERVICE_URL}{api_path}"
-        response = httpx.post(url, json=payload, timeout=10)
+        response = storage.post(api_path, payload)
         
         if response.status_code == 201:
             message = f"{data_type.capitalize()} data submitted successfully! Trace ID: {payload['trace_id']}"
             return redirect(url_for('data_entry_home', status=message))
         else:
-            print(f"Storage Service Error ({response.status_code}): {response.text}")
+            logger.error(f"Storage Service Error ({response.status_code}): {response.text}")
             error_details = response.text[:200]
             message = f"Storage Service failed ({response.status_code}). Details: {error_details}..."
             return redirect(url_for('data_entry_home', status=message))
             
     except httpx.RequestError as e:
-        print(f"Connection Error to Storage Service: {e}")
+        logger.error(f"Connection Error to Storage Service: {e}")
         message = "Connection Error: Storage service is unavailable. Please check the 8090 port and service status."
         return redirect(url_for('data_entry_home', status=message))
 
+
+async def store_upload_batch(api_path, payloads, parent):
+    """Stores one batch of uploaded rows (Storage Service /batch endpoint); returns None or an error message."""
+    try:
+        response = await storage.apost(f"{api_path}/batch", payloads, parent=parent)
+    except httpx.RequestError as e:
+        return f"Storage service is unavailable: {e}"
+    if response.status_code != 201:
+        return f"{response.status_code} {response.text[:200]}"
+    return None
+
+
+def submit_upload_batch(api_path, payloads):
+    """Sends one upload batch on the async storage pool; returns a Future of None or an error message."""
+    span = tracing.current_span()
+    return storage.run(store_upload_batch(api_path, payloads, span.context if span else None))
+
+
+def send_spooled_batch(api_path, payloads):
+    """
+    Sender of the submission spool: returns (status code, error text), status None if storage is unreachable.
+    Every spooled submission has its own trace id, so storage skips the rows of a resent batch it already stored.
+    """
+    try:
+        response = storage.post(f"{api_path}/batch?skip_stored=true", payloads)
+    except httpx.RequestError as e:
+        return None, str(e)
+    return response.status_code, response.text[:200]
+
+
+spool = None
+if SPOOL_CONF.get('enabled', False):
+    spool = SubmissionSpool(SPOOL_CONF.get('path', './data/spool.db'), send_spooled_batch,
+                            batch_size=SPOOL_CONF.get('batch_size', 100),
+                            poll_interval_seconds=SPOOL_CONF.get('poll_interval_seconds', 5),
+                            min_backoff_seconds=SPOOL_CONF.get('min_backoff_seconds', 1),
+                            max_backoff_seconds=SPOOL_CONF.get('max_backoff_seconds', 60),
+                            synchronous=SPOOL_CONF.get('synchronous', 'FULL'))
+
+
+# --- Health Checks ---
+# /readyz: the Storage Service is ready. With the spool, submissions are accepted while storage
+# is down, so storage is reported but not required.
+health_monitor = health.monitor_from_config(app_config.get('health'))
+
+def check_storage():
+    storage.client.get(f"{storage.base_url}/readyz", timeout=2).raise_for_status()
+
+health_monitor.add('storage_service', check_storage, required=spool is None)
+app.add_url_rule('/healthz', 'healthz', health_monitor.healthz, methods=['GET'])
+app.add_url_rule('/readyz', 'readyz', health_monitor.readyz, methods=['GET'])
+
+
+@app.route('/spool', methods=['GET'])
+def get_spool_stats():
+    """Queue depth, oldest item age and sender counters of the submission spool."""
+    if spool is None:
+        return {"enabled": False}, 200
+    return {"enabled": True, **spool.stats()}, 200
+
+
+@app.route('/upload', methods=['POST'])
+def upload_data():
+    """
+    Bulk upload of a CSV or NDJSON file (multipart field 'file', or the raw request body with a
+    text/csv or application/x-ndjson content type). Rows without a data_type column use the
+    'data_type' form/query value. Progress and per-row errors are streamed back as NDJSON.
+    """
+    upload = request.files.get('file')
+    if upload is not None:
+        stream, file_format = upload.stream, bulk_upload.detect_format(upload.filename, upload.mimetype)
+        # Flask 在视图返回时关闭 request.files，而文件要在流式响应中才读取：接管文件，由 events() 关闭
+        upload.stream = io.BytesIO()
+    else:
+        stream, file_format = request.stream, bulk_upload.detect_format(None, request.mimetype)
+    if file_format is None:
+        return {"message": "Upload a .csv or .ndjson file."}, 400
+    default_type = request.form.get('data_type') or request.args.get('data_type')
+    parent = tracing.parse_traceparent(request.headers.get(tracing.TRACEPARENT_HEADER))
+
+    def events():
+        try:
+            with tracer.start_span('upload', parent=parent, kind='server', attributes={'upload.format': file_format}) as span:
+                uploader = bulk_upload.BatchUpload(submit_upload_batch,
+                                                   batch_size=UPLOAD_CONF.get('batch_size', 500),
+                                                   concurrency=UPLOAD_CONF.get('concurrency', 4),
+                                                   max_reported_errors=UPLOAD_CONF.get('max_reported_errors', 1000))
+                yield json.dumps({'event': 'started', 'trace_id': span.trace_id}) + '\n'
+                rows = bulk_upload.iter_rows(stream, file_format)
+                for event in uploader.run(rows, lambda row: build_payload(row.get('data_type') or default_type, row, span.trace_id)):
+                    yield json.dumps(event) + '\n'
+                span.set_attribute('upload.rows', uploader.rows)
+                span.set_attribute('upload.failed', uploader.failed)
+                logger.info(f"Upload finished: {uploader.stored} rows stored, {uploader.failed} rejected (trace {span.trace_id}).")
+        finally:
+            stream.close()
+
+    return Response(stream_with_context(events()), mimetype='application/x-ndjson',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+# --- Pre-rendered Pages ---
+# The form template is compiled once; the page without a status message is also rendered once and
+# served with precomputed gzip/brotli variants, a strong ETag and Cache-Control (see static_pages.py).
+# The form is only reachable after the gateway's login, so browsers revalidate it on every visit.
+DATA_ENTRY_TEMPLATE = app.jinja_env.from_string(DATA_ENTRY_HTML)
+with app.test_request_context():
+    DATA_ENTRY_PAGE = StaticPage(render_template(DATA_ENTRY_TEMPLATE, status=None))
+
+# --- Prometheus Metrics ---
+app.add_url_rule('/metrics', 'get_prometheus_metrics', metrics.metrics_view, methods=['GET'])
+
+
+def storage_pool_gauges():
+    """Scrape-time values of the storage client pools (latency is in upstream_request_duration_seconds)."""
+    stats = storage.stats()
+    for pool, counts in stats['pools'].items():
+        for field, value in counts.items():
+            yield (pool, field), value
+        yield (pool, 'max_connections'), stats['max_connections']
+    yield ('all', 'in_flight'), stats['in_flight']
+
+
+metrics.register_gauges('data_entry_storage_pool', 'Storage Service client pools (sync: form posts and spool, async: uploads)',
+                        ['pool', 'field'], storage_pool_gauges)
+if spool is not None:
+    metrics.register_gauges('data_entry_spool', 'Submission spool backlog (rows, oldest row age in seconds)',
+                            ['field'], lambda: [((field,), value) for field, value in zip(('depth', 'oldest_age_seconds'), spool.backlog())])
+    metrics.register_gauges('data_entry_spool_rows', 'Rows enqueued, sent, retried and dead-lettered by the spool',
+                            ['event'], lambda: [((event,), count) for event, count in spool.counters.items()], kind='counter')
+metrics.register_gauges('log_records', 'Log records queued, dropped on a full queue or sampled out',
+                        ['event'], LOG_PIPELINE.counters, kind='counter')
+metrics.instrument_flask(app)
+
+# --- Multi-process Serving ---
+# gunicorn.conf.py imports this module once in the gunicorn master (config, templates and the
+# pre-rendered page), forks the workers and calls post_fork() in each of them.
+
+def post_fork():
+    """Per-worker setup after the fork: own storage pools, span export and log writer threads, spool connection and health checks."""
+    storage.after_fork()
+    tracer.after_fork()
+    LOG_PIPELINE.after_fork()
+    health_monitor.start()
+    if spool is not None:
+        spool.after_fork()
+        spool.start()
+
+
+def worker_exit():
+    """Called once a worker has drained its requests: stops the spool sender and flushes the spans."""
+    health_monitor.stop()
+    if spool is not None:
+        spool.stop()
+    tracer.shutdown()
+    storage.close()
+
+
 if __name__ == '__main__':
-    print(f"Running Data Entry Web App on port {PORT}...")
+    health_monitor.start()
+    if spool is not None:
+        spool.start()
+    logger.info(f"Running Data Entry Web App on port {PORT}...")
     app.run(host='0.0.0.0', port=PORT, debug=False)
\ No newline at end of file
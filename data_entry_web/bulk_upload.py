@@ -0,0 +1,127 @@
+"""
+Streaming bulk upload of grade and activity rows from a CSV or NDJSON file.
+
+- the file is parsed row by row from the request stream, never held in memory as a whole
+- each row is validated with the same rules as a form submission (build_payload in app.py);
+  invalid rows are reported with their line number and skipped
+- optional reporting_date (YYYY-MM-DD) and timestamp (ISO 8601) columns are stored as given;
+  rows without them are stamped with the upload time
+- valid rows are sent to storage in fixed-size batches (one per data type), with at most
+  ``concurrency`` batches in flight (on the storage client's async pool); parsing waits when
+  that many are pending, so memory stays bounded by batch_size x concurrency rows
+- progress is reported as NDJSON events while the upload runs:
+  ``{"event": "progress", ...}`` after each batch, ``{"event": "error", "row": n, ...}`` per
+  rejected row (the first ``max_reported_errors``) and a final ``{"event": "done", ...}``
+"""
+import io
+import csv
+import json
+from collections import deque
+
+FORMATS = {'.csv': 'csv', '.ndjson': 'ndjson', '.jsonl': 'ndjson',
+           'text/csv': 'csv', 'application/x-ndjson': 'ndjson', 'application/jsonl': 'ndjson'}
+
+
+def detect_format(filename, mimetype):
+    """Returns 'csv' or 'ndjson' from the file extension or the content type, or None."""
+    for extension in ('.csv', '.ndjson', '.jsonl'):
+        if filename and filename.lower().endswith(extension):
+            return FORMATS[extension]
+    return FORMATS.get(mimetype)
+
+
+def iter_rows(stream, file_format):
+    """Yields (line number, row dict or None, error message or None) for every row of the stream."""
+    if not hasattr(stream, 'read1'):
+        stream = io.BufferedReader(stream)
+    text = io.TextIOWrapper(stream, encoding='utf-8-sig', newline='')
+    if file_format == 'csv':
+        reader = csv.DictReader(text)
+        for row in reader:
+            yield reader.line_num, row, None
+        return
+
+    for line_number, line in enumerate(text, start=1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except json.JSONDecodeError as e:
+            yield line_number, None, f"Invalid JSON: {e.msg}"
+            continue
+        if not isinstance(row, dict):
+            yield line_number, None, "Each line must be a JSON object."
+            continue
+        yield line_number, row, None
+
+
+class BatchUpload:
+
+    def __init__(self, submit_batch, batch_size=500, concurrency=4, max_reported_errors=1000):
+        """``submit_batch(api_path, payloads)`` starts storing one batch; returns a Future of None or an error message."""
+        self.submit_batch = submit_batch
+        self.batch_size = batch_size
+        self.concurrency = concurrency
+        self.max_reported_errors = max_reported_errors
+        self.rows = 0
+        self.stored = 0
+        self.failed = 0
+
+    def _progress(self):
+        return {'event': 'progress', 'rows': self.rows, 'stored': self.stored, 'failed': self.failed}
+
+    def _error(self, line_number, message):
+        self.failed += 1
+        if self.failed <= self.max_reported_errors:
+            return {'event': 'error', 'row': line_number, 'error': message}
+        return None
+
+    def _finish(self, future, line_numbers):
+        """Collects one batch result; yields the error events of a failed batch and a progress event."""
+        error = future.result()
+        if error is None:
+            self.stored += len(line_numbers)
+        else:
+            for line_number in line_numbers:
+                event = self._error(line_number, f"Storage rejected the batch: {error}")
+                if event:
+                    yield event
+        yield self._progress()
+
+    def run(self, rows, build_payload):
+        """Validates and sends the rows; yields progress events. ``build_payload(row)`` returns (api_path, payload)."""
+        batches = {}
+        pending = deque()
+
+        def submit(api_path):
+            payloads, line_numbers = batches.pop(api_path)
+            pending.append((self.submit_batch(api_path, payloads), line_numbers))
+
+        for line_number, row, error in rows:
+            self.rows += 1
+            if error is None:
+                try:
+                    api_path, payload = build_payload(row)
+                except ValueError as e:
+                    error = str(e)
+            if error is not None:
+                event = self._error(line_number, error)
+                if event:
+                    yield event
+                continue
+
+            payloads, line_numbers = batches.setdefault(api_path, ([], []))
+            payloads.append(payload)
+            line_numbers.append(line_number)
+            if len(payloads) >= self.batch_size:
+                submit(api_path)
+            # 达到并发上限时先等待最早的批次完成，再继续解析
+            while len(pending) >= self.concurrency:
+                yield from self._finish(*pending.popleft())
+
+        for api_path in list(batches):
+            submit(api_path)
+        while pending:
+            yield from self._finish(*pending.popleft())
+
+        yield {'event': 'done', 'rows': self.rows, 'stored': self.stored, 'failed': self.failed}
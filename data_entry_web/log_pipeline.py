@@ -0,0 +1,184 @@
+"""
+Non-blocking logging: request threads and the event loop only put records on a queue, a
+background thread formats them and writes them to the configured handlers (console, app.log).
+
+- ``pipeline_from_config`` applies log_conf.yml as before, then moves the handlers of the root
+  logger and of every logger configured with handlers behind one bounded queue; when the queue
+  is full records are dropped and counted instead of blocking the request
+- formatting is lazy: records are queued with their ``%`` arguments and the message is built on
+  the background thread (records whose arguments could still change, or with a traceback, are
+  formatted before they are queued). Use ``logger.debug("... %s", value)``, not f-strings, so
+  that nothing is formatted when the level is disabled
+- per-request logs go to ``basicLogger.requests`` (``request_logger()``): every record is kept up
+  to ``request_burst_per_second``, above that only ``request_sample_ratio`` of them
+- threads do not survive fork: call ``after_fork()`` in each worker process
+"""
+import time
+import queue
+import atexit
+import random
+import logging
+import logging.config
+import logging.handlers
+
+REQUEST_LOGGER = 'basicLogger.requests'
+
+DEFAULT_SETTINGS = {
+    'enabled': True,
+    'max_queue': 10000,
+    'request_burst_per_second': 50,
+    'request_sample_ratio': 0.1,
+}
+
+_IMMUTABLE_ARGS = (str, int, float, bool, type(None))
+
+
+def request_logger():
+    return logging.getLogger(REQUEST_LOGGER)
+
+
+class RequestSampler(logging.Filter):
+    """Passes every record up to ``burst_per_second``, then ``sample_ratio`` of the rest of that second."""
+
+    def __init__(self, burst_per_second, sample_ratio):
+        super().__init__()
+        self.burst_per_second = burst_per_second
+        self.sample_ratio = sample_ratio
+        self.window = 0
+        self.count = 0
+        self.sampled_out = 0
+
+    def filter(self, record):
+        # 计数不加锁：多线程下只是近似值
+        second = int(time.monotonic())
+        if second != self.window:
+            self.window, self.count = second, 0
+        self.count += 1
+        if self.count <= self.burst_per_second or random.random() < self.sample_ratio:
+            return True
+        self.sampled_out += 1
+        return False
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """Queues records for the listener thread; drops them when the queue is full."""
+
+    def __init__(self, log_queue, route):
+        super().__init__(log_queue)
+        self.route = route
+        self.queued = 0
+        self.dropped = 0
+
+    def prepare(self, record):
+        # 异常信息（引用栈帧）和可变参数（包括单个 dict 参数本身）在调用线程中格式化
+        if record.exc_info or (record.args and not (isinstance(record.args, tuple) and
+                                                    all(isinstance(arg, _IMMUTABLE_ARGS) for arg in record.args))):
+            record.msg = record.getMessage()
+            record.args = None
+            if record.exc_info:
+                record.exc_text = logging.Formatter().formatException(record.exc_info)
+                record.exc_info = None
+        record.log_route = self.route
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+            self.queued += 1
+        except queue.Full:
+            self.dropped += 1
+
+
+class RoutingQueueListener(logging.handlers.QueueListener):
+    """One listener thread for all loggers: each record goes to the handlers of the logger that queued it."""
+
+    def __init__(self, log_queue, routes):
+        super().__init__(log_queue, respect_handler_level=True)
+        self.routes = routes
+
+    def handle(self, record):
+        for handler in self.routes[record.log_route]:
+            if record.levelno >= handler.level:
+                handler.handle(record)
+
+    def enqueue_sentinel(self):
+        self.queue.put(self._sentinel, timeout=5)
+
+
+class LogPipeline:
+
+    def __init__(self, max_queue=10000):
+        self.max_queue = max_queue
+        self.routes = {}
+        self.queue_handlers = []
+        self.sampler = None
+        self._listener = None
+
+    def install(self, logger):
+        """Replaces the logger's handlers by a queue handler; the listener thread writes to them."""
+        if not logger.handlers:
+            return
+        route = logger.name
+        self.routes[route] = list(logger.handlers)
+        queue_handler = DroppingQueueHandler(None, route)
+        for handler in self.routes[route]:
+            logger.removeHandler(handler)
+        logger.addHandler(queue_handler)
+        self.queue_handlers.append(queue_handler)
+
+    def start(self):
+        log_queue = queue.Queue(maxsize=self.max_queue)
+        for queue_handler in self.queue_handlers:
+            queue_handler.queue = log_queue
+        self._listener = RoutingQueueListener(log_queue, self.routes)
+        self._listener.start()
+
+    def after_fork(self):
+        """Gives a forked worker its own queue and listener thread."""
+        if self._listener is not None:
+            self.start()
+
+    def stop(self):
+        """Writes the records still queued (called at exit)."""
+        if self._listener is not None and self._listener._thread is not None:
+            try:
+                self._listener.stop()
+            except queue.Full:
+                pass
+
+    def counters(self):
+        """Yields (event,), count for the metrics: queued, dropped (queue full), sampled_out."""
+        yield ('queued',), sum(queue_handler.queued for queue_handler in self.queue_handlers)
+        yield ('dropped',), sum(queue_handler.dropped for queue_handler in self.queue_handlers)
+        yield ('sampled_out',), self.sampler.sampled_out if self.sampler else 0
+
+    def stats(self):
+        counts = {event: count for (event,), count in self.counters()}
+        counts['queue_depth'] = self._listener.queue.qsize() if self._listener else 0
+        return counts
+
+
+def pipeline_from_config(log_config, conf=None):
+    """
+    Configures logging from the parsed log_conf.yml (``None``: basicConfig at INFO) and the
+    ``logging`` section of app_conf.yml. Returns the started LogPipeline.
+    """
+    settings = dict(DEFAULT_SETTINGS)
+    settings.update({key: value for key, value in (conf or {}).items() if key in DEFAULT_SETTINGS})
+    if log_config is None:
+        logging.basicConfig(level=logging.INFO)
+    else:
+        logging.config.dictConfig(log_config)
+
+    pipeline = LogPipeline(settings['max_queue'])
+    pipeline.sampler = RequestSampler(settings['request_burst_per_second'], settings['request_sample_ratio'])
+    request_logger().addFilter(pipeline.sampler)
+    if not settings['enabled']:
+        return pipeline
+
+    pipeline.install(logging.getLogger())
+    for name in (log_config or {}).get('loggers', {}):
+        pipeline.install(logging.getLogger(name))
+    pipeline.start()
+    atexit.register(pipeline.stop)
+    return pipeline
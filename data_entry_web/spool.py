@@ -0,0 +1,231 @@
+"""
+Durable local spool for asynchronous form submissions.
+
+- a validated payload is appended to a SQLite queue (WAL journal) and the user is answered at once;
+  the row is on disk before the answer is sent, so a crash or restart does not lose it
+- a background sender drains the queue oldest first, in batches of ``batch_size`` per storage
+  endpoint (the Storage Service /batch endpoints), and deletes the rows storage accepted
+- storage unreachable, 5xx, 408 or 429: the rows stay queued and the sender backs off
+  exponentially (``min_backoff_seconds`` doubling up to ``max_backoff_seconds``, with jitter)
+- any other 4xx: the batch is resent one row at a time so that a single bad row does not hold
+  back the others; rows storage still rejects are moved to the ``dead_letters`` table
+- rows left in the queue by a previous run are sent as soon as the sender starts
+- delivery is at-least-once: a batch storage stored but whose answer was lost is sent again, so
+  the sender passes ``skip_stored`` and storage leaves out the rows whose trace_id it already has
+- with several worker processes on one spool file, every worker enqueues but only the one
+  holding the sender lock (``<path>.sender.lock``) sends; another takes over if it exits
+"""
+import os
+import fcntl
+import json
+import time
+import random
+import sqlite3
+import logging
+import threading
+
+logger = logging.getLogger('basicLogger')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS spool (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    api_path TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    enqueued_at REAL NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS dead_letters (
+    id INTEGER PRIMARY KEY,
+    api_path TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    enqueued_at REAL NOT NULL,
+    failed_at REAL NOT NULL,
+    error TEXT
+);
+"""
+
+RETRYABLE_STATUS = (408, 429)
+
+
+class SubmissionSpool:
+
+    def __init__(self, path, send_batch, batch_size=100, poll_interval_seconds=5,
+                 min_backoff_seconds=1, max_backoff_seconds=60, synchronous='FULL'):
+        """
+        ``send_batch(api_path, payloads)`` stores a batch and returns (status code, error text);
+        the status is None when storage could not be reached.
+        """
+        self.path = path
+        self.send_batch = send_batch
+        self.batch_size = batch_size
+        self.poll_interval_seconds = poll_interval_seconds
+        self.min_backoff_seconds = min_backoff_seconds
+        self.max_backoff_seconds = max_backoff_seconds
+        self.synchronous = synchronous
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self._open()
+        self._sender_lock = None
+        self.counters = {'enqueued': 0, 'sent': 0, 'retried': 0, 'dead_lettered': 0}
+        self.consecutive_failures = 0
+        self.last_error = None
+
+    def _open(self):
+        # 一个连接由请求线程和发送线程共用，用锁串行化
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        # FULL: 每次提交都 fsync；NORMAL: 只在 checkpoint 时 fsync（进程崩溃不丢，断电可能丢最后几条）
+        self._db.execute(f'PRAGMA synchronous={self.synchronous}')
+        self._db.executescript(SCHEMA)
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def after_fork(self):
+        """Reopens the database in a forked worker: SQLite connections must not cross a fork."""
+        self._open()
+        self._sender_lock = None
+
+    def _is_sender(self):
+        """Takes the sender lock if it is free; True while this process holds it."""
+        if self._sender_lock is None:
+            lock_file = open(f"{self.path}.sender.lock", 'a')
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                lock_file.close()
+                return False
+            self._sender_lock = lock_file
+        return True
+
+    def enqueue(self, api_path, payload):
+        """Appends one payload to the spool; returns once it is committed."""
+        with self._lock:
+            self._db.execute('INSERT INTO spool (api_path, payload, enqueued_at) VALUES (?, ?, ?)',
+                             (api_path, json.dumps(payload), time.time()))
+            self.counters['enqueued'] += 1
+        self._wake.set()
+
+    def _next_batches(self):
+        """Oldest ``batch_size`` rows, grouped by storage endpoint: {api_path: [(id, payload), ...]}."""
+        with self._lock:
+            rows = self._db.execute('SELECT id, api_path, payload FROM spool ORDER BY id LIMIT ?',
+                                    (self.batch_size,)).fetchall()
+        batches = {}
+        for row_id, api_path, payload in rows:
+            batches.setdefault(api_path, []).append((row_id, json.loads(payload)))
+        return batches
+
+    def _delete(self, ids):
+        with self._lock:
+            self._db.execute('BEGIN')
+            self._db.executemany('DELETE FROM spool WHERE id = ?', [(row_id,) for row_id in ids])
+            self._db.execute('COMMIT')
+            self.counters['sent'] += len(ids)
+
+    def _dead_letter(self, row_id, error):
+        with self._lock:
+            self._db.execute('BEGIN')
+            self._db.execute('INSERT INTO dead_letters (id, api_path, payload, enqueued_at, failed_at, error) '
+                             'SELECT id, api_path, payload, enqueued_at, ?, ? FROM spool WHERE id = ?',
+                             (time.time(), error, row_id))
+            self._db.execute('DELETE FROM spool WHERE id = ?', (row_id,))
+            self._db.execute('COMMIT')
+            self.counters['dead_lettered'] += 1
+        logger.error(f"Spool: storage rejected spooled row {row_id}, moved to dead_letters: {error}")
+
+    def _mark_attempt(self, ids, error):
+        with self._lock:
+            self._db.execute('BEGIN')
+            self._db.executemany('UPDATE spool SET attempts = attempts + 1 WHERE id = ?', [(row_id,) for row_id in ids])
+            self._db.execute('COMMIT')
+            self.counters['retried'] += len(ids)
+        self.last_error = error
+
+    @staticmethod
+    def _retryable(status):
+        return status is None or status >= 500 or status in RETRYABLE_STATUS
+
+    def drain_once(self):
+        """Sends one round of batches; returns the number of rows taken off the spool, or None if storage failed."""
+        done = 0
+        for api_path, rows in self._next_batches().items():
+            ids = [row_id for row_id, _ in rows]
+            status, error = self.send_batch(api_path, [payload for _, payload in rows])
+            if status == 201:
+                self._delete(ids)
+                done += len(ids)
+                continue
+            if self._retryable(status):
+                self._mark_attempt(ids, f"{status or 'unreachable'}: {error}")
+                return None
+
+            # 批次被拒绝（4xx）：逐条重发，找出真正有问题的行
+            for row_id, payload in rows:
+                status, error = self.send_batch(api_path, [payload])
+                if status == 201:
+                    self._delete([row_id])
+                    done += 1
+                elif self._retryable(status):
+                    self._mark_attempt([row_id], f"{status or 'unreachable'}: {error}")
+                    return None
+                else:
+                    self._dead_letter(row_id, f"{status}: {error}")
+                    done += 1
+        return done
+
+    def _backoff(self):
+        delay = min(self.max_backoff_seconds, self.min_backoff_seconds * 2 ** (self.consecutive_failures - 1))
+        return delay * random.uniform(0.5, 1.0)
+
+    def _run(self):
+        while not self._is_sender():
+            if self._stop.wait(self.poll_interval_seconds):
+                return
+        depth, _ = self.backlog()
+        if depth:
+            logger.info(f"Spool: replaying {depth} submissions left from the previous run.")
+        while not self._stop.is_set():
+            self._wake.clear()
+            try:
+                done = self.drain_once()
+            except Exception as e:
+                logger.exception(f"Spool: sender failed: {e}")
+                self.last_error = str(e)
+                done = None
+            if done is None:
+                self.consecutive_failures += 1
+                delay = self._backoff()
+                logger.warning(f"Spool: storage unavailable ({self.last_error}), retrying in {delay:.1f}s.")
+                self._stop.wait(delay)
+            elif done:
+                self.consecutive_failures = 0
+            else:
+                # 队列为空：等待新的提交或下一次轮询
+                self.consecutive_failures = 0
+                self._wake.wait(self.poll_interval_seconds)
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='spool-sender', daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout=5):
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def backlog(self):
+        """Returns (queued rows, age in seconds of the oldest one or 0)."""
+        with self._lock:
+            depth, oldest = self._db.execute('SELECT COUNT(*), MIN(enqueued_at) FROM spool').fetchone()
+        return depth, time.time() - oldest if oldest else 0.0
+
+    def stats(self):
+        depth, oldest_age = self.backlog()
+        with self._lock:
+            dead_letters = self._db.execute('SELECT COUNT(*) FROM dead_letters').fetchone()[0]
+            counters = dict(self.counters)
+        return {'depth': depth, 'oldest_age_seconds': round(oldest_age, 3), 'dead_letters': dead_letters,
+                'consecutive_failures': self.consecutive_failures, 'last_error': self.last_error, **counters}
@@ -0,0 +1,171 @@
+"""
+Shared, pooled HTTP client for the Storage Service.
+
+One long-lived client keeps connections to storage alive between submissions instead of
+opening (and leaving in TIME_WAIT) a new TCP connection for every form post.
+
+- a sync pool serves the Flask request threads (form submissions) and the spool sender
+- an async pool serves the bulk upload batches: they run as coroutines on an event loop thread
+  owned by the client (started on first use), so an upload needs no thread per batch in flight
+- pool limits, keep-alive expiry and timeouts come from the ``http_client`` section of
+  app_conf.yml; any key can be overridden in the ``storage`` section
+- HTTP/2 is optional: it needs the ``h2`` package and a storage server that negotiates it;
+  without ``h2`` the client falls back to HTTP/1.1 keep-alive and logs a warning
+- every call is a 'storage http' span and is recorded in the upstream latency histogram
+"""
+import time
+import asyncio
+import logging
+import threading
+import httpx
+import metrics
+
+try:
+    import h2  # noqa: F401  (only needed for http2: true)
+except ImportError:
+    h2 = None
+
+logger = logging.getLogger('basicLogger')
+
+DEFAULT_SETTINGS = {
+    'max_connections': 20,
+    'max_keepalive_connections': 10,
+    'keepalive_expiry': 30,
+    'connect_timeout': 2,
+    'timeout': 10,
+    'http2': False,
+}
+
+
+def client_settings(defaults, storage_conf):
+    """Merges the http_client settings with the overrides of the storage section."""
+    settings = dict(DEFAULT_SETTINGS)
+    settings.update({key: value for key, value in (defaults or {}).items() if key in DEFAULT_SETTINGS})
+    settings.update({key: value for key, value in (storage_conf or {}).items() if key in DEFAULT_SETTINGS})
+    return settings
+
+
+class StorageClient:
+
+    def __init__(self, base_url, tracer, settings):
+        self.base_url = base_url
+        self.tracer = tracer
+        self.settings = settings
+        self.timeout = httpx.Timeout(settings['timeout'], connect=settings['connect_timeout'])
+        self.limits = httpx.Limits(
+            max_connections=settings['max_connections'],
+            max_keepalive_connections=settings['max_keepalive_connections'],
+            keepalive_expiry=settings['keepalive_expiry'],
+        )
+        self.http2 = bool(settings['http2'])
+        if self.http2 and h2 is None:
+            logger.warning("HTTP/2 requested for the Storage Service but the h2 package is not installed. Using HTTP/1.1.")
+            self.http2 = False
+
+        self._open_pools()
+        self._lock = threading.Lock()
+        self.in_flight = 0
+        self.requests_total = 0
+        self.errors_total = 0
+
+    def _open_pools(self):
+        self._transport = httpx.HTTPTransport(limits=self.limits, http2=self.http2)
+        self.client = httpx.Client(transport=self._transport, timeout=self.timeout)
+        self._async_transport = httpx.AsyncHTTPTransport(limits=self.limits, http2=self.http2)
+        self.async_client = httpx.AsyncClient(transport=self._async_transport, timeout=self.timeout)
+        self._loop = None
+        self._loop_lock = threading.Lock()
+
+    def after_fork(self):
+        """Gives a forked worker its own pools; connections and the loop thread are not shared across processes."""
+        self._open_pools()
+        self._lock = threading.Lock()
+        self.in_flight = 0
+
+    def _begin(self):
+        with self._lock:
+            self.in_flight += 1
+            self.requests_total += 1
+        return time.perf_counter()
+
+    def _end(self, started, response, span):
+        with self._lock:
+            self.in_flight -= 1
+            if response is None:
+                self.errors_total += 1
+        if response is not None:
+            span.set_attribute('http.status_code', response.status_code)
+        outcome = 'error' if response is None else f"{response.status_code // 100}xx"
+        metrics.UPSTREAM_LATENCY.labels('storage', outcome).observe(time.perf_counter() - started)
+
+    def post(self, api_path, json_body):
+        """POSTs on the sync pool in a 'storage http' span. Raises httpx.RequestError if storage is unreachable."""
+        url = f"{self.base_url}{api_path}"
+        with self.tracer.start_span('storage http', kind='client', attributes={'http.method': 'POST', 'http.url': url}) as span:
+            started = self._begin()
+            response = None
+            try:
+                response = self.client.post(url, json=json_body, headers=self.tracer.inject({}))
+                return response
+            finally:
+                self._end(started, response, span)
+
+    async def apost(self, api_path, json_body, parent=None):
+        """
+        POSTs on the async pool. ``parent`` is the caller's span context: coroutines scheduled with
+        run() do not see the calling thread's current span.
+        """
+        url = f"{self.base_url}{api_path}"
+        with self.tracer.start_span('storage http', parent=parent, kind='client',
+                                    attributes={'http.method': 'POST', 'http.url': url}) as span:
+            started = self._begin()
+            response = None
+            try:
+                response = await self.async_client.post(url, json=json_body, headers=self.tracer.inject({}))
+                return response
+            finally:
+                self._end(started, response, span)
+
+    def _event_loop(self):
+        # 首次使用时才启动事件循环线程（预加载时不会在 fork 之前创建线程）
+        with self._loop_lock:
+            if self._loop is None:
+                loop = asyncio.new_event_loop()
+                threading.Thread(target=loop.run_forever, name='storage-client-loop', daemon=True).start()
+                self._loop = loop
+        return self._loop
+
+    def run(self, coroutine):
+        """Schedules a coroutine on the client's event loop; returns a concurrent.futures.Future."""
+        return asyncio.run_coroutine_threadsafe(coroutine, self._event_loop())
+
+    def pool_connections(self, transport):
+        """Returns (open, idle) connection counts of one pool, or (None, None) if unavailable."""
+        connections = getattr(getattr(transport, '_pool', None), 'connections', None)
+        if connections is None:
+            return None, None
+        return len(connections), sum(1 for connection in connections if connection.is_idle())
+
+    def stats(self):
+        pools = {}
+        for name, transport in (('sync', self._transport), ('async', self._async_transport)):
+            open_connections, idle_connections = self.pool_connections(transport)
+            pools[name] = {'open_connections': open_connections, 'idle_connections': idle_connections}
+        with self._lock:
+            return {
+                'base_url': self.base_url,
+                'http2': self.http2,
+                'max_connections': self.limits.max_connections,
+                'max_keepalive_connections': self.limits.max_keepalive_connections,
+                'pools': pools,
+                'in_flight': self.in_flight,
+                'requests_total': self.requests_total,
+                'errors_total': self.errors_total,
+            }
+
+    def close(self):
+        self.client.close()
+        if self._loop is not None:
+            self.run(self.async_client.aclose()).result(timeout=5)
+            self._loop.call_soon_threadsafe(self._loop.stop)
+        logger.info("Closed the Storage Service connection pools.")
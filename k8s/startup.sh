@@ -1,6 +1,6 @@
 #!/bin/bash
 set -e
-list=("mongodb.yml" "mysql.yml" "storage.yml" "processing.yml" "auth-service.yml" "data_entry_web.yml" "api-gateway.yml")
+list=("mongodb.yml" "mysql.yml" "storage-schema-job.yml" "storage-archive.yml" "storage.yml" "processing.yml" "auth-service.yml" "data_entry_web.yml" "api-gateway.yml")
 for file in "${list[@]}";
 do
     echo "start applying $file ..."
@@ -0,0 +1,221 @@
+"""
+Mergeable partial aggregates for the processing stats.
+
+A partial summarises any slice of events (one scheduler tick, one backfill shard, ...) and
+two partials can be merged without looking at the raw rows again. The stats document stored
+in MongoDB is built from one partial per event type.
+
+Values are aggregated column-wise: fetched chunks are decoded into a float64 array and count,
+sum, min, max, moments and histogram bins are computed in one vectorized pass per chunk.
+NumPy is used when installed, otherwise a single-loop fallback over ``array('d')``.
+
+Spread is tracked as online moments (count, mean, M2): a chunk's M2 is summed around its own
+mean, and partials are combined with Chan's parallel merge, so the variance stays numerically
+stable and never needs a second pass over history. Histograms use fixed bins and merge by
+adding counts.
+"""
+import math
+from array import array
+from itertools import chain
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+INF = float('inf')
+
+# event type -> MySQL table / value column
+TABLE_NAMES = {
+    'grade': 'grades',
+    'activity': 'activities'
+}
+VALUE_COLUMNS = {
+    'grade': 'score',
+    'activity': 'hours'
+}
+
+# event type -> stats document field for each aggregate
+STATS_FIELDS = {
+    'grade': {
+        'count': 'num_grade_readings',
+        'sum': 'sum_grade_readings',
+        'min': 'min_grade_readings',
+        'max': 'max_grade_readings',
+        'avg': 'avg_grade_readings',
+        'var': 'var_grade_readings',
+        'std': 'std_grade_readings',
+        'moments': 'grade_moments',
+        'hist': 'grade_histogram',
+    },
+    'activity': {
+        'count': 'num_activity_readings',
+        'sum': 'sum_activity_hours',
+        'min': 'min_activity_hours',
+        'max': 'max_activity_hours',
+        'avg': 'avg_activity_hours',
+        'var': 'var_activity_hours',
+        'std': 'std_activity_hours',
+        'moments': 'activity_moments',
+        'hist': 'activity_histogram',
+    },
+}
+
+
+# event type -> fixed histogram bins (low, high, number of bins); out-of-range values land in the edge bins
+HISTOGRAMS = {
+    'grade': (0.0, 100.0, 10),  # score: 10 bins of 10 points, 100 counts in the last bin
+    'activity': (0.0, 40.0, 8),  # hours: 8 bins of 5 hours, 40+ hours counts in the last bin
+}
+
+
+def histogram_edges(event_type):
+    low, high, bins = HISTOGRAMS[event_type]
+    width = (high - low) / bins
+    return [low + i * width for i in range(bins + 1)]
+
+
+def empty_moments():
+    return {"count": 0, "mean": 0.0, "m2": 0.0}
+
+
+def empty_partial(event_type):
+    """Partial aggregate of zero events. min/max start at inf/-inf so the first merge is correct."""
+    return {"count": 0, "sum": 0.0, "min": INF, "max": -INF,
+            "moments": empty_moments(), "hist": [0] * HISTOGRAMS[event_type][2]}
+
+
+def column_array(rows):
+    """
+    Decodes fetched single-column rows (tuples from a plain cursor) into a float64 array, dropping NULLs.
+    """
+    if np is not None:
+        # NULL 被解码为 NaN，随后一次性过滤
+        values = np.fromiter(chain.from_iterable(rows), dtype=np.float64, count=len(rows))
+        return values[~np.isnan(values)]
+    return array('d', (row[0] for row in rows if row[0] is not None))
+
+
+def aggregate_values(values, event_type):
+    """Aggregates a chunk of numeric values (ndarray, array('d') or list) into a partial."""
+    partial = empty_partial(event_type)
+    if len(values) == 0:
+        return partial
+
+    low, high, bins = HISTOGRAMS[event_type]
+    scale = bins / (high - low)
+
+    if np is not None:
+        values = np.asarray(values, dtype=np.float64)
+        bin_index = ((values - low) * scale).astype(np.intp)
+        np.clip(bin_index, 0, bins - 1, out=bin_index)
+        total = float(values.sum())
+        mean = total / values.size
+        deviations = values - mean
+        partial["count"] = int(values.size)
+        partial["sum"] = total
+        partial["min"] = float(values.min())
+        partial["max"] = float(values.max())
+        partial["moments"] = {"count": int(values.size), "mean": mean, "m2": float(np.dot(deviations, deviations))}
+        partial["hist"] = np.bincount(bin_index, minlength=bins).tolist()
+        return partial
+
+    # 纯 Python 回退：一次循环同时计算所有聚合值 (Welford 在线算法计算均值和 M2)
+    total = mean = m2 = 0.0
+    lowest, highest = INF, -INF
+    hist = partial["hist"]
+    for count, value in enumerate(values, 1):
+        total += value
+        delta = value - mean
+        mean += delta / count
+        m2 += delta * (value - mean)
+        if value < lowest:
+            lowest = value
+        if value > highest:
+            highest = value
+        hist[min(max(int((value - low) * scale), 0), bins - 1)] += 1
+    partial.update({"count": len(values), "sum": total, "min": lowest, "max": highest,
+                    "moments": {"count": len(values), "mean": mean, "m2": m2}})
+    return partial
+
+
+def merge_moments(a, b):
+    """Chan et al. parallel merge of two (count, mean, M2) moments."""
+    if a["count"] == 0:
+        return dict(b)
+    if b["count"] == 0:
+        return dict(a)
+    count = a["count"] + b["count"]
+    delta = b["mean"] - a["mean"]
+    return {
+        "count": count,
+        "mean": a["mean"] + delta * b["count"] / count,
+        "m2": a["m2"] + b["m2"] + delta * delta * a["count"] * b["count"] / count,
+    }
+
+
+def merge_partials(a, b):
+    """Merges two partials into a new one; the order of arguments does not matter."""
+    return {
+        "count": a["count"] + b["count"],
+        "sum": a["sum"] + b["sum"],
+        "min": min(a["min"], b["min"]),
+        "max": max(a["max"], b["max"]),
+        "moments": merge_moments(a["moments"], b["moments"]),
+        "hist": [x + y for x, y in zip(a["hist"], b["hist"])],
+    }
+
+
+def partial_from_stats(stats, event_type):
+    """
+    Rebuilds the running partial of one event type from a stored stats document.
+
+    Documents written before moments/histograms existed have none stored; those start empty and
+    only cover events processed from then on (run backfill.py to recompute them over all history).
+    """
+    fields = STATS_FIELDS[event_type]
+    partial = empty_partial(event_type)
+    count = stats.get(fields['count'], 0)
+    if count == 0:
+        return partial
+    partial.update({
+        "count": count,
+        "sum": stats.get(fields['sum'], 0.0),
+        "min": stats.get(fields['min'], INF),
+        "max": stats.get(fields['max'], -INF),
+    })
+    if stats.get(fields['moments']):
+        partial["moments"] = dict(stats[fields['moments']])
+    histogram = stats.get(fields['hist']) or {}
+    if len(histogram.get('counts', [])) == len(partial["hist"]):
+        partial["hist"] = list(histogram['counts'])
+    return partial
+
+
+def stats_from_partials(partials, last_updated):
+    """
+    Builds the stats document stored in MongoDB from one partial per event type.
+    min/max are stored as 0.0 and avg/var/std are rounded to two decimals, as the API expects.
+    var/std are population variance and standard deviation (M2 / n).
+    """
+    doc = {}
+    for event_type in ('grade', 'activity'):
+        partial = partials[event_type]
+        fields = STATS_FIELDS[event_type]
+        moments = partial["moments"]
+        avg = partial["sum"] / partial["count"] if partial["count"] > 0 else 0.0
+        variance = moments["m2"] / moments["count"] if moments["count"] > 0 else 0.0
+        doc[fields['count']] = partial["count"]
+        doc[fields['min']] = partial["min"] if partial["min"] != INF else 0.0
+        doc[fields['max']] = partial["max"] if partial["max"] != -INF else 0.0
+        doc[fields['avg']] = round(avg, 2)
+        doc[fields['var']] = round(variance, 2)
+        doc[fields['std']] = round(math.sqrt(variance), 2)
+        doc[fields['hist']] = {"edges": histogram_edges(event_type), "counts": list(partial["hist"])}
+
+    # 存储运行总和、矩 (count, mean, M2) 和检查点时间
+    for event_type in ('grade', 'activity'):
+        doc[STATS_FIELDS[event_type]['sum']] = partials[event_type]["sum"]
+        doc[STATS_FIELDS[event_type]['moments']] = dict(partials[event_type]["moments"])
+    doc["last_updated"] = last_updated
+    return doc
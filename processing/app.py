@@ -1,11 +1,22 @@
-import connexion, os, json, yaml, logging, logging.config, time
-from datetime import datetime
+import connexion, os, json, yaml, logging, logging.config, time, atexit
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta
 from connexion import NoContent
 from apscheduler.schedulers.background import BackgroundScheduler
 # 引入 MongoDB 驱动
-from pymongo import MongoClient
+from pymongo import MongoClient, monitoring
+from pymongo.errors import DuplicateKeyError
 # 引入 MySQL 驱动
 import mysql.connector 
+from leader import LeaderElector
+from event_time import EventTimeWindows
+from aggregation import (TABLE_NAMES, VALUE_COLUMNS, STATS_FIELDS, empty_partial, column_array, aggregate_values,
+                         merge_partials, partial_from_stats, stats_from_partials, HISTOGRAMS, histogram_edges)
+import metrics
+import serving
+import health
+import log_pipeline
+import fast_json
 
 # --- Configuration Loading and Logging Setup ---
 # 假设 app_conf.yml 和 log_conf.yml 位于同一目录
@@ -16,37 +27,80 @@ with open('./app_conf.yml','r') as f:
 
 with open("log_conf.yml", "r") as f:
     LOG_CONFIG = yaml.safe_load(f.read())
-    logging.config.dictConfig(LOG_CONFIG)
 
+# 日志由后台线程写出（log_pipeline.py），请求和调度线程只把记录放进队列
+LOG_PIPELINE = log_pipeline.pipeline_from_config(LOG_CONFIG, app_config.get('logging'))
+metrics.register_gauges('log_records', 'Log records queued, dropped on a full queue or sampled out',
+                        ['event'], LOG_PIPELINE.counters, kind='counter')
 
 logger = logging.getLogger('basicLogger')
+request_logger = log_pipeline.request_logger()
 
 # --- MongoDB Initialization ---
 MONGO_CONF = app_config['mongodb']
 MONGO_URL = f"mongodb://{MONGO_CONF['hostname']}:{MONGO_CONF['port']}/"
 
+class MongoCommandMetrics(monitoring.CommandListener):
+    """把每个 MongoDB 命令的耗时记录到 Prometheus (db=mongodb, operation=命令名)。"""
+
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        metrics.DB_QUERY_LATENCY.labels('mongodb', event.command_name).observe(event.duration_micros / 1e6)
+
+    def failed(self, event):
+        metrics.DB_QUERY_LATENCY.labels('mongodb', f"{event.command_name}_failed").observe(event.duration_micros / 1e6)
+
+
 # 建立 MongoDB 连接
-# 这里使用了一个循环重试机制来等待 MongoDB 启动
-MAX_RETRIES = 10
-RETRY_DELAY = 5
-client = None
-db = None
+# MongoClient 在后台线程中连接并自动重连，导入时不等待 MongoDB；连接状态由 /readyz 反映
+client = MongoClient(MONGO_URL, serverSelectionTimeoutMS=5000, event_listeners=[MongoCommandMetrics()])
+db = client[MONGO_CONF['db']]
+stats_collection = db[MONGO_CONF['collection']]
 
-for i in range(MAX_RETRIES):
-    try:
-        client = MongoClient(MONGO_URL, serverSelectionTimeoutMS=5000)
-        client.admin.command('ismaster') 
-        db = client[MONGO_CONF['db']]
-        stats_collection = db[MONGO_CONF['collection']]
-        logger.info(f"Successfully connected to MongoDB at {MONGO_URL} | DB: {MONGO_CONF['db']}")
-        break
-    except Exception as e:
-        logger.warning(f"Connection to MongoDB failed (Attempt {i+1}/{MAX_RETRIES}). Retrying in {RETRY_DELAY} seconds: {e}")
-        time.sleep(RETRY_DELAY)
-else:
-    logger.error("FATAL: Failed to connect to MongoDB after multiple retries. Exiting.")
-    # 如果无法连接，则退出或设置一个标志阻止进一步操作
-    exit(1)
+
+def ensure_stats_indexes():
+    """
+    每个统计文档带有版本号 seq（基于的上一个文档的 seq + 1）。seq 上的唯一索引让写入本身成为
+    compare-and-set：基于同一个旧文档计算的两次写入（例如失去租约的旧 leader 和新 leader）只有一个成功。
+    没有 seq 的旧文档不受索引约束。
+    """
+    stats_collection.create_index('seq', unique=True, partialFilterExpression={'seq': {'$exists': True}})
+
+
+# --- Leader Election ---
+# 多副本部署时只有持有租约的 leader 运行 populate_stats，所有副本都可以响应 /stats
+LEADER_CONF = app_config.get('leader_election', {})
+leader_elector = None
+if LEADER_CONF.get('enabled', True):
+    leader_elector = LeaderElector(
+        db[LEADER_CONF.get('collection', 'leader_lease')],
+        LEADER_CONF.get('lease_name', 'processing-stats'),
+        lease_seconds=LEADER_CONF.get('lease_seconds', 30)
+    )
+    atexit.register(leader_elector.release)
+
+# --- Event-Time Windows ---
+# 按事件的客户端 timestamp 分窗口聚合，迟到的事件只修改受影响的窗口
+EVENT_TIME_CONF = app_config.get('event_time', {})
+event_windows = None
+if EVENT_TIME_CONF.get('enabled', False):
+    event_windows = EventTimeWindows(
+        db[EVENT_TIME_CONF.get('collection', 'event_time_windows')],
+        window_seconds=EVENT_TIME_CONF.get('window_seconds', 3600),
+        allowed_lateness_seconds=EVENT_TIME_CONF.get('allowed_lateness_seconds', 86400)
+    )
+
+# 内部字段：存储在 MongoDB 中，但不通过 API 返回
+INTERNAL_FIELDS = {'fencing_token', 'seq'} | {fields['moments'] for fields in STATS_FIELDS.values()}
+
+
+def public_fields(stats):
+    """
+    过滤掉内部的 sum_ 字段和其他内部字段，只保留面向 API 的字段。
+    """
+    return {k: v for k, v in stats.items() if not k.startswith('sum_') and k not in INTERNAL_FIELDS}
 
 
 # --- MySQL Configuration (假设 app_conf.yml 中有此配置) ---
@@ -55,6 +109,32 @@ MYSQL_CONF = app_config.get('mysql', {})
 if not MYSQL_CONF:
     logger.error("MySQL configuration not found in app_conf.yml. Cannot proceed with direct DB read.")
 
+# 每次从游标读取的行数，每块解码为一个数组并向量化聚合
+FETCH_CHUNK_ROWS = MYSQL_CONF.get('fetch_chunk_rows', 10000)
+
+
+# --- Adaptive Scheduler Configuration ---
+SCHEDULER_CONF = app_config.get('scheduler', {})
+BASE_INTERVAL = SCHEDULER_CONF.get('interval', 10)
+MIN_INTERVAL = SCHEDULER_CONF.get('min_interval', 1)
+MAX_INTERVAL = SCHEDULER_CONF.get('max_interval', 60)
+BACKOFF_FACTOR = SCHEDULER_CONF.get('backoff_factor', 2)
+MAX_ROWS_PER_CHUNK = SCHEDULER_CONF.get('max_rows_per_chunk', 50000)
+MAX_TICK_SECONDS = SCHEDULER_CONF.get('max_tick_seconds', 8)
+COMMIT_GRACE_MS = SCHEDULER_CONF.get('commit_grace_ms', 1000)
+POPULATE_JOB_ID = 'populate_stats'
+
+scheduler = None
+SCHEDULER_METRICS = {
+    "lag_ms": 0,              # MySQL 中最新事件的 date_created - last_updated
+    "rows_last_tick": 0,
+    "chunks_last_tick": 0,
+    "tick_duration_ms": 0.0,
+    "interval_seconds": BASE_INTERVAL,
+    "is_leader": leader_elector is None,
+    "last_tick_at": 0,
+}
+
 
 def get_latest_stats():
     """
@@ -73,19 +153,27 @@ def get_latest_stats():
         "max_activity_hours": float('-inf'), 
         "min_activity_hours": float('inf'),
         "sum_activity_hours": 0.0, "avg_activity_hours": 0.0, 
-        "last_updated": 0 # last_updated 使用毫秒级时间戳
+
+        # 方差/标准差和固定区间直方图
+        "var_grade_readings": 0.0, "std_grade_readings": 0.0,
+        "var_activity_hours": 0.0, "std_activity_hours": 0.0,
+        "grade_histogram": {"edges": histogram_edges('grade'), "counts": [0] * HISTOGRAMS['grade'][2]},
+        "activity_histogram": {"edges": histogram_edges('activity'), "counts": [0] * HISTOGRAMS['activity'][2]},
+        "last_updated": 0, # last_updated 使用毫秒级时间戳
+        "seq": 0 # 文档版本号，见 ensure_stats_indexes
     }
     
     try:
         # 查询最新的一个文档
+        # 按版本号排序（没有 seq 的旧文档排在最后），而不是按插入顺序
         latest_doc = stats_collection.find_one(
             {}, 
-            sort=[('_id', -1)]
+            sort=[('seq', -1), ('_id', -1)]
         )
         
         if latest_doc:
             del latest_doc['_id']
-            logger.debug(f"Latest stats found. Last updated timestamp (ms): {latest_doc.get('last_updated')}")
+            logger.debug("Latest stats found. Last updated timestamp (ms): %s", latest_doc.get('last_updated'))
             
             # 使用 .get() 确保旧文档结构兼容性，如果字段不存在，则使用初始值
             for key, default_val in initial_stats.items():
@@ -102,63 +190,99 @@ def get_latest_stats():
         return initial_stats
 
 
-def get_events_from_mysql(event_type, start_timestamp_ms):
+def get_mysql_connection():
     """
-    直接查询 MySQL 数据库，获取自指定时间戳以来的新事件。
+    建立到 MySQL 的新连接。
     """
-    conn = None
-    cursor = None
-    events = []
-    
-    table_name_map = {
-        'grade': 'grades',
-        'activity': 'activities'
-    }
-    table_name = table_name_map.get(event_type)
+    # 强制将 password 转换为字符串，以防 YAML 误解析为 int
+    password_str = str(MYSQL_CONF.get('password')) 
+
+    with metrics.DB_QUERY_LATENCY.labels('mysql', 'connect').time():
+        return mysql.connector.connect(
+            host=MYSQL_CONF.get('host'),
+            user=MYSQL_CONF.get('user'),
+            password=password_str, 
+            database=MYSQL_CONF.get('database'),
+            connection_timeout=MYSQL_CONF.get('connect_timeout', 5)
+        )
+
+
+def get_partial_from_mysql(event_type, start_timestamp_ms, end_timestamp_ms, event_chunk=None):
+    """
+    直接查询 MySQL 数据库，聚合 [start_timestamp_ms, end_timestamp_ms) 区间内的新事件。
 
+    只读取数值列，按 FETCH_CHUNK_ROWS 分块获取，每块解码为 float64 数组后做一次向量化聚合，
+    最后合并为一个 partial。查询失败时返回 None，调用方不应推进 last_updated。
+    如果传入 event_chunk (EventTimeChunk)，同时读取 timestamp 和 date_created 列，交给它按事件时间分窗口。
+    """
+    table_name = TABLE_NAMES.get(event_type)
     if not table_name:
         logger.error(f"Invalid event type: {event_type}")
-        return []
-
-    TIME_COLUMN_NAME = 'date_created' 
-    start_value_for_query = start_timestamp_ms
+        return None
 
+    columns = VALUE_COLUMNS[event_type] if event_chunk is None else f"{VALUE_COLUMNS[event_type]}, timestamp, date_created"
     query = f"""
-        SELECT * FROM {table_name} 
-        WHERE {TIME_COLUMN_NAME} >= {start_value_for_query}
-        ORDER BY {TIME_COLUMN_NAME} ASC
+        SELECT {columns} FROM {table_name} 
+        WHERE date_created >= {start_timestamp_ms} AND date_created < {end_timestamp_ms}
     """
-    
-    logger.debug(f"MySQL Query for {event_type}: {query}")
+    logger.debug("MySQL Query for %s: %s", event_type, query)
 
+    conn = None
+    cursor = None
+    partial = empty_partial(event_type)
     try:
-        # 强制将 password 转换为字符串，以防 YAML 误解析为 int
-        password_str = str(MYSQL_CONF.get('password')) 
-        
-        conn = mysql.connector.connect(
-            host=MYSQL_CONF.get('host'),
-            user=MYSQL_CONF.get('user'),
-            password=password_str, 
-            database=MYSQL_CONF.get('database')
-        )
-        cursor = conn.cursor(dictionary=True) 
-        cursor.execute(query)
-        events = cursor.fetchall()
-        logger.info(f"Successfully fetched {len(events)} new {event_type} events from MySQL.")
-
-        processed_events = []
-        for event in events:
-            # 查找并处理实际的时间列。
-            if 'timestamp' in event and isinstance(event['timestamp'], datetime):
-                event['timestamp'] = event['timestamp'].isoformat()
-            
-            processed_events.append(event)
-            
-        return processed_events
+        conn = get_mysql_connection()
+        cursor = conn.cursor()
+        with metrics.DB_QUERY_LATENCY.labels('mysql', 'select').time():
+            cursor.execute(query)
+        # 读取时间单独统计，不包含聚合时间
+        fetch_seconds = 0.0
+        while True:
+            fetch_started = time.perf_counter()
+            rows = cursor.fetchmany(FETCH_CHUNK_ROWS)
+            fetch_seconds += time.perf_counter() - fetch_started
+            if not rows:
+                break
+            values = column_array(rows) if event_chunk is None else event_chunk.add_rows(rows)
+            partial = merge_partials(partial, aggregate_values(values, event_type))
+        metrics.DB_QUERY_LATENCY.labels('mysql', 'fetch').observe(fetch_seconds)
+
+        logger.info("Successfully aggregated %d new %s events from MySQL.", partial['count'], event_type)
+        return partial
 
     except mysql.connector.Error as err:
         logger.error(f"MySQL Error fetching {event_type} data: {err}")
-        return []
+        return None
+
+    finally:
+        if cursor:
+            cursor.close()
+        if conn and conn.is_connected():
+            conn.close()
+
+
+def query_mysql_scalars(queries):
+    """
+    在同一个连接上依次执行多个查询，返回每个查询第一行第一列的值 (无结果时为 None)。
+    查询失败时返回 None。
+    """
+    conn = None
+    cursor = None
+    try:
+        conn = get_mysql_connection()
+        cursor = conn.cursor()
+        values = []
+        for query in queries:
+            with metrics.DB_QUERY_LATENCY.labels('mysql', 'select').time():
+                cursor.execute(query)
+                row = cursor.fetchone()
+                cursor.fetchall()
+            values.append(row[0] if row else None)
+        return values
+
+    except mysql.connector.Error as err:
+        logger.error(f"MySQL Error running {queries}: {err}")
+        return None
 
     finally:
         if cursor:
@@ -167,127 +291,100 @@ def get_events_from_mysql(event_type, start_timestamp_ms):
             conn.close()
 
 
-def calculate_and_store_stats(stats, content_activity, content_grade, end):
+def get_chunk_end(start_timestamp_ms, limit_timestamp_ms):
+    """
+    计算本次要处理的区间终点 end，使 [start, end) 在每个表中最多包含 MAX_ROWS_PER_CHUNK 行。
+    积压不足一个区间时 end 就是 limit_timestamp_ms。
     """
-    计算新的统计数据（包括平均值）并将其存储到 MongoDB。
+    queries = [f"""
+        SELECT date_created FROM {table_name}
+        WHERE date_created >= {start_timestamp_ms} AND date_created < {limit_timestamp_ms}
+        ORDER BY date_created LIMIT 1 OFFSET {MAX_ROWS_PER_CHUNK}
+    """ for table_name in TABLE_NAMES.values()]
+    cuts = query_mysql_scalars(queries)
+    if cuts is None:
+        return None
+
+    end = min([limit_timestamp_ms] + [cut for cut in cuts if cut is not None])
+    # 同一毫秒内的行超过上限时，至少前进 1 毫秒，避免原地循环
+    return max(end, start_timestamp_ms + 1)
+
+
+def get_newest_event_ms():
+    """返回 MySQL 中最新事件的 date_created (毫秒)，没有数据或查询失败时返回 None。"""
+    newest = query_mysql_scalars([f"SELECT MAX(date_created) FROM {table_name}" for table_name in TABLE_NAMES.values()])
+    if newest is None:
+        return None
+    newest = [value for value in newest if value is not None]
+    return max(newest) if newest else None
+
+
+def calculate_and_store_stats(stats, content_activity, content_grade, end, fencing_token=None):
+    """
+    根据原始事件记录（dict 列表）计算新的统计数据并存储到 MongoDB。
+    """
+    logger.debug("Calculating stats based on %d raw grade records and %d raw activity records.",
+                 len(content_grade), len(content_activity))
+
+    new_partials = {}
+    for event_type, content in (('grade', content_grade), ('activity', content_activity)):
+        column = VALUE_COLUMNS[event_type]
+        readings = [item.get(column) for item in content if isinstance(item.get(column), (int, float))]
+        new_partials[event_type] = aggregate_values(readings, event_type)
+
+    return calculate_and_store_partials(stats, new_partials, end, fencing_token)
+
+
+def calculate_and_store_partials(stats, new_partials, end, fencing_token=None):
+    """
+    将新事件的 partial 与历史统计合并，计算新的统计数据（包括平均值）并将其存储到 MongoDB。
     
     此函数增加了逻辑来修复旧版本中 min 值被错误存储为 0.0 的历史数据腐败问题。
+    如果传入 fencing_token，写入前会确认本副本仍然持有 leader 租约，否则放弃写入。
+    写入以 seq = stats 的 seq + 1 为条件（唯一索引）：如果在确认租约之后、写入之前已有其他写入者
+    （新 leader 或 backfill）基于同一文档写入，插入失败，本次结果被丢弃。
     """
-    logger.debug(f"Calculating stats based on {len(content_grade)} raw grade records and {len(content_activity)} raw activity records.")
-    
-    # 历史记录中的最小/大值和计数
-    hist_min_grade = stats.get('min_grade_readings', float('inf'))
-    hist_max_grade = stats.get('max_grade_readings', float('-inf'))
-    hist_num_grade = stats.get('num_grade_readings', 0)
-    
-    hist_min_activity = stats.get('min_activity_hours', float('inf'))
-    hist_max_activity = stats.get('max_activity_hours', float('-inf'))
-    hist_num_activity = stats.get('num_activity_readings', 0)
-
-    # 1. 初始化新的统计数据结构
-    new_stats = {
-        "last_updated": end, 
-        # 获取上次的累积总和和计数
-        "num_grade_readings": hist_num_grade,
-        "sum_grade_readings": stats.get('sum_grade_readings', 0.0),
-        "min_grade_readings": hist_min_grade,
-        "max_grade_readings": hist_max_grade,
-        
-        "num_activity_readings": hist_num_activity,
-        "sum_activity_hours": stats.get('sum_activity_hours', 0.0),
-        "min_activity_hours": hist_min_activity,
-        "max_activity_hours": hist_max_activity,
-    }
-    
-    # --- 2. 计算分数统计 (Grade Stats) ---
-    list_grade_readings = [item.get("score") for item in content_grade if isinstance(item.get("score"), (int, float))]
-    
-    # 修复逻辑：检查历史最小分是否为腐败的 0.0
-    # 如果历史总数大于 0，且历史最小分是 0.0，且新数据中没有 0.0，则临时重置为 inf
-    if hist_num_grade > 0 and hist_min_grade == 0.0 and 0.0 not in list_grade_readings:
-        new_stats["min_grade_readings"] = float('inf')
-        logger.warning("Historical min_grade_readings was 0.0 but no 0.0 in new data. Resetting min calculation base to inf.")
-    
-    # 更新总数和总和
-    new_stats["num_grade_readings"] += len(list_grade_readings)
-    new_grade_sum_increment = sum(list_grade_readings)
-    new_stats["sum_grade_readings"] += new_grade_sum_increment
-
-    # 更新 Min/Max
-    if list_grade_readings:
-        # 这里的 new_stats["min_grade_readings"] 现在要么是正确的历史值，要么是 inf (如果被重置了)
-        new_stats["min_grade_readings"] = min(new_stats["min_grade_readings"], min(list_grade_readings))
-        new_stats["max_grade_readings"] = max(new_stats["max_grade_readings"], max(list_grade_readings))
-
-    # 计算平均值
-    if new_stats["num_grade_readings"] > 0:
-        new_stats["avg_grade_readings"] = new_stats["sum_grade_readings"] / new_stats["num_grade_readings"]
-    else:
-        new_stats["avg_grade_readings"] = 0.0
-
-    # --- 3. 计算活动统计 (Activity Stats) ---
-    list_activity_readings = [item.get("hours") for item in content_activity if isinstance(item.get("hours"), (int, float))]
-    
-    # 修复逻辑：检查历史最小活动小时数是否为腐败的 0.0
-    if hist_num_activity > 0 and hist_min_activity == 0.0 and 0.0 not in list_activity_readings:
-        new_stats["min_activity_hours"] = float('inf')
-        logger.warning("Historical min_activity_hours was 0.0 but no 0.0 in new data. Resetting min calculation base to inf.")
-        
-    # 更新总数和总和
-    new_stats["num_activity_readings"] += len(list_activity_readings)
-    new_activity_sum_increment = sum(list_activity_readings)
-    new_stats["sum_activity_hours"] += new_activity_sum_increment
-
-    # 更新 Min/Max
-    if list_activity_readings:
-        new_stats["min_activity_hours"] = min(new_stats["min_activity_hours"], min(list_activity_readings))
-        new_stats["max_activity_hours"] = max(new_stats["max_activity_hours"], max(list_activity_readings))
-
-    # 计算平均值
-    if new_stats["num_activity_readings"] > 0:
-        new_stats["avg_activity_hours"] = new_stats["sum_activity_hours"] / new_stats["num_activity_readings"]
-    else:
-        new_stats["avg_activity_hours"] = 0.0
-
-    # --- 4. 最终数据结构和存储 ---
-    # 确保 Min/Max 在没有数据时显示为 0.0
-    final_min_grade = new_stats["min_grade_readings"] if new_stats["min_grade_readings"] != float('inf') else 0.0
-    final_max_grade = new_stats["max_grade_readings"] if new_stats["max_grade_readings"] != float('-inf') else 0.0
-    final_min_activity = new_stats["min_activity_hours"] if new_stats["min_activity_hours"] != float('inf') else 0.0
-    final_max_activity = new_stats["max_activity_hours"] if new_stats["max_activity_hours"] != float('-inf') else 0.0
-
-    final_stats_doc = {
-        "num_grade_readings": new_stats["num_grade_readings"],
-        "min_grade_readings": final_min_grade,
-        "max_grade_readings": final_max_grade,
-        "avg_grade_readings": round(new_stats["avg_grade_readings"], 2), # 四舍五入到两位小数
-        
-        "num_activity_readings": new_stats["num_activity_readings"],
-        "min_activity_hours": final_min_activity,
-        "max_activity_hours": final_max_activity,
-        "avg_activity_hours": round(new_stats["avg_activity_hours"], 2), # 四舍五入到两位小数
-        
-        # 存储运行总和和检查点时间
-        "sum_grade_readings": new_stats["sum_grade_readings"],
-        "sum_activity_hours": new_stats["sum_activity_hours"],
-        "last_updated": new_stats["last_updated"],
-    }
+    partials = {}
+    for event_type, new_partial in new_partials.items():
+        # 历史记录中的累积值 (count, sum, min, max)
+        historical = partial_from_stats(stats, event_type)
+
+        # 修复逻辑：检查历史最小值是否为腐败的 0.0
+        # 如果历史总数大于 0，且历史最小值是 0.0，且新数据中没有 0.0，则临时重置为 inf
+        # (新数据的最小值不是 0.0 时，重置与否对结果等价于“新数据中没有 0.0”的判断)
+        if historical["count"] > 0 and historical["min"] == 0.0 and new_partial["min"] != 0.0:
+            historical["min"] = float('inf')
+            logger.warning(f"Historical {STATS_FIELDS[event_type]['min']} was 0.0 but no 0.0 in new data. Resetting min calculation base to inf.")
+
+        partials[event_type] = merge_partials(historical, new_partial)
+
+    # 最终数据结构：Min/Max 在没有数据时显示为 0.0，平均值四舍五入到两位小数
+    final_stats_doc = stats_from_partials(partials, end)
+    final_stats_doc["seq"] = stats.get("seq", 0) + 1
+
+    if fencing_token is not None:
+        final_stats_doc["fencing_token"] = fencing_token
+        if not leader_elector.validate(fencing_token):
+            logger.warning(f"Fencing token {fencing_token} is no longer valid. Discarding computed stats instead of storing them.")
+            return public_fields(final_stats_doc)
 
     try:
         stats_collection.insert_one(final_stats_doc)
         logger.debug("New statistics stored to MongoDB: %s", final_stats_doc)
+    except DuplicateKeyError:
+        logger.warning(f"Stats version {final_stats_doc['seq']} was already written by another writer. Discarding computed stats.")
     except Exception as e:
         logger.error(f"Failed to write new stats to MongoDB: {e}")
 
     # 返回给日志记录，不包含内部的总和字段
-    return {k: v for k, v in final_stats_doc.items() if not k.startswith('sum_')}
+    return public_fields(final_stats_doc)
 
 
 def get_stats():
     """
     API Endpoint: 返回最新的统计数据。
     """
-    logger.info("Request received for latest statistics.")
+    request_logger.info("Request received for latest statistics.")
     
     latest_stats = get_latest_stats()
 
@@ -295,10 +392,10 @@ def get_stats():
     if latest_stats["last_updated"] == 0:
         logger.warning("Statistics collection is empty.")
         # 返回 200，只返回面向用户/API 的字段
-        return {k: v for k, v in latest_stats.items() if not k.startswith('sum_')}, 200
+        return public_fields(latest_stats), 200
 
     # 过滤掉内部的 sum_ 字段，只返回 API 需要的字段
-    api_response = {k: v for k, v in latest_stats.items() if not k.startswith('sum_')}
+    api_response = public_fields(latest_stats)
     
     # 确保在 API 响应中，如果 min 值是 inf/neg_inf，显示为 0.0 (以防 get_latest_stats 返回了 inf/neg_inf)
     if api_response.get("min_grade_readings") == float('inf'):
@@ -311,67 +408,245 @@ def get_stats():
     if api_response.get("max_activity_hours") == float('-inf'):
         api_response["max_activity_hours"] = 0.0
 
-    logger.debug("Returning latest stats: %s", api_response)
-    logger.info("The request has been completed.")
+    request_logger.debug("Returning latest stats: %s", api_response)
+    request_logger.info("The request has been completed.")
     return api_response, 200
     
 
 def populate_stats():
     """
     调度器任务：从 MySQL 获取新数据，计算统计并存储。
+
+    每个区间 [last_updated, end) 在每个表中最多包含 max_rows_per_chunk 行。
+    落后时在 max_tick_seconds 内连续处理多个区间；返回下一次运行的间隔 (秒)：
+    落后时缩短到 min_interval，有新数据时恢复为 interval，空闲时逐步退避到 max_interval。
     """
+    fencing_token = None
+    if leader_elector is not None:
+        SCHEDULER_METRICS["is_leader"] = leader_elector.is_leader()
+        if not SCHEDULER_METRICS["is_leader"]:
+            logger.debug("This replica is not the leader. Skipping stats population.")
+            return BASE_INTERVAL
+        fencing_token = leader_elector.token
+
     logger.info("Scheduler started populating stats!")
+    tick_started = time.monotonic()
+    rows = chunks = 0
+    behind = False
     
     try:
-        # 1. 获取上次处理的最新时间戳 (毫秒)
-        stats = get_latest_stats()
-        most_recent_event_ts = stats["last_updated"] # 毫秒级时间戳作为起点
-
-        # 2. 从 MySQL 获取新数据
-        content_grade = get_events_from_mysql('grade', most_recent_event_ts)
-        content_activity = get_events_from_mysql('activity', most_recent_event_ts)
+        while True:
+            # 1. 获取上次处理的最新时间戳 (毫秒)
+            stats = get_latest_stats()
+            most_recent_event_ts = stats["last_updated"] # 毫秒级时间戳作为起点
+
+            # 2. 计算本区间终点：只处理提交宽限期之前的事件，且行数不超过上限
+            limit = int(time.time() * 1000) - COMMIT_GRACE_MS
+            if limit <= most_recent_event_ts:
+                behind = False
+                break
+            end = get_chunk_end(most_recent_event_ts, limit)
+
+            # 3. 从 MySQL 获取并聚合新数据 (启用事件时间模式时同时按 timestamp 分窗口)
+            event_chunks = None if event_windows is None else {
+                event_type: event_windows.new_chunk(event_type) for event_type in TABLE_NAMES
+            }
+            new_partials = None if end is None else {
+                event_type: get_partial_from_mysql(event_type, most_recent_event_ts, end,
+                                                   event_chunks[event_type] if event_chunks else None)
+                for event_type in ('grade', 'activity')
+            }
+            if new_partials is None or None in new_partials.values():
+                logger.error("Failed to read new events from MySQL. Keeping last_updated unchanged until the next run.")
+                behind = False
+                break
+
+            # 先更新事件时间窗口再存储统计：统计写入失败时重放本区间，窗口会跳过已包含的区间
+            if event_chunks is not None:
+                if fencing_token is not None and not leader_elector.validate(fencing_token):
+                    logger.warning(f"Fencing token {fencing_token} is no longer valid. Stopping this run.")
+                    behind = False
+                    break
+                if not event_windows.apply(event_chunks.values(), most_recent_event_ts, end):
+                    behind = False
+                    break
+
+            chunk_rows = new_partials['grade']['count'] + new_partials['activity']['count']
+            logger.debug("Scheduler fetched: %d new grade readings, %d new activity readings in [%d, %d).",
+                         new_partials['grade']['count'], new_partials['activity']['count'], most_recent_event_ts, end)
+
+            # 4. 计算并存储，last_updated 推进到区间终点
+            calculate_and_store_partials(stats, new_partials, end, fencing_token)
+            if get_latest_stats()["last_updated"] != end:
+                logger.warning(f"Stats for [{most_recent_event_ts}, {end}) were not stored. Stopping this run.")
+                behind = False
+                break
+            rows += chunk_rows
+            chunks += 1
+
+            # 5. 区间被行数上限截断说明仍有积压，在时间预算内继续处理下一个区间
+            behind = end < limit
+            if not behind:
+                break
+            if time.monotonic() - tick_started >= MAX_TICK_SECONDS:
+                logger.info(f"Still behind after {chunks} chunks ({rows} rows). Continuing in the next run.")
+                break
+            if leader_elector is not None and not leader_elector.is_leader():
+                break
+
+        newest = get_newest_event_ms()
+        if newest is not None:
+            SCHEDULER_METRICS["lag_ms"] = max(0, newest - get_latest_stats()["last_updated"])
         
-        logger.debug(f"Scheduler fetched: {len(content_grade)} new grade readings, {len(content_activity)} new activity readings.")
+    except Exception as e:
+        logger.error(f"FATAL: Unhandled exception during populate_stats execution: {e}", exc_info=True)
 
+    SCHEDULER_METRICS["rows_last_tick"] = rows
+    SCHEDULER_METRICS["chunks_last_tick"] = chunks
+    SCHEDULER_METRICS["tick_duration_ms"] = round((time.monotonic() - tick_started) * 1000, 1)
+    SCHEDULER_METRICS["last_tick_at"] = int(time.time() * 1000)
+    logger.info(f"Processed {rows} rows in {chunks} chunks in {SCHEDULER_METRICS['tick_duration_ms']} ms. Lag: {SCHEDULER_METRICS['lag_ms']} ms.")
 
-        # 3. 设置新的结束时间戳 (毫秒)
-        end = int(time.time() * 1000) 
+    if behind:
+        return MIN_INTERVAL
+    if rows:
+        return BASE_INTERVAL
+    return min(max(SCHEDULER_METRICS["interval_seconds"], BASE_INTERVAL) * BACKOFF_FACTOR, MAX_INTERVAL)
 
-        # 4. 只有在接收到新数据时才进行计算和存储
-        if not content_activity and not content_grade and end == most_recent_event_ts:
-            logger.info("No new readings found and no time change since last update. Skipping calculation.")
-            return
-            
-        calculate_and_store_stats(stats, content_activity, content_grade, end)
-        
+
+def run_scheduled_tick():
+    """
+    调度器入口：运行一次 populate_stats，然后按其返回的间隔安排下一次运行。
+    每次只安排一个一次性任务，所以追赶期间的长时间运行不会与下一次运行重叠。
+    """
+    interval = BASE_INTERVAL
+    try:
+        interval = populate_stats()
+    finally:
+        schedule_next_tick(interval)
+
+
+def schedule_next_tick(interval):
+    if scheduler is None:
+        return
+    if interval != SCHEDULER_METRICS["interval_seconds"]:
+        logger.info(f"Scheduler interval changed from {SCHEDULER_METRICS['interval_seconds']} to {interval} seconds.")
+    SCHEDULER_METRICS["interval_seconds"] = interval
+    scheduler.add_job(run_scheduled_tick, 'date', run_date=datetime.now() + timedelta(seconds=interval),
+                      id=POPULATE_JOB_ID, replace_existing=True)
+
+
+def get_event_time_windows(event_type, start_timestamp=None, end_timestamp=None, limit=100):
+    """
+    API Endpoint: 返回按事件时间 (timestamp) 聚合的窗口统计，以及当前水位线和被丢弃的迟到事件数。
+    """
+    if event_windows is None:
+        return {"message": "Event-time windowing is not enabled."}, 404
+
+    try:
+        state = event_windows.get_state(event_type)
+        windows = event_windows.get_windows(event_type, start_timestamp, end_timestamp, limit)
     except Exception as e:
-        logger.error(f"FATAL: Unhandled exception during populate_stats execution: {e}", exc_info=True)
+        logger.error(f"Error accessing MongoDB for event-time windows: {e}")
+        return {"message": "Event-time windows are temporarily unavailable."}, 503
+
+    return {
+        "event_type": event_type,
+        "window_seconds": event_windows.window_ms // 1000,
+        "allowed_lateness_seconds": event_windows.allowed_lateness_ms // 1000,
+        "watermark_ms": state['watermark_ms'],
+        "dropped_late": state['dropped_late'],
+        "windows": windows,
+    }, 200
+
+
+def get_scheduler_metrics():
+    """
+    API Endpoint: 返回调度器的积压 (lag)、每次运行处理的行数和耗时。
+    """
+    return dict(SCHEDULER_METRICS), 200
     
 
 def init_scheduler():
     """
     初始化并启动后台调度器。
     """
+    global scheduler
+
     # 1. 检查配置是否存在
-    if 'scheduler' not in app_config or 'interval' not in app_config['scheduler']:
+    if 'interval' not in SCHEDULER_CONF:
         logger.error("Scheduler configuration missing 'interval' in app_conf.yml. Scheduler not started.")
         return
-        
-    interval = app_config['scheduler']['interval']
     
     try:
         sched = BackgroundScheduler(daemon=True)
-        sched.add_job(populate_stats, 'interval', seconds=interval)
+        if leader_elector is not None:
+            # 心跳间隔必须小于租约时长，立即执行一次以便尽快选出 leader
+            renew_interval = LEADER_CONF.get('renew_interval', 10)
+            sched.add_job(leader_elector.heartbeat, 'interval', seconds=renew_interval, next_run_time=datetime.now())
+            logger.info(f"Leader election enabled for {leader_elector.identity}, renewing every {renew_interval} seconds.")
         sched.start()
-        logger.info(f"Scheduler initialized and started to run every {interval} seconds.")
+        scheduler = sched
+        schedule_next_tick(BASE_INTERVAL)
+        logger.info(f"Scheduler initialized and started to run every {BASE_INTERVAL} seconds "
+                    f"(adaptive between {MIN_INTERVAL} and {MAX_INTERVAL} seconds).")
     except Exception as e:
         # 如果启动失败，打印详细的错误信息
         logger.error(f"Failed to start scheduler: {e}")
         
 
+def scheduler_gauges():
+    """Prometheus: 抓取时读取 SCHEDULER_METRICS"""
+    for name, value in SCHEDULER_METRICS.items():
+        yield (name,), float(value)
+
+
+metrics.register_gauges('processing_scheduler', 'Adaptive scheduler state (see /scheduler/metrics)', ['field'], scheduler_gauges)
+
+
+# --- Multi-process Serving ---
+# gunicorn.conf.py does not preload this module: the MongoDB client is not fork-safe, so every
+# worker imports the app itself and starts its scheduler in post_worker_init. With leader
+# election only the lease holder runs populate_stats; every worker answers /stats.
+SERVING_CONF = serving.settings(app_config.get('serving'))
+
+# --- Health Checks ---
+# /readyz: MongoDB answers (it serves /stats); MySQL is only needed by the leader's populate_stats.
+# The stats and event-time window indexes are created once MongoDB is first reachable.
+health_monitor = health.monitor_from_config(app_config.get('health'))
+
+def ensure_indexes():
+    ensure_stats_indexes()
+    if event_windows is not None:
+        event_windows.ensure_indexes()
+
+health_monitor.add('mongodb', lambda: client.admin.command('ping'), on_ready=ensure_indexes)
+
+def check_mysql():
+    get_mysql_connection().close()
+
+health_monitor.add('mysql', check_mysql, required=False)
+
+@asynccontextmanager
+async def lifespan(app):
+    """Sizes the thread pool of the sync views and starts the dependency checks."""
+    await serving.limit_threadpool(SERVING_CONF['threads'])
+    health_monitor.start()
+    yield
+    health_monitor.stop()
+
 # --- Main App Execution ---
-app = connexion.FlaskApp(__name__, specification_dir='')
-app.add_api("OpenAPI_processing.yaml", strict_validation=True, validate_responses=True)
+# 响应由 fast_json.py 序列化；按 OpenAPI 规范校验响应只在开发环境打开（responses.validate）
+RESPONSES_CONF = app_config.get('responses', {})
+JSONIFIER = fast_json.jsonifier_from_config(RESPONSES_CONF)
+
+app = connexion.FlaskApp(__name__, specification_dir='', lifespan=lifespan, jsonifier=JSONIFIER)
+fast_json.install_flask_provider(app.app, JSONIFIER)
+app.add_api("OpenAPI_processing.yaml", strict_validation=True, validate_responses=RESPONSES_CONF.get('validate', False))
+app.app.add_url_rule('/metrics', 'get_prometheus_metrics', metrics.metrics_view, methods=['GET'])
+app.app.add_url_rule('/healthz', 'healthz', health_monitor.healthz, methods=['GET'])
+app.app.add_url_rule('/readyz', 'readyz', health_monitor.readyz, methods=['GET'])
+metrics.instrument_flask(app.app)
 
 if __name__ == "__main__":
     init_scheduler() 
@@ -0,0 +1,337 @@
+"""
+Parallel, resumable backfill of the processing stats.
+
+Recomputes the cumulative stats document from the full history instead of waiting for the
+scheduler to scan everything in a single tick after ``reset_mongo.py``:
+
+1. Freeze a watermark (now minus ``scheduler.commit_grace_ms``, in ms, like populate_stats) and
+   split the history below it into id or time ranges.
+   Months the storage service archived (storage/archive.py) are no longer in MySQL: below each
+   table's ``_archived_until`` the history is read from the Parquet part files of the archive
+   volume instead, one shard per part file, and only the rows above it from MySQL.
+2. Aggregate the shards in parallel with a process pool; every finished shard is written to a
+   checkpoint file, so an interrupted run continues where it stopped with ``--resume``.
+3. Merge the partial aggregates and install them as a single new stats document whose
+   ``last_updated`` is the watermark, so the scheduler carries on from exactly that point.
+
+Usage (inside the processing container):
+    python backfill.py --split id --shard-size 200000 --workers 4
+    python backfill.py --resume
+"""
+import os
+import sys
+import json
+import time
+import yaml
+import glob
+import argparse
+import logging.config
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import mysql.connector
+from pymongo import MongoClient
+from pymongo.errors import DuplicateKeyError
+from aggregation import np, TABLE_NAMES, VALUE_COLUMNS, empty_partial, column_array, aggregate_values, merge_partials, stats_from_partials
+from leader import bump_fencing_token
+
+try:
+    import pyarrow.parquet as pq
+except ImportError:
+    pq = None
+
+# --- Configuration Loading ---
+# Assume app_conf.yml and log_conf.yml are in the same directory
+try:
+    with open('./app_conf.yml', 'r') as f:
+        app_config = yaml.safe_load(f.read())
+
+    with open("log_conf.yml", "r") as f:
+        LOG_CONFIG = yaml.safe_load(f.read())
+        logging.config.dictConfig(LOG_CONFIG)
+except FileNotFoundError as e:
+    print(f"Error: Configuration file not found. Ensure app_conf.yml and log_conf.yml are present. {e}")
+    exit(1)
+
+logger = logging.getLogger('basicLogger')
+
+MONGO_CONF = app_config['mongodb']
+MONGO_URL = f"mongodb://{MONGO_CONF['hostname']}:{MONGO_CONF['port']}/"
+MYSQL_CONF = app_config.get('mysql', {})
+LEADER_CONF = app_config.get('leader_election', {})
+ARCHIVE_CONF = app_config.get('archive', {})
+
+DEFAULT_CHECKPOINT = './backfill_checkpoint.json'
+FETCH_CHUNK_ROWS = MYSQL_CONF.get('fetch_chunk_rows', 10000)
+# 与调度器相同的提交宽限期：仍在提交的行会在水位线之上，由调度器之后处理
+COMMIT_GRACE_MS = app_config.get('scheduler', {}).get('commit_grace_ms', 1000)
+
+# storage/archive.py: <path>/<table>/_archived_until and <path>/<table>/month=YYYY-MM/part-*.parquet
+ARCHIVE_BOUNDARY_FILE = '_archived_until'
+
+# Per-process MySQL connection, opened once by the pool initializer
+_worker_conn = None
+
+
+def connect_mysql():
+    return mysql.connector.connect(
+        host=MYSQL_CONF.get('host'),
+        port=MYSQL_CONF.get('port', 3306),
+        user=MYSQL_CONF.get('user'),
+        # 强制将 password 转换为字符串，以防 YAML 误解析为 int
+        password=str(MYSQL_CONF.get('password')),
+        database=MYSQL_CONF.get('database')
+    )
+
+
+def shard_key(shard):
+    if 'part' in shard:
+        return f"{shard['event_type']}:{shard['part']}"
+    return f"{shard['event_type']}:{shard['lo']}-{shard['hi']}"
+
+
+def archive_boundary(table_name):
+    """date_created (ms) below which storage archived ``table_name`` to Parquet; 0 if nothing is."""
+    try:
+        with open(os.path.join(ARCHIVE_CONF.get('path', './archive'), table_name, ARCHIVE_BOUNDARY_FILE)) as f:
+            return int(f.read().strip() or 0)
+    except FileNotFoundError:
+        return 0
+
+
+def archived_until(watermark):
+    """event type -> date_created (ms) below which its history is read from the archive."""
+    if not ARCHIVE_CONF.get('enabled', False):
+        return {event_type: 0 for event_type in TABLE_NAMES}
+    return {event_type: min(archive_boundary(table_name), watermark) for event_type, table_name in TABLE_NAMES.items()}
+
+
+def archive_parts(table_name):
+    """Part files of every archived month of ``table_name``, relative to the archive path."""
+    path = ARCHIVE_CONF.get('path', './archive')
+    return sorted(os.path.relpath(part, path) for part in glob.glob(os.path.join(path, table_name, 'month=*', 'part-*.parquet')))
+
+
+def plan_shards(conn, split, shard_size, watermark, boundaries):
+    """
+    Splits the history below ``watermark`` into half-open [lo, hi) ranges of ids or date_created values
+    over the MySQL rows at or above the table's archive boundary, plus one shard per archive part file.
+    """
+    column = 'id' if split == 'id' else 'date_created'
+    shards = []
+    cursor = conn.cursor()
+    try:
+        for event_type, table_name in TABLE_NAMES.items():
+            since = boundaries[event_type]
+            if since:
+                parts = archive_parts(table_name)
+                shards.extend({'event_type': event_type, 'part': part, 'until': since} for part in parts)
+                logger.info(f"{event_type}: {len(parts)} archive part files below {since}.")
+            cursor.execute(f"SELECT MIN({column}), MAX({column}) FROM {table_name} "
+                           f"WHERE date_created >= {since} AND date_created < {watermark}")
+            low, high = cursor.fetchone()
+            if low is None:
+                logger.info(f"No {event_type} rows in MySQL between {since} and watermark {watermark}.")
+                continue
+            for lo in range(int(low), int(high) + 1, shard_size):
+                shards.append({'event_type': event_type, 'lo': lo, 'hi': min(lo + shard_size, int(high) + 1), 'since': since})
+    finally:
+        cursor.close()
+    return shards
+
+
+def _init_worker():
+    global _worker_conn
+    _worker_conn = connect_mysql()
+
+
+def aggregate_part(shard):
+    """
+    Aggregates the value column of one archive part file. Only rows below the table's boundary count:
+    a part written by an archive run interrupted before it moved the boundary still has its rows in MySQL.
+    """
+    column = VALUE_COLUMNS[shard['event_type']]
+    data = pq.read_table(os.path.join(ARCHIVE_CONF.get('path', './archive'), shard['part']), columns=[column],
+                         filters=[('date_created', '<', shard['until'])], memory_map=True)
+    partial = empty_partial(shard['event_type'])
+    for batch in data.to_batches(max_chunksize=FETCH_CHUNK_ROWS):
+        values = batch.column(0).drop_null()
+        partial = merge_partials(partial, aggregate_values(values.to_numpy() if np is not None else values.to_pylist(),
+                                                           shard['event_type']))
+    return shard, partial
+
+
+def aggregate_shard(shard, split, watermark):
+    """
+    Pool worker: aggregates the value column of one shard, streaming rows in chunks to bound memory
+    and aggregating each chunk as a float64 array.
+    """
+    if 'part' in shard:
+        return aggregate_part(shard)
+    table_name = TABLE_NAMES[shard['event_type']]
+    column = VALUE_COLUMNS[shard['event_type']]
+    range_column = 'id' if split == 'id' else 'date_created'
+    query = f"""
+        SELECT {column} FROM {table_name}
+        WHERE {range_column} >= {shard['lo']} AND {range_column} < {shard['hi']}
+        AND date_created >= {shard.get('since', 0)} AND date_created < {watermark}
+    """
+    partial = empty_partial(shard['event_type'])
+    cursor = _worker_conn.cursor()
+    try:
+        cursor.execute(query)
+        while True:
+            rows = cursor.fetchmany(FETCH_CHUNK_ROWS)
+            if not rows:
+                break
+            partial = merge_partials(partial, aggregate_values(column_array(rows), shard['event_type']))
+    finally:
+        cursor.close()
+    return shard, partial
+
+
+def load_checkpoint(path):
+    with open(path, 'r') as f:
+        return json.load(f)
+
+
+def save_checkpoint(path, checkpoint):
+    """Writes the checkpoint atomically (temp file + rename) so a crash never leaves it half-written."""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(checkpoint, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def run_shards(checkpoint, checkpoint_path, workers):
+    """Aggregates every shard not yet recorded in the checkpoint, reporting progress as shards complete."""
+    done = checkpoint['done']
+    pending = [shard for shard in checkpoint['shards'] if shard_key(shard) not in done]
+    total = len(checkpoint['shards'])
+    logger.info(f"Backfill: {total} shards planned, {total - len(pending)} already done, {len(pending)} to run with {workers} workers.")
+    if not pending:
+        return
+
+    started = time.time()
+    completed = 0
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as pool:
+        futures = [pool.submit(aggregate_shard, shard, checkpoint['split'], checkpoint['watermark']) for shard in pending]
+        for future in as_completed(futures):
+            shard, partial = future.result()
+            done[shard_key(shard)] = partial
+            save_checkpoint(checkpoint_path, checkpoint)
+
+            completed += 1
+            elapsed = time.time() - started
+            eta = elapsed / completed * (len(pending) - completed)
+            logger.info(f"Backfill progress: {len(done)}/{total} shards ({shard_key(shard)}: {partial['count']} rows). "
+                        f"Elapsed {elapsed:.1f}s, ETA {eta:.1f}s.")
+
+
+def archive_moved(checkpoint):
+    """True (and logs why) if the archive job moved a boundary after the run was planned."""
+    if checkpoint.get('archived_until', {event_type: 0 for event_type in TABLE_NAMES}) == archived_until(checkpoint['watermark']):
+        return False
+    # 规划之后归档任务又删除了 MySQL 中的行：未完成的 MySQL 分片会漏算这些行
+    logger.error("The archive job moved the archive boundary since this backfill was planned; "
+                 "rows may be missing from the MySQL shards. Start a new run without --resume.")
+    return True
+
+
+def merge_checkpoint(checkpoint):
+    """Merges the per-shard partials into one partial per event type."""
+    partials = {event_type: empty_partial(event_type) for event_type in TABLE_NAMES}
+    for shard in checkpoint['shards']:
+        partials[shard['event_type']] = merge_partials(partials[shard['event_type']], checkpoint['done'][shard_key(shard)])
+    return partials
+
+
+def install_stats(stats_doc, attempts=5):
+    """
+    Inserts the recomputed stats as the newest document (the next ``seq``, see ensure_stats_indexes in
+    app.py). Bumping the leader fencing token first makes any scheduler tick still running on the old
+    state discard its result; a tick that stored its result in between takes the ``seq`` and the
+    insert is retried with the next one, so the backfilled stats always end up newest.
+    """
+    client = MongoClient(MONGO_URL, serverSelectionTimeoutMS=5000)
+    try:
+        db = client[MONGO_CONF['db']]
+        if LEADER_CONF.get('enabled', True):
+            lease_name = LEADER_CONF.get('lease_name', 'processing-stats')
+            if bump_fencing_token(db[LEADER_CONF.get('collection', 'leader_lease')], lease_name):
+                logger.info(f"Bumped fencing token of leader lease '{lease_name}'.")
+        collection = db[MONGO_CONF['collection']]
+        for attempt in range(attempts):
+            latest = collection.find_one({'seq': {'$exists': True}}, sort=[('seq', -1)], projection={'seq': True})
+            stats_doc['seq'] = (latest['seq'] if latest else 0) + 1
+            stats_doc.pop('_id', None)
+            try:
+                collection.insert_one(stats_doc)
+                return
+            except DuplicateKeyError:
+                logger.warning(f"Stats version {stats_doc['seq']} was taken by a concurrent write. Retrying.")
+        raise RuntimeError(f"Could not install the backfilled stats after {attempts} attempts.")
+    finally:
+        client.close()
+
+
+def main(argv=None):
+    arg_parser = argparse.ArgumentParser(description="Recompute processing stats from the full MySQL history in parallel.")
+    arg_parser.add_argument('--split', choices=['id', 'time'], default='id',
+                            help="split history into id ranges or date_created (ms) ranges")
+    arg_parser.add_argument('--shard-size', type=int, default=None,
+                            help="rows ids per shard for --split id (default 200000), milliseconds for --split time (default 1 day)")
+    arg_parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help="number of worker processes")
+    arg_parser.add_argument('--checkpoint', default=DEFAULT_CHECKPOINT, help="checkpoint file used for resuming")
+    arg_parser.add_argument('--resume', action='store_true', help="continue an interrupted run from its checkpoint")
+    arg_parser.add_argument('--dry-run', action='store_true', help="compute and print the stats without installing them")
+    args = arg_parser.parse_args(argv)
+
+    if ARCHIVE_CONF.get('enabled', False):
+        # 归档的月份已从 MySQL 删除：读不到归档文件时宁可不运行，也不能用少算的统计覆盖现有结果
+        if not os.path.isdir(ARCHIVE_CONF.get('path', './archive')):
+            logger.error(f"Archive path {ARCHIVE_CONF.get('path', './archive')} not found: mount the storage archive volume "
+                         f"(or set archive.enabled: false if storage does not archive).")
+            return 1
+        if pq is None and any(archive_boundary(table_name) for table_name in TABLE_NAMES.values()):
+            logger.error("Storage has archived history to Parquet, but pyarrow is not installed to read it.")
+            return 1
+
+    if args.resume:
+        if not os.path.exists(args.checkpoint):
+            logger.error(f"No checkpoint found at {args.checkpoint}. Nothing to resume.")
+            return 1
+        checkpoint = load_checkpoint(args.checkpoint)
+        if archive_moved(checkpoint):
+            return 1
+        logger.info(f"Resuming backfill with watermark {checkpoint['watermark']} from {args.checkpoint}.")
+    else:
+        shard_size = args.shard_size or (200000 if args.split == 'id' else 24 * 3600 * 1000)
+        watermark = int(time.time() * 1000) - COMMIT_GRACE_MS
+        boundaries = archived_until(watermark)
+        conn = connect_mysql()
+        try:
+            shards = plan_shards(conn, args.split, shard_size, watermark, boundaries)
+        finally:
+            conn.close()
+        checkpoint = {'watermark': watermark, 'split': args.split, 'archived_until': boundaries, 'shards': shards, 'done': {}}
+        save_checkpoint(args.checkpoint, checkpoint)
+        logger.info(f"Planned backfill below watermark {watermark} ({args.split} split, shard size {shard_size}).")
+
+    run_shards(checkpoint, args.checkpoint, args.workers)
+    if archive_moved(checkpoint):
+        return 1
+
+    stats_doc = stats_from_partials(merge_checkpoint(checkpoint), checkpoint['watermark'])
+    if args.dry_run:
+        logger.info(f"Dry run, stats not installed: {stats_doc}")
+        return 0
+
+    install_stats(stats_doc)
+    os.remove(args.checkpoint)
+    logger.info(f"SUCCESS: Backfilled stats installed with last_updated={checkpoint['watermark']}: {stats_doc}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
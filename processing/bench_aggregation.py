@@ -0,0 +1,74 @@
+"""
+Microbenchmark: legacy per-row aggregation vs. the columnar path in aggregation.py.
+
+legacy    - dict rows, isinstance filter per row, then separate sum/min/max passes
+            (what calculate_and_store_stats did before the columnar path)
+columnar  - single-column row tuples fetched in chunks, decoded with column_array and
+            aggregated with aggregate_values (count, sum, min, max, moments, histogram)
+
+Runs without MySQL/MongoDB:
+    python bench_aggregation.py --rows 1000000 --chunk 10000
+"""
+import time
+import random
+import argparse
+import aggregation
+from aggregation import empty_partial, column_array, aggregate_values, merge_partials
+
+
+def legacy_aggregate(content_grade):
+    list_grade_readings = [item.get("score") for item in content_grade if isinstance(item.get("score"), (int, float))]
+    return {
+        "count": len(list_grade_readings),
+        "sum": sum(list_grade_readings),
+        "min": min(list_grade_readings),
+        "max": max(list_grade_readings),
+    }
+
+
+def columnar_aggregate(row_tuples, chunk):
+    partial = empty_partial('grade')
+    for start in range(0, len(row_tuples), chunk):
+        partial = merge_partials(partial, aggregate_values(column_array(row_tuples[start:start + chunk]), 'grade'))
+    return partial
+
+
+def timed(func, *args, repeat=3):
+    best = float('inf')
+    result = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = func(*args)
+        best = min(best, time.perf_counter() - started)
+    return best, result
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument('--rows', type=int, default=1000000)
+    arg_parser.add_argument('--chunk', type=int, default=10000)
+    args = arg_parser.parse_args()
+
+    rng = random.Random(42)
+    scores = [min(100.0, max(0.0, rng.gauss(72, 12))) for _ in range(args.rows)]
+    dict_rows = [{"id": i, "score": score, "course": "Maths"} for i, score in enumerate(scores)]
+    row_tuples = [(score,) for score in scores]
+
+    legacy_time, legacy = timed(legacy_aggregate, dict_rows)
+    columnar_time, columnar = timed(columnar_aggregate, row_tuples, args.chunk)
+
+    numpy_module = aggregation.np
+    aggregation.np = None
+    fallback_time, _ = timed(columnar_aggregate, row_tuples, args.chunk)
+    aggregation.np = numpy_module
+
+    assert legacy["count"] == columnar["count"] and legacy["min"] == columnar["min"] and legacy["max"] == columnar["max"]
+    assert abs(legacy["sum"] - columnar["sum"]) < 1e-6 * abs(legacy["sum"])
+
+    print(f"rows={args.rows} chunk={args.chunk} numpy={'yes' if numpy_module is not None else 'no'}")
+    for name, seconds in (("legacy", legacy_time), ("columnar", columnar_time), ("columnar (no numpy)", fallback_time)):
+        print(f"{name:<20} {seconds * 1000:10.1f} ms  {args.rows / seconds:14,.0f} rows/s  x{legacy_time / seconds:.2f}")
+
+
+if __name__ == "__main__":
+    main()
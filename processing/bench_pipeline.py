@@ -0,0 +1,281 @@
+"""
+End-to-end throughput benchmark of the processing pipeline.
+
+Drives the real ``populate_stats`` from app.py over synthetic events (see synthetic_events.py)
+until the stats catch up, with local stand-ins for the external services:
+
+- MySQL   -> a SQLite file with the storage schema, filled by the synthetic generator
+- MongoDB -> mongomock (stats, leader lease and event-time window collections)
+
+Each size runs in two fresh processes: one generates the data, the other only runs the
+pipeline, so the reported peak RSS belongs to the pipeline alone. Reported per size:
+rows/s, wall time, peak RSS and the time spent in each pipeline stage:
+
+  state    - reading the latest stats document (get_latest_stats)
+  plan     - chunk boundary queries (get_chunk_end)
+  fetch    - MySQL query and cursor fetches, excluding decode/aggregate
+  decode   - converting fetched rows into arrays (column_array, or EventTimeChunk.add_rows)
+  aggregate- count/sum/min/max/moments/histogram per chunk (aggregate_values)
+  windows  - aggregating rows per window and writing event-time windows (event_time.enabled of
+             app_conf.yml, like the service; --no-event-time / --event-time override it)
+  store    - writing the stats document (calculate_and_store_partials)
+  lag      - newest event lookup for the lag metric (get_newest_event_ms)
+
+Saving a run with --save and passing it as --baseline on a later run fails (exit code 1)
+when rows/s drops by more than --max-regression, so regressions are caught before deploy.
+
+Needs the bench requirements (mongomock): pip install -r requirements-bench.txt
+
+Usage:
+    python bench_pipeline.py --sizes 10000 1000000 10000000
+    python bench_pipeline.py --sizes 1000000 --no-event-time
+    python bench_pipeline.py --sizes 1000000 --save bench_baseline.json
+    python bench_pipeline.py --sizes 1000000 --baseline bench_baseline.json --max-regression 0.2
+"""
+import os
+import sys
+import json
+import time
+import sqlite3
+import argparse
+import resource
+import tempfile
+import functools
+import yaml
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+
+from synthetic_events import populate_sqlite
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+STAGES = ('state', 'plan', 'fetch', 'decode', 'aggregate', 'windows', 'store', 'lag')
+
+
+class SQLiteConnection:
+    """Makes a sqlite3 connection look like the mysql.connector connection app.py expects."""
+
+    def __init__(self, path):
+        self._conn = sqlite3.connect(path)
+        self._open = True
+
+    def cursor(self, **kwargs):
+        return self._conn.cursor()
+
+    def is_connected(self):
+        return self._open
+
+    def close(self):
+        self._conn.close()
+        self._open = False
+
+
+def install_mongo_stand_in():
+    """Replaces pymongo.MongoClient with a shared mongomock client before app.py connects at import."""
+    import pymongo
+    import mongomock
+    from pymongo import ReplaceOne
+
+    class _Admin:
+        def command(self, *args, **kwargs):
+            return {'ok': 1}
+
+    class StandInClient(mongomock.MongoClient):
+        @property
+        def admin(self):
+            return _Admin()
+
+    # mongomock's bulk_write does not accept the arguments newer pymongo operations pass to it
+    def bulk_write(self, operations, ordered=True, **kwargs):
+        for op in operations:
+            if isinstance(op, ReplaceOne):
+                self.replace_one(op._filter, op._doc, upsert=op._upsert)
+            else:
+                self.update_one(op._filter, op._doc, upsert=op._upsert)
+
+    mongomock.collection.Collection.bulk_write = bulk_write
+    shared = StandInClient()
+    pymongo.MongoClient = lambda *args, **kwargs: shared
+
+
+class StageTimer:
+    def __init__(self):
+        self.seconds = defaultdict(float)
+
+    def wrap(self, stage, func):
+        @functools.wraps(func)
+        def timed(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self.seconds[stage] += time.perf_counter() - started
+        return timed
+
+
+def peak_rss_mb():
+    # ru_maxrss 在 Linux 上以 KB 为单位，在 macOS 上以字节为单位
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+def generate(db_path, total_rows, options):
+    activity_rows = int(total_rows * options['activity_ratio'])
+    started = time.perf_counter()
+    populate_sqlite(db_path, total_rows - activity_rows, activity_rows, seed=options['seed'],
+                    schools=options['schools'], students=options['students'], skew=options['skew'],
+                    score_dist=options['score_dist'], late_fraction=options['late_fraction'])
+    return time.perf_counter() - started
+
+
+def run_pipeline(db_path, total_rows, options):
+    """Runs populate_stats until the stats have caught up with every generated row."""
+    os.chdir(HERE)
+    sys.path.insert(0, HERE)
+    install_mongo_stand_in()
+    import app
+    import event_time
+
+    app.logger.setLevel('WARNING')
+    rss_after_import = peak_rss_mb()
+
+    app.get_mysql_connection = lambda: SQLiteConnection(db_path)
+    app.MAX_ROWS_PER_CHUNK = options['chunk_rows']
+    app.FETCH_CHUNK_ROWS = options['fetch_rows']
+    app.MAX_TICK_SECONDS = float('inf')
+    if app.leader_elector is not None:
+        app.leader_elector.heartbeat()
+    if options['event_time']:
+        if app.event_windows is None:
+            app.event_windows = event_time.EventTimeWindows(app.db['event_time_windows'])
+    else:
+        app.event_windows = None
+
+    timer = StageTimer()
+    app.get_latest_stats = timer.wrap('state', app.get_latest_stats)
+    app.get_chunk_end = timer.wrap('plan', app.get_chunk_end)
+    app.get_partial_from_mysql = timer.wrap('fetch', app.get_partial_from_mysql)
+    app.column_array = timer.wrap('decode', app.column_array)
+    app.aggregate_values = timer.wrap('aggregate', app.aggregate_values)
+    app.calculate_and_store_partials = timer.wrap('store', app.calculate_and_store_partials)
+    app.get_newest_event_ms = timer.wrap('lag', app.get_newest_event_ms)
+    event_time.EventTimeChunk.add_rows = timer.wrap('decode', event_time.EventTimeChunk.add_rows)
+    if app.event_windows is not None:
+        app.event_windows.apply = timer.wrap('windows', app.event_windows.apply)
+
+    started = time.perf_counter()
+    ticks = 0
+    while True:
+        ticks += 1
+        app.populate_stats()
+        if app.SCHEDULER_METRICS['lag_ms'] == 0 or app.SCHEDULER_METRICS['rows_last_tick'] == 0:
+            break
+    elapsed = time.perf_counter() - started
+
+    stats = app.get_stats()[0]
+    processed = stats['num_grade_readings'] + stats['num_activity_readings']
+    if processed != total_rows:
+        raise RuntimeError(f"Pipeline processed {processed} of {total_rows} rows")
+
+    seconds = dict(timer.seconds)
+    # fetch 的计时包含嵌套在其中的 decode 和 aggregate，这里只保留查询与游标读取本身
+    seconds['fetch'] = seconds.get('fetch', 0.0) - seconds.get('decode', 0.0) - seconds.get('aggregate', 0.0)
+    return {
+        'rows': total_rows,
+        'seconds': elapsed,
+        'rows_per_second': total_rows / elapsed,
+        'ticks': ticks,
+        'chunks': app.SCHEDULER_METRICS['chunks_last_tick'],
+        'rss_after_import_mb': rss_after_import,
+        'peak_rss_mb': peak_rss_mb(),
+        'stages': {stage: seconds.get(stage, 0.0) for stage in STAGES},
+    }
+
+
+def run_in_fresh_process(func, *args):
+    with ProcessPoolExecutor(max_workers=1, mp_context=get_context('spawn')) as pool:
+        return pool.submit(func, *args).result()
+
+
+def print_result(result, generate_seconds):
+    print(f"\nrows={result['rows']:,}  generate={generate_seconds:.1f}s  pipeline={result['seconds']:.2f}s  "
+          f"{result['rows_per_second']:,.0f} rows/s  chunks={result['chunks']}  "
+          f"peak RSS={result['peak_rss_mb']:.0f} MB (after import {result['rss_after_import_mb']:.0f} MB)")
+    for stage in STAGES:
+        seconds = result['stages'][stage]
+        share = seconds / result['seconds'] * 100 if result['seconds'] else 0.0
+        print(f"  {stage:<10} {seconds * 1000:10.1f} ms  {share:5.1f}%")
+
+
+def check_baseline(results, baseline_path, max_regression):
+    with open(baseline_path, 'r') as f:
+        baseline = {entry['rows']: entry for entry in json.load(f)['results']}
+    failed = False
+    for result in results:
+        previous = baseline.get(result['rows'])
+        if previous is None:
+            continue
+        change = result['rows_per_second'] / previous['rows_per_second'] - 1
+        status = 'OK'
+        if change < -max_regression:
+            status = 'REGRESSION'
+            failed = True
+        print(f"rows={result['rows']:,}: {result['rows_per_second']:,.0f} rows/s vs baseline "
+              f"{previous['rows_per_second']:,.0f} ({change:+.1%}) {status}")
+    return not failed
+
+
+def event_time_enabled():
+    """event_time.enabled of the service's app_conf.yml, so the benchmark runs the pipeline as deployed."""
+    with open(os.path.join(HERE, 'app_conf.yml'), 'r') as f:
+        return bool(yaml.safe_load(f.read()).get('event_time', {}).get('enabled', False))
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 1000000])
+    arg_parser.add_argument('--chunk-rows', type=int, default=50000, help="scheduler.max_rows_per_chunk")
+    arg_parser.add_argument('--fetch-rows', type=int, default=10000, help="mysql.fetch_chunk_rows")
+    arg_parser.add_argument('--event-time', action=argparse.BooleanOptionalAction, default=event_time_enabled(),
+                            help="maintain event-time windows (default: event_time.enabled of app_conf.yml)")
+    arg_parser.add_argument('--activity-ratio', type=float, default=0.3)
+    arg_parser.add_argument('--schools', type=int, default=200)
+    arg_parser.add_argument('--students', type=int, default=20000)
+    arg_parser.add_argument('--skew', type=float, default=1.3)
+    arg_parser.add_argument('--score-dist', choices=['normal', 'bimodal', 'uniform'], default='normal')
+    arg_parser.add_argument('--late-fraction', type=float, default=0.02)
+    arg_parser.add_argument('--seed', type=int, default=42)
+    arg_parser.add_argument('--workdir', default=None, help="directory for the SQLite files (default: a temp dir)")
+    arg_parser.add_argument('--save', default=None, help="write the results as JSON")
+    arg_parser.add_argument('--baseline', default=None, help="compare rows/s with a saved run")
+    arg_parser.add_argument('--max-regression', type=float, default=0.2)
+    args = arg_parser.parse_args()
+
+    options = {
+        'chunk_rows': args.chunk_rows, 'fetch_rows': args.fetch_rows, 'event_time': args.event_time,
+        'activity_ratio': args.activity_ratio, 'schools': args.schools, 'students': args.students,
+        'skew': args.skew, 'score_dist': args.score_dist, 'late_fraction': args.late_fraction, 'seed': args.seed,
+    }
+    print(f"Benchmark options: {options}")
+
+    results = []
+    with tempfile.TemporaryDirectory(dir=args.workdir) as workdir:
+        for size in args.sizes:
+            db_path = os.path.join(workdir, f"events_{size}.sqlite")
+            generate_seconds = run_in_fresh_process(generate, db_path, size, options)
+            result = run_in_fresh_process(run_pipeline, db_path, size, options)
+            os.remove(db_path)
+            print_result(result, generate_seconds)
+            results.append(result)
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump({'options': options, 'results': results}, f, indent=2)
+        print(f"\nSaved results to {args.save}")
+    if args.baseline and not check_baseline(results, args.baseline, args.max_regression):
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,112 @@
+"""
+Startup benchmark: time from launching a service to its first /healthz 200 (serving) and its
+first /readyz 200 (dependencies available), over several cold starts.
+
+Works for any of the services; run it from the service directory:
+    python bench_startup.py --cmd "gunicorn -c gunicorn.conf.py app:app" --url http://localhost:8100
+    python ../processing/bench_startup.py --cmd "python app.py" --url http://localhost:8090 --runs 10
+
+--save writes the medians to a JSON file; --baseline compares against one and exits 1 when a
+median regressed by more than --max-regression (e.g. 0.2 = 20%), so it can gate a CI job.
+"""
+import sys
+import json
+import time
+import shlex
+import signal
+import argparse
+import statistics
+import subprocess
+import httpx
+
+
+def wait_for(client, url, deadline, process):
+    """Polls ``url`` until it answers 200; returns the time it did, or None on timeout or exit."""
+    while time.perf_counter() < deadline:
+        if process.poll() is not None:
+            return None
+        try:
+            if client.get(url).status_code == 200:
+                return time.perf_counter()
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.02)
+    return None
+
+
+def cold_start(args):
+    """Starts the service once; returns (seconds to /healthz, seconds to /readyz), None where it did not get there."""
+    started = time.perf_counter()
+    process = subprocess.Popen(shlex.split(args.cmd), cwd=args.cwd, stdout=subprocess.DEVNULL,
+                               stderr=None if args.verbose else subprocess.DEVNULL)
+    try:
+        with httpx.Client(timeout=1) as client:
+            deadline = started + args.timeout
+            live = wait_for(client, f"{args.url}/healthz", deadline, process)
+            ready = wait_for(client, f"{args.url}/readyz", deadline, process) if live else None
+    finally:
+        process.send_signal(signal.SIGTERM)
+        try:
+            process.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            process.kill()
+            process.wait()
+    return (live - started if live else None), (ready - started if ready else None)
+
+
+def summary(samples):
+    reached = [sample for sample in samples if sample is not None]
+    if not reached:
+        return {'median': None, 'min': None, 'max': None, 'failed': len(samples)}
+    return {'median': round(statistics.median(reached), 3), 'min': round(min(reached), 3),
+            'max': round(max(reached), 3), 'failed': len(samples) - len(reached)}
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument('--cmd', default='gunicorn -c gunicorn.conf.py app:app')
+    arg_parser.add_argument('--cwd', default='.')
+    arg_parser.add_argument('--url', default='http://localhost:8100')
+    arg_parser.add_argument('--runs', type=int, default=5)
+    arg_parser.add_argument('--timeout', type=float, default=60, help='seconds to wait for /readyz per run')
+    arg_parser.add_argument('--save', help='write the results to this JSON file')
+    arg_parser.add_argument('--baseline', help='compare against results saved with --save')
+    arg_parser.add_argument('--max-regression', type=float, default=0.2)
+    arg_parser.add_argument('--verbose', action='store_true', help="show the service's stderr")
+    args = arg_parser.parse_args()
+
+    live_samples, ready_samples = [], []
+    for run in range(1, args.runs + 1):
+        live, ready = cold_start(args)
+        live_samples.append(live)
+        ready_samples.append(ready)
+        print(f"run {run}: /healthz {f'{live:.3f}s' if live else 'timed out'}, "
+              f"/readyz {f'{ready:.3f}s' if ready else 'timed out'}")
+
+    results = {'cmd': args.cmd, 'runs': args.runs, 'healthz': summary(live_samples), 'readyz': summary(ready_samples)}
+    for probe in ('healthz', 'readyz'):
+        stats = results[probe]
+        print(f"/{probe:8s} median {stats['median']}s  min {stats['min']}s  max {stats['max']}s  failed {stats['failed']}")
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressed = False
+        for probe in ('healthz', 'readyz'):
+            before, after = baseline[probe]['median'], results[probe]['median']
+            if before is None or after is None:
+                continue
+            change = (after - before) / before
+            print(f"/{probe}: {before}s -> {after}s ({change:+.0%})")
+            regressed = regressed or change > args.max_regression
+        if regressed or results['healthz']['failed']:
+            print(f"Startup regressed by more than {args.max_regression:.0%} or failed.")
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,277 @@
+"""
+Event-time windowing for the processing stats.
+
+Besides the cumulative stats (keyed on ingestion time, ``date_created``), events can be bucketed
+by their client ``timestamp`` into fixed windows stored one document per window in MongoDB.
+
+- Every window document holds a mergeable partial (see aggregation.py), so an event that arrives
+  late only amends the windows it falls into; nothing is recomputed and untouched windows are
+  never rewritten.
+- Per event type, the watermark is the newest event time seen minus ``allowed_lateness``. Events
+  whose window ended before the watermark are too late: they are counted in ``dropped_late`` and
+  left out of the windows. Windows that end before the watermark are marked ``final``.
+- Each row is applied once: windows and the per-type state remember the ingestion bound
+  (``applied_through``) they already include and rows below it are left out, so replaying an
+  ingestion range after a failed stats write does not double count, also when the replay ends
+  later than the first attempt (``end`` is recomputed) or the first attempt stopped halfway.
+"""
+import math
+import time
+import logging
+from datetime import datetime, timedelta
+from pymongo import ReplaceOne, UpdateOne, ASCENDING
+from pymongo.errors import PyMongoError
+from aggregation import (np, INF, empty_partial, aggregate_values, merge_partials, histogram_edges)
+
+logger = logging.getLogger('basicLogger')
+
+EPOCH = datetime(1970, 1, 1)
+ONE_MS = timedelta(milliseconds=1)
+
+
+def to_epoch_ms(timestamp):
+    """Converts a naive (UTC) datetime or ISO string from MySQL into milliseconds since the epoch."""
+    if isinstance(timestamp, str):
+        timestamp = datetime.fromisoformat(timestamp)
+    return (timestamp - EPOCH) // ONE_MS
+
+
+class EventTimeChunk:
+    """
+    Collects the rows of one event type for one fetched ingestion range.
+    Rows are (value, timestamp, date_created) tuples as returned by the cursor. They are kept until
+    the chunk is applied and only then aggregated per window, leaving out the rows a window
+    already includes (``partials``).
+    """
+
+    def __init__(self, event_type, window_ms):
+        self.event_type = event_type
+        self.window_ms = window_ms
+        # NumPy: one array per fetched block; fallback: one entry per row
+        self._values = []
+        self._event_ms = []
+        self._created = []
+
+    def add_rows(self, rows):
+        """Decodes a fetched chunk and returns its value column as an array."""
+        if np is not None:
+            values = np.fromiter((row[0] for row in rows), dtype=np.float64, count=len(rows))
+            event_ms = np.array([row[1] for row in rows], dtype='datetime64[ms]').astype(np.int64)
+            created = np.fromiter((row[2] for row in rows), dtype=np.int64, count=len(rows))
+            keep = ~np.isnan(values)
+            values = values[keep]
+            self._values.append(values)
+            self._event_ms.append(event_ms[keep])
+            self._created.append(created[keep])
+            return values
+
+        values = []
+        for value, timestamp, created in rows:
+            if value is None:
+                continue
+            self._values.append(value)
+            self._event_ms.append(to_epoch_ms(timestamp))
+            self._created.append(created)
+            values.append(value)
+        return values
+
+    def window_starts(self):
+        """Start of every window the chunk's rows fall into."""
+        if not self._values:
+            return []
+        if np is not None:
+            return [int(start) for start in np.unique(np.concatenate(self._event_ms) // self.window_ms * self.window_ms)]
+        return sorted({event_ms // self.window_ms * self.window_ms for event_ms in self._event_ms})
+
+    def partials(self, applied_through):
+        """
+        Aggregates the rows per window, counting a row only if its date_created is at or above
+        ``applied_through(window_start)``. Returns ({window_start: partial}, newest counted event time or None).
+        """
+        if not self._values:
+            return {}, None
+        if np is not None:
+            values = np.concatenate(self._values)
+            event_ms = np.concatenate(self._event_ms)
+            window_starts = event_ms // self.window_ms * self.window_ms
+            unique_starts = np.unique(window_starts)
+            thresholds = np.array([applied_through(int(start)) for start in unique_starts], dtype=np.int64)
+            keep = np.concatenate(self._created) >= thresholds[np.searchsorted(unique_starts, window_starts)]
+            values, event_ms, window_starts = values[keep], event_ms[keep], window_starts[keep]
+            if values.size == 0:
+                return {}, None
+
+            # 按窗口起点排序后分段，每段做一次向量化聚合
+            order = np.argsort(window_starts, kind='stable')
+            window_starts, sorted_values = window_starts[order], values[order]
+            boundaries = np.flatnonzero(np.diff(window_starts)) + 1
+            buckets = {int(segment_starts[0]): aggregate_values(segment_values, self.event_type)
+                       for segment_starts, segment_values in zip(np.split(window_starts, boundaries), np.split(sorted_values, boundaries))}
+            return buckets, int(event_ms.max())
+
+        grouped = {}
+        max_event_ms = None
+        thresholds = {}
+        for value, event_ms, created in zip(self._values, self._event_ms, self._created):
+            window_start = event_ms // self.window_ms * self.window_ms
+            if window_start not in thresholds:
+                thresholds[window_start] = applied_through(window_start)
+            if created < thresholds[window_start]:
+                continue
+            grouped.setdefault(window_start, []).append(value)
+            max_event_ms = event_ms if max_event_ms is None else max(max_event_ms, event_ms)
+        return {window_start: aggregate_values(window_values, self.event_type)
+                for window_start, window_values in grouped.items()}, max_event_ms
+
+
+class EventTimeWindows:
+    """MongoDB-backed store of event-time windows with a per-event-type watermark."""
+
+    def __init__(self, collection, window_seconds=3600, allowed_lateness_seconds=86400):
+        self.collection = collection
+        self.window_ms = int(window_seconds * 1000)
+        self.allowed_lateness_ms = int(allowed_lateness_seconds * 1000)
+
+    def ensure_indexes(self):
+        self.collection.create_index([('event_type', ASCENDING), ('window_start', ASCENDING)])
+
+    def new_chunk(self, event_type):
+        return EventTimeChunk(event_type, self.window_ms)
+
+    @staticmethod
+    def window_id(event_type, window_start):
+        return f"{event_type}:{window_start}"
+
+    @staticmethod
+    def state_id(event_type):
+        return f"{event_type}:state"
+
+    def get_state(self, event_type):
+        state = self.collection.find_one({'_id': self.state_id(event_type)}) or {}
+        return {
+            'max_event_ms': state.get('max_event_ms'),
+            'watermark_ms': state.get('watermark_ms'),
+            'dropped_late': state.get('dropped_late', 0),
+            'applied_through': state.get('applied_through', 0),
+        }
+
+    def apply(self, chunks, start, end):
+        """
+        Amends the windows touched by the chunks of the ingestion range [start, end).
+        Only affected windows are rewritten. Returns False if MongoDB could not be updated.
+        """
+        try:
+            for chunk in chunks:
+                self._apply_chunk(chunk, start, end)
+            return True
+        except PyMongoError as e:
+            logger.error(f"Failed to update event-time windows for [{start}, {end}): {e}")
+            return False
+
+    def _apply_chunk(self, chunk, start, end):
+        event_type = chunk.event_type
+        state = self.get_state(event_type)
+        if state['applied_through'] >= end:
+            logger.debug("Event-time windows of %s already include [%d, %d). Skipping replay.", event_type, start, end)
+            return
+
+        previous_max = state['max_event_ms'] if state['max_event_ms'] is not None else -INF
+        watermark = previous_max - self.allowed_lateness_ms
+        now_ms = int(time.time() * 1000)
+
+        ids = [self.window_id(event_type, window_start) for window_start in chunk.window_starts()]
+        existing = {doc['_id']: doc for doc in self.collection.find({'_id': {'$in': ids}})} if ids else {}
+
+        def applied_through(window_start):
+            # 窗口文档可能比状态更新（上次写入在中途失败）：取两者中较大的边界
+            doc = existing.get(self.window_id(event_type, window_start))
+            return max(state['applied_through'], doc.get('applied_through', 0) if doc else 0)
+
+        buckets, max_event_ms = chunk.partials(applied_through)
+        operations = []
+        dropped = late = 0
+        for window_start, partial in buckets.items():
+            window_end = window_start + self.window_ms
+            if window_end <= watermark:
+                # 超过允许的迟到时间：不再修改已定稿的窗口
+                dropped += partial["count"]
+                continue
+
+            doc = existing.get(self.window_id(event_type, window_start))
+            is_late = window_end <= previous_max
+            if is_late:
+                late += partial["count"]
+            merged = merge_partials(self._partial_from_window(event_type, doc), partial) if doc else partial
+            operations.append(ReplaceOne(
+                {'_id': self.window_id(event_type, window_start)},
+                self._window_doc(event_type, window_start, merged, doc, partial["count"] if is_late else 0, end, now_ms),
+                upsert=True
+            ))
+
+        # 事件时间不可能晚于写入时间：用 end 限制客户端时钟超前造成的水位线跳跃
+        new_max = previous_max
+        if max_event_ms is not None:
+            new_max = max(previous_max, min(max_event_ms, end))
+        new_watermark = new_max - self.allowed_lateness_ms if new_max != -INF else None
+        operations.append(UpdateOne(
+            {'_id': self.state_id(event_type)},
+            {'$set': {'watermark_for': event_type, 'max_event_ms': new_max if new_max != -INF else None,
+                      'watermark_ms': new_watermark, 'applied_through': end},
+             '$inc': {'dropped_late': dropped}},
+            upsert=True
+        ))
+        self.collection.bulk_write(operations, ordered=True)
+
+        if new_watermark is not None:
+            self.collection.update_many(
+                {'event_type': event_type, 'final': False, 'window_end': {'$lte': new_watermark}},
+                {'$set': {'final': True}}
+            )
+        if late or dropped:
+            logger.info(f"Event-time {event_type}: amended windows with {late} late events, dropped {dropped} events past the allowed lateness.")
+
+    def _partial_from_window(self, event_type, doc):
+        partial = empty_partial(event_type)
+        partial.update({key: doc[key] for key in ('count', 'sum', 'min', 'max', 'moments')})
+        partial["min"] = doc["min"] if doc["count"] else INF
+        partial["max"] = doc["max"] if doc["count"] else -INF
+        partial["hist"] = list(doc["histogram"]["counts"])
+        return partial
+
+    def _window_doc(self, event_type, window_start, partial, previous, late_count, applied_through, now_ms):
+        moments = partial["moments"]
+        variance = moments["m2"] / moments["count"] if moments["count"] > 0 else 0.0
+        return {
+            'event_type': event_type,
+            'window_start': window_start,
+            'window_end': window_start + self.window_ms,
+            'count': partial["count"],
+            'sum': partial["sum"],
+            'min': partial["min"],
+            'max': partial["max"],
+            'moments': dict(moments),
+            'avg': round(partial["sum"] / partial["count"], 2) if partial["count"] else 0.0,
+            'std': round(math.sqrt(variance), 2),
+            'histogram': {'edges': histogram_edges(event_type), 'counts': list(partial["hist"])},
+            'late_count': (previous or {}).get('late_count', 0) + late_count,
+            'revision': (previous or {}).get('revision', 0) + 1,
+            'final': False,
+            'applied_through': applied_through,
+            'updated_at': now_ms,
+        }
+
+    def get_windows(self, event_type, start_ms=None, end_ms=None, limit=100):
+        """Returns up to ``limit`` windows of one event type whose start lies in [start_ms, end_ms), newest last."""
+        query = {'event_type': event_type}
+        window_range = {}
+        if start_ms is not None:
+            window_range['$gte'] = start_ms
+        if end_ms is not None:
+            window_range['$lt'] = end_ms
+        if window_range:
+            query['window_start'] = window_range
+
+        projection = {'_id': 0, 'moments': 0, 'sum': 0, 'applied_through': 0}
+        windows = list(self.collection.find(query, projection).sort('window_start', -1).limit(limit))
+        windows.reverse()
+        return windows
@@ -0,0 +1,114 @@
+"""
+Liveness and readiness probes: GET /healthz and GET /readyz.
+
+- /healthz (liveness) only says the process is serving; it never looks at dependencies, so a
+  database outage does not make Kubernetes restart every pod
+- /readyz (readiness) answers 503 until every required dependency passed its last check, so a
+  new pod only gets traffic once it can serve it, and a pod that loses a dependency is taken out
+  of the Service endpoints until it is back
+- dependencies are checked by a background thread every ``interval_seconds`` (doubling up to
+  ``max_interval_seconds`` while one is down): startup never waits on a connection and probes
+  never open one. The drivers reconnect on their own; a dependency's ``on_ready`` callback runs
+  after its first successful check (e.g. index creation)
+"""
+import time
+import logging
+import threading
+
+logger = logging.getLogger('basicLogger')
+
+
+class Dependency:
+
+    def __init__(self, name, check, required=True, on_ready=None):
+        self.name = name
+        self.check = check
+        self.required = required
+        self.on_ready = on_ready
+        self.healthy = False
+        self.last_error = 'not checked yet'
+        self.last_checked = None
+        self.seconds = None
+
+    def run(self):
+        started = time.perf_counter()
+        try:
+            self.check()
+            if self.on_ready is not None:
+                # 失败时下次检查再试
+                self.on_ready()
+                self.on_ready = None
+        except Exception as e:
+            if self.healthy or self.last_checked is None:
+                logger.warning(f"Health: {self.name} is unavailable: {e}")
+            self.healthy, self.last_error = False, str(e)
+        else:
+            if not self.healthy:
+                logger.info(f"Health: {self.name} is available.")
+            self.healthy, self.last_error = True, None
+        self.last_checked = time.time()
+        self.seconds = time.perf_counter() - started
+
+    def state(self):
+        return {'healthy': self.healthy, 'required': self.required, 'error': self.last_error,
+                'checked_at': self.last_checked,
+                'check_ms': round(self.seconds * 1000, 1) if self.seconds is not None else None}
+
+
+class HealthMonitor:
+
+    def __init__(self, interval_seconds=5, max_interval_seconds=30):
+        self.interval_seconds = interval_seconds
+        self.max_interval_seconds = max_interval_seconds
+        self.dependencies = []
+        self.started_at = time.time()
+        self._thread = None
+        self._stop = threading.Event()
+
+    def add(self, name, check, required=True, on_ready=None):
+        """``check()`` raises if the dependency is unavailable; it should time out within a few seconds."""
+        self.dependencies.append(Dependency(name, check, required, on_ready))
+
+    def check_all(self):
+        """Runs every check once; returns True if all of them passed."""
+        for dependency in self.dependencies:
+            dependency.run()
+        return all(dependency.healthy for dependency in self.dependencies)
+
+    def _run(self):
+        interval = self.interval_seconds
+        while not self._stop.is_set():
+            if self.check_all():
+                interval = self.interval_seconds
+            else:
+                # 依赖不可用时逐步拉长检查间隔
+                interval = min(self.max_interval_seconds, interval * 2)
+            self._stop.wait(interval)
+
+    def start(self):
+        """Starts the check thread (in each worker process, after the fork)."""
+        if self._thread is None and self.dependencies:
+            self._thread = threading.Thread(target=self._run, name='health-checks', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def is_ready(self):
+        return all(dependency.healthy for dependency in self.dependencies if dependency.required)
+
+    def healthz(self):
+        """Flask view for GET /healthz."""
+        return {'status': 'ok', 'uptime_seconds': round(time.time() - self.started_at, 1)}, 200
+
+    def readyz(self):
+        """Flask view for GET /readyz."""
+        ready = self.is_ready()
+        body = {'status': 'ready' if ready else 'not ready',
+                'dependencies': {dependency.name: dependency.state() for dependency in self.dependencies}}
+        return body, 200 if ready else 503
+
+
+def monitor_from_config(conf):
+    conf = conf or {}
+    return HealthMonitor(conf.get('interval_seconds', 5), conf.get('max_interval_seconds', 30))
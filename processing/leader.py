@@ -0,0 +1,132 @@
+import os
+import time
+import socket
+import logging
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError, PyMongoError
+
+logger = logging.getLogger('basicLogger')
+
+
+def default_identity():
+    """
+    Identity of this replica: pod hostname plus pid, so two processes in one pod never share a lease.
+    """
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+class LeaderElector:
+    """
+    Lease-based leader election stored in a single MongoDB document.
+
+    The lease document looks like:
+        {"_id": <lease_name>, "holder": <identity>, "expires_at": <ms>, "fencing_token": <int>}
+
+    - A replica becomes leader by taking over an expired lease; every takeover increments
+      ``fencing_token`` so writes made by a stale leader can be detected and rejected.
+    - The leader renews the lease (extends ``expires_at``) on every heartbeat.
+    - ``expires_at`` is compared against wall-clock time, so replica clocks are assumed to be
+      within a small fraction of ``lease_seconds`` of each other.
+    """
+
+    def __init__(self, collection, lease_name, lease_seconds=30, identity=None):
+        self.collection = collection
+        self.lease_name = lease_name
+        self.lease_seconds = lease_seconds
+        self.identity = identity or default_identity()
+        self.token = None
+        # 本地租约截止时间 (monotonic)，用于在心跳之间判断是否仍是 leader
+        self._valid_until = 0.0
+
+    def heartbeat(self):
+        """
+        Renews the lease if we hold it, otherwise tries to acquire it. Returns True if this replica is the leader.
+        """
+        started = time.monotonic()
+        now_ms = int(time.time() * 1000)
+        expires_at = now_ms + int(self.lease_seconds * 1000)
+
+        try:
+            if self.token is not None:
+                doc = self.collection.find_one_and_update(
+                    {'_id': self.lease_name, 'holder': self.identity, 'expires_at': {'$gt': now_ms}},
+                    {'$set': {'expires_at': expires_at, 'renewed_at': now_ms}},
+                    return_document=ReturnDocument.AFTER
+                )
+                if doc:
+                    self._mark_leader(doc, started)
+                    return True
+                logger.warning(f"Leader lease '{self.lease_name}' lost by {self.identity} (fencing token {self.token}).")
+                self._mark_follower()
+
+            doc = self.collection.find_one_and_update(
+                {'_id': self.lease_name, '$or': [{'expires_at': {'$lte': now_ms}}, {'holder': self.identity}]},
+                {'$set': {'holder': self.identity, 'expires_at': expires_at, 'acquired_at': now_ms, 'renewed_at': now_ms},
+                 '$inc': {'fencing_token': 1}},
+                upsert=True,
+                return_document=ReturnDocument.AFTER
+            )
+            self._mark_leader(doc, started)
+            logger.info(f"Acquired leader lease '{self.lease_name}' as {self.identity} with fencing token {self.token}.")
+            return True
+
+        except DuplicateKeyError:
+            # 租约被其他副本持有且尚未过期：upsert 尝试插入相同 _id 失败
+            return False
+        except PyMongoError as e:
+            logger.error(f"Leader election heartbeat failed for {self.identity}: {e}")
+            self._mark_follower()
+            return False
+
+    def is_leader(self):
+        """Returns True while the lease obtained by the last successful heartbeat is still valid locally."""
+        return self.token is not None and time.monotonic() < self._valid_until
+
+    def validate(self, token):
+        """
+        Checks against MongoDB that ``token`` is still the current fencing token held by this replica.
+        Called right before writing results so a paused or partitioned ex-leader cannot overwrite newer stats.
+        """
+        now_ms = int(time.time() * 1000)
+        try:
+            doc = self.collection.find_one({'_id': self.lease_name})
+        except PyMongoError as e:
+            logger.error(f"Failed to validate fencing token {token}: {e}")
+            return False
+        return bool(doc) and doc.get('holder') == self.identity \
+            and doc.get('fencing_token') == token and doc.get('expires_at', 0) > now_ms
+
+    def release(self):
+        """Expires the lease immediately (e.g. on shutdown) so another replica can take over without waiting."""
+        if self.token is None:
+            return
+        try:
+            self.collection.update_one(
+                {'_id': self.lease_name, 'holder': self.identity, 'fencing_token': self.token},
+                {'$set': {'expires_at': 0}}
+            )
+            logger.info(f"Released leader lease '{self.lease_name}' held by {self.identity}.")
+        except PyMongoError as e:
+            logger.warning(f"Failed to release leader lease '{self.lease_name}': {e}")
+        finally:
+            self._mark_follower()
+
+    def _mark_leader(self, doc, started):
+        self.token = doc['fencing_token']
+        self._valid_until = started + self.lease_seconds
+
+    def _mark_follower(self):
+        self.token = None
+        self._valid_until = 0.0
+
+
+def bump_fencing_token(collection, lease_name):
+    """
+    Increments the fencing token of a lease without changing its holder.
+
+    Used by out-of-band writers (e.g. backfill.py) right before they install a stats document:
+    any scheduler tick already in flight fails ``validate`` and drops its result, while the
+    leader picks up the new token on its next renewal.
+    """
+    result = collection.update_one({'_id': lease_name}, {'$inc': {'fencing_token': 1}})
+    return result.modified_count > 0
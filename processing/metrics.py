@@ -0,0 +1,111 @@
+"""
+Prometheus metrics for the Python services, exposed on GET /metrics.
+
+- HTTP: request count per route/method/status, an in-flight gauge and a latency histogram per
+  route, recorded from Flask request hooks. The route label is the URL rule (e.g. /store/grade),
+  never the raw path, so label cardinality stays fixed.
+- upstream calls: latency histogram per target service and outcome
+- database: query latency histogram per database and operation
+- pool usage, scheduler state and other service-specific values are read at scrape time through
+  register_gauges callbacks, so the hot paths only pay for a counter increment and a histogram observe.
+- multi-worker serving (PROMETHEUS_MULTIPROC_DIR set, see serving.py): counters, gauges and
+  histograms are summed over all workers; the register_gauges values are those of the worker
+  that answers the scrape.
+"""
+import os
+import time
+from flask import g
+from flask import request as flask_request
+from prometheus_client import Counter, Gauge, Histogram, CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, generate_latest
+from prometheus_client import multiprocess
+from prometheus_client.core import GaugeMetricFamily, CounterMetricFamily
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+HTTP_REQUESTS = Counter('http_requests_total', 'HTTP requests handled', ['route', 'method', 'status'])
+HTTP_IN_FLIGHT = Gauge('http_requests_in_flight', 'HTTP requests currently being handled', multiprocess_mode='livesum')
+HTTP_LATENCY = Histogram('http_request_duration_seconds', 'HTTP request latency per route',
+                         ['route', 'method'], buckets=LATENCY_BUCKETS)
+UPSTREAM_LATENCY = Histogram('upstream_request_duration_seconds', 'Latency of calls to other services',
+                             ['upstream', 'outcome'], buckets=LATENCY_BUCKETS)
+DB_QUERY_LATENCY = Histogram('db_query_duration_seconds', 'Database query latency',
+                             ['db', 'operation'], buckets=LATENCY_BUCKETS)
+
+
+def observe_request(route, method, status, seconds):
+    HTTP_REQUESTS.labels(route, method, str(status)).inc()
+    HTTP_LATENCY.labels(route, method).observe(seconds)
+
+
+def instrument_flask(flask_app):
+    """Records count, in-flight and latency of every request handled by the Flask app."""
+
+    @flask_app.before_request
+    def _metrics_start():
+        g.metrics_started = time.perf_counter()
+        HTTP_IN_FLIGHT.inc()
+
+    @flask_app.after_request
+    def _metrics_status(response):
+        g.metrics_status = response.status_code
+        return response
+
+    @flask_app.teardown_request
+    def _metrics_finish(error=None):
+        started = g.pop('metrics_started', None)
+        if started is None:
+            return
+        HTTP_IN_FLIGHT.dec()
+        rule = flask_request.url_rule
+        # Without a response (errors left to Connexion's exception middleware) the status comes from the error
+        status = (g.pop('metrics_status', None) or getattr(flask_request.routing_exception, 'code', None)
+                  or getattr(error, 'status_code', None) or getattr(error, 'code', None) or 500)
+        observe_request(rule.rule if rule is not None else 'unmatched', flask_request.method, status,
+                        time.perf_counter() - started)
+
+
+class _CallbackCollector:
+    """Builds one metric family at scrape time from ``callback() -> [(label values, value), ...]``."""
+
+    def __init__(self, name, documentation, labelnames, callback, kind):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.callback = callback
+        self.family_class = CounterMetricFamily if kind == 'counter' else GaugeMetricFamily
+
+    def describe(self):
+        return [self.family_class(self.name, self.documentation, labels=self.labelnames)]
+
+    def collect(self):
+        family = self.family_class(self.name, self.documentation, labels=self.labelnames)
+        for label_values, value in self.callback():
+            if value is not None:
+                family.add_metric([str(label) for label in label_values], value)
+        yield family
+
+
+_callback_collectors = {}
+
+
+def register_gauges(name, documentation, labelnames, callback, kind='gauge'):
+    """
+    Registers a scrape-time metric family. Registering the same name again replaces the callback:
+    Connexion imports the app module a second time to resolve operationIds, and the functions of
+    that second import are the ones serving requests.
+    """
+    if name in _callback_collectors:
+        REGISTRY.unregister(_callback_collectors[name])
+    _callback_collectors[name] = _CallbackCollector(name, documentation, labelnames, callback, kind)
+    REGISTRY.register(_callback_collectors[name])
+
+
+def metrics_view():
+    """Flask view for GET /metrics."""
+    if 'PROMETHEUS_MULTIPROC_DIR' not in os.environ:
+        return generate_latest(REGISTRY), 200, {'Content-Type': CONTENT_TYPE_LATEST}
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry)
+    for collector in _callback_collectors.values():
+        registry.register(collector)
+    return generate_latest(registry), 200, {'Content-Type': CONTENT_TYPE_LATEST}
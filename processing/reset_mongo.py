@@ -51,6 +51,7 @@ def drop_and_reset_stats():
             logger.info("--------------------------------------------------")
             logger.info("Next Step: Restart the processing/app.py service.")
             logger.info("The scheduler will now start from a clean slate (last_updated=0) and recalculate ALL stats from MySQL, using the fixed logic.")
+            logger.info("For large histories, run `python backfill.py` instead to recompute the stats in parallel shards.")
             logger.info("--------------------------------------------------")
             return
 
@@ -0,0 +1,159 @@
+"""
+Synthetic grade and activity rows for benchmarking the processing pipeline.
+
+Rows match the storage service tables (see storage/models.py) and are written into a SQLite
+file that stands in for MySQL. The generator is vectorized with NumPy so tens of millions of
+rows can be produced in batches without holding them in memory.
+
+- schools and students are drawn from Zipf distributions (``skew``), so a few large schools
+  and very active students dominate, as in production
+- scores are ``normal`` (mean 72, sd 12), ``bimodal`` (pass/fail clusters) or ``uniform``
+  over 0-100; activity hours are log-normal
+- ``date_created`` (ingestion time) is spread evenly over ``span_ms``; the client ``timestamp``
+  lags it by a few seconds, except for ``late_fraction`` of rows delayed by up to
+  ``max_delay_hours`` (offline schools syncing later)
+
+Usage:
+    python synthetic_events.py --rows 1000000 --db /tmp/bench.sqlite
+"""
+import time
+import sqlite3
+import argparse
+import numpy as np
+
+BATCH_ROWS = 200000
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS grades (
+    id INTEGER PRIMARY KEY,
+    school_id TEXT NOT NULL, school_name TEXT NOT NULL, reporting_date TEXT NOT NULL,
+    student_id TEXT NOT NULL, student_name TEXT NOT NULL,
+    course TEXT NOT NULL, assignment TEXT NOT NULL, score REAL NOT NULL,
+    timestamp TEXT NOT NULL, date_created INTEGER NOT NULL, trace_id TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS activities (
+    id INTEGER PRIMARY KEY,
+    school_id TEXT NOT NULL, school_name TEXT NOT NULL, reporting_date TEXT NOT NULL,
+    student_id TEXT NOT NULL, student_name TEXT NOT NULL,
+    activity_type TEXT NOT NULL, activity_name TEXT NOT NULL, hours REAL NOT NULL,
+    timestamp TEXT NOT NULL, date_created INTEGER NOT NULL, trace_id TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS ix_grades_date_created ON grades (date_created);
+CREATE INDEX IF NOT EXISTS ix_activities_date_created ON activities (date_created);
+"""
+
+COURSES = np.array(["Maths", "English", "Physics", "Chemistry", "History", "ACIT3855 Service Based Architecture"])
+ASSIGNMENTS = np.array(["lab1", "lab2", "lab3", "Midterm Exam", "Final Exam", "Project"])
+ACTIVITY_TYPES = np.array(["Sports", "Volunteering", "Music", "Clubs"])
+ACTIVITY_NAMES = np.array(["Basketball", "Digital Coffee", "Choir", "Chess", "Robotics", "Soccer"])
+
+
+class SyntheticEvents:
+    """Generates batches of grade/activity row tuples ready for ``executemany``."""
+
+    def __init__(self, seed=42, schools=200, students=20000, skew=1.3, score_dist='normal',
+                 span_ms=7 * 24 * 3600 * 1000, end_ms=None, late_fraction=0.02, max_delay_hours=48):
+        self.rng = np.random.default_rng(seed)
+        self.schools = schools
+        self.students = students
+        self.skew = skew
+        self.score_dist = score_dist
+        self.span_ms = span_ms
+        self.end_ms = end_ms if end_ms is not None else int(time.time() * 1000) - 60000
+        self.late_fraction = late_fraction
+        self.max_delay_ms = int(max_delay_hours * 3600 * 1000)
+
+    def _zipf_ids(self, n, limit):
+        return np.minimum(self.rng.zipf(self.skew, n), limit) - 1
+
+    def _scores(self, n):
+        if self.score_dist == 'uniform':
+            scores = self.rng.uniform(0, 100, n)
+        elif self.score_dist == 'bimodal':
+            passing = self.rng.random(n) < 0.8
+            scores = np.where(passing, self.rng.normal(78, 8, n), self.rng.normal(42, 10, n))
+        else:
+            scores = self.rng.normal(72, 12, n)
+        return np.round(np.clip(scores, 0, 100), 1)
+
+    def _hours(self, n):
+        return np.round(np.clip(self.rng.lognormal(1.2, 0.7, n), 0, 60) * 2) / 2
+
+    def _times(self, offset, n, total):
+        """Evenly spaced ingestion times plus client timestamps that lag behind them."""
+        step = self.span_ms / max(total, 1)
+        date_created = (self.end_ms - self.span_ms + (np.arange(offset, offset + n) * step)).astype(np.int64)
+        delay = self.rng.exponential(3000, n).astype(np.int64)
+        late = self.rng.random(n) < self.late_fraction
+        delay[late] = self.rng.integers(0, self.max_delay_ms, int(late.sum()))
+        timestamps = np.datetime_as_string((date_created - delay).astype('datetime64[ms]'), unit='ms')
+        return date_created, timestamps
+
+    def batches(self, event_type, total, batch_rows=BATCH_ROWS):
+        """Yields lists of row tuples (without id) for the grades or activities table."""
+        for offset in range(0, total, batch_rows):
+            n = min(batch_rows, total - offset)
+            school = self._zipf_ids(n, self.schools)
+            student = self._zipf_ids(n, self.students)
+            date_created, timestamps = self._times(offset, n, total)
+            if event_type == 'grade':
+                first = COURSES[self.rng.integers(0, len(COURSES), n)]
+                second = ASSIGNMENTS[self.rng.integers(0, len(ASSIGNMENTS), n)]
+                values = self._scores(n)
+            else:
+                first = ACTIVITY_TYPES[self.rng.integers(0, len(ACTIVITY_TYPES), n)]
+                second = ACTIVITY_NAMES[self.rng.integers(0, len(ACTIVITY_NAMES), n)]
+                values = self._hours(n)
+
+            reporting_dates = np.datetime_as_string(timestamps.astype('datetime64[D]'))
+            yield [
+                (f"S{school[i]:04d}", f"School {school[i]}", reporting_dates[i],
+                 f"STU{student[i]:06d}", f"Student {student[i]}",
+                 first[i], second[i], float(values[i]),
+                 timestamps[i], int(date_created[i]), f"bench-{event_type}-{offset + i}")
+                for i in range(n)
+            ]
+
+
+def populate_sqlite(path, grade_rows, activity_rows, **generator_options):
+    """Creates (or appends to) a SQLite stand-in for the reportsDB MySQL database."""
+    generator = SyntheticEvents(**generator_options)
+    conn = sqlite3.connect(path)
+    try:
+        conn.executescript(SCHEMA)
+        for event_type, table_name, total in (('grade', 'grades', grade_rows), ('activity', 'activities', activity_rows)):
+            value_columns = "course, assignment, score" if event_type == 'grade' else "activity_type, activity_name, hours"
+            insert = f"""
+                INSERT INTO {table_name} (school_id, school_name, reporting_date, student_id, student_name,
+                                          {value_columns}, timestamp, date_created, trace_id)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """
+            for batch in generator.batches(event_type, total):
+                conn.executemany(insert, batch)
+            conn.commit()
+    finally:
+        conn.close()
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument('--rows', type=int, default=100000, help="total rows, split between grades and activities")
+    arg_parser.add_argument('--activity-ratio', type=float, default=0.3)
+    arg_parser.add_argument('--db', default='./bench_events.sqlite')
+    arg_parser.add_argument('--schools', type=int, default=200)
+    arg_parser.add_argument('--students', type=int, default=20000)
+    arg_parser.add_argument('--skew', type=float, default=1.3, help="Zipf exponent for schools and students (> 1)")
+    arg_parser.add_argument('--score-dist', choices=['normal', 'bimodal', 'uniform'], default='normal')
+    arg_parser.add_argument('--late-fraction', type=float, default=0.02)
+    arg_parser.add_argument('--seed', type=int, default=42)
+    args = arg_parser.parse_args()
+
+    activity_rows = int(args.rows * args.activity_ratio)
+    started = time.perf_counter()
+    populate_sqlite(args.db, args.rows - activity_rows, activity_rows, seed=args.seed, schools=args.schools,
+                    students=args.students, skew=args.skew, score_dist=args.score_dist, late_fraction=args.late_fraction)
+    print(f"Wrote {args.rows} rows to {args.db} in {time.perf_counter() - started:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+"""
+Replays of the event-time windows (event_time.py) against mongomock.
+
+    pip install -r requirements-bench.txt
+    python -m unittest test_event_time
+"""
+import unittest
+from datetime import timedelta
+from unittest import mock
+import mongomock
+from pymongo import ReplaceOne
+import event_time
+from event_time import EPOCH, EventTimeWindows
+
+WINDOW_MS = 3600 * 1000
+
+
+def rows(*events):
+    """(score, event time in ms, date_created in ms) -> cursor rows (value, timestamp, date_created)."""
+    return [(score, EPOCH + timedelta(milliseconds=event_ms), created) for score, event_ms, created in events]
+
+
+def bulk_write(collection, operations, ordered=True, **kwargs):
+    """mongomock's bulk_write does not accept the arguments newer pymongo operations pass to it."""
+    for op in operations:
+        if isinstance(op, ReplaceOne):
+            collection.replace_one(op._filter, op._doc, upsert=op._upsert)
+        else:
+            collection.update_one(op._filter, op._doc, upsert=op._upsert)
+
+
+class EventTimeReplayTest(unittest.TestCase):
+
+    def setUp(self):
+        patcher = mock.patch.object(mongomock.collection.Collection, 'bulk_write', bulk_write)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.windows = EventTimeWindows(mongomock.MongoClient().db.windows, window_seconds=3600,
+                                        allowed_lateness_seconds=86400)
+
+    def apply(self, fetched, start, end):
+        chunk = self.windows.new_chunk('grade')
+        chunk.add_rows(rows(*fetched))
+        self.assertTrue(self.windows.apply([chunk], start, end))
+
+    def window_count(self, window_start=0):
+        return self.windows.collection.find_one({'_id': EventTimeWindows.window_id('grade', window_start)})['count']
+
+    def test_replay_of_the_same_range(self):
+        first = [(50, 1000, 100), (70, 2000, 200)]
+        self.apply(first, 0, 1000)
+        self.apply(first, 0, 1000)
+        self.assertEqual(self.window_count(), 2)
+
+    def test_replay_with_a_later_end(self):
+        # populate_stats 重放时 end 会被重新计算得更晚：只合并新增的行
+        first = [(50, 1000, 100), (70, 2000, 200)]
+        self.apply(first, 0, 1000)
+        self.apply(first + [(90, 3000, 1500)], 0, 2000)
+        self.assertEqual(self.window_count(), 3)
+        self.assertEqual(self.windows.get_state('grade')['applied_through'], 2000)
+
+    def test_replay_after_a_write_stopped_halfway(self):
+        # 窗口文档已写入但状态未更新：该窗口只合并它尚未包含的行
+        first = [(50, 1000, 100), (60, WINDOW_MS + 1000, 150)]
+        self.apply(first, 0, 1000)
+        self.windows.collection.update_one({'_id': EventTimeWindows.state_id('grade')}, {'$set': {'applied_through': 0}})
+        self.apply(first + [(90, 3000, 1500)], 0, 2000)
+        self.assertEqual(self.window_count(0), 2)
+        self.assertEqual(self.window_count(WINDOW_MS), 1)
+
+    def test_replay_without_numpy(self):
+        with mock.patch.object(event_time, 'np', None):
+            self.test_replay_with_a_later_end()
+
+
+if __name__ == '__main__':
+    unittest.main()
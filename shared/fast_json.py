@@ -0,0 +1,105 @@
+"""
+JSON serialization of the API responses (``responses`` section of app_conf.yml).
+
+- ``json_library: orjson`` (default) serializes in C: datetimes, dataclass records (``__slots__``)
+  and numpy scalars natively, without intermediate dicts; when orjson is not installed the
+  service falls back to the stdlib and logs a warning
+- ``json_library: json`` is the stdlib encoder with compact separators (Connexion's default is
+  ``indent=2``)
+- both write naive datetimes as UTC with a ``Z`` suffix, like Connexion's encoder did
+- the same jsonifier serves the Connexion operations (``FlaskApp(jsonifier=...)``) and the
+  plain Flask views (``install_flask_provider``)
+- other libraries can be plugged in with ``register_library``
+"""
+import json
+import logging
+from decimal import Decimal
+import flask.json.provider
+from connexion.jsonifier import Jsonifier, JSONEncoder
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+logger = logging.getLogger('basicLogger')
+
+
+class RecordJSONEncoder(JSONEncoder):
+    """Connexion's encoder (datetimes, Decimal, UUID) plus the slotted dataclass records."""
+
+    def default(self, o):
+        if hasattr(o, '__dataclass_fields__'):
+            return {name: getattr(o, name) for name in o.__dataclass_fields__}
+        return super().default(o)
+
+
+class OrjsonJsonifier(Jsonifier):
+
+    OPTIONS = (orjson.OPT_NAIVE_UTC | orjson.OPT_UTC_Z | orjson.OPT_SERIALIZE_NUMPY) if orjson else 0
+
+    def __init__(self):
+        super().__init__(json)
+
+    @staticmethod
+    def _default(o):
+        if isinstance(o, Decimal):
+            return float(o)
+        raise TypeError(f"Object of type {type(o).__name__} is not JSON serializable")
+
+    def dumps(self, data, **kwargs):
+        # bytes：Connexion 和 Flask 的响应都直接接受，省去一次解码
+        return orjson.dumps(data, default=self._default, option=self.OPTIONS)
+
+    def loads(self, data):
+        try:
+            return orjson.loads(data)
+        except orjson.JSONDecodeError:
+            return data.decode() if isinstance(data, bytes) else data
+
+
+def stdlib_jsonifier():
+    return Jsonifier(json, cls=RecordJSONEncoder, separators=(',', ':'))
+
+
+def orjson_jsonifier():
+    if orjson is None:
+        logger.warning("JSON: orjson is not installed, using the stdlib encoder.")
+        return stdlib_jsonifier()
+    return OrjsonJsonifier()
+
+
+LIBRARIES = {'orjson': orjson_jsonifier, 'json': stdlib_jsonifier}
+
+
+def register_library(name, jsonifier_factory):
+    """Makes ``json_library: <name>`` in the responses config use ``jsonifier_factory()`` (a Connexion Jsonifier)."""
+    LIBRARIES[name] = jsonifier_factory
+
+
+def jsonifier_from_config(conf):
+    return LIBRARIES[(conf or {}).get('json_library', 'orjson')]()
+
+
+class JSONifierProvider(flask.json.provider.JSONProvider):
+    """Flask JSON provider backed by a Connexion jsonifier."""
+
+    def __init__(self, app, jsonifier):
+        super().__init__(app)
+        self.jsonifier = jsonifier
+
+    def dumps(self, obj, **kwargs):
+        data = self.jsonifier.dumps(obj)
+        return data.decode() if isinstance(data, bytes) else data
+
+    def loads(self, s, **kwargs):
+        return self.jsonifier.loads(s)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(self.jsonifier.dumps(obj), mimetype='application/json')
+
+
+def install_flask_provider(flask_app, jsonifier):
+    """Serializes the dicts returned by plain Flask views with the jsonifier too."""
+    flask_app.json = JSONifierProvider(flask_app, jsonifier)
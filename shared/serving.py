@@ -0,0 +1,96 @@
+"""
+Production serving settings, read by the service's gunicorn.conf.py (``serving`` section of app_conf.yml).
+
+- workers: ``serving.workers`` (a number or ``auto``), overridden by the WEB_CONCURRENCY environment
+  variable. ``auto`` sizes the workers from the CPU quota of the container (cgroup v2 ``cpu.max``
+  or cgroup v1 ``cpu.cfs_quota_us``) rather than the host's core count, so a pod limited to 200m
+  runs one worker and a pod with 2 CPUs runs two
+- threads: request threads per worker (gthread workers), or the size of the thread pool that
+  runs the sync views of a Connexion app on the event loop (uvicorn workers)
+- the app is imported once in the gunicorn master before forking (config, specs, templates);
+  connection pools and background threads are created per worker in the post_fork hook
+- SIGTERM drains: workers stop accepting connections and finish in-flight requests for up to
+  ``graceful_timeout_seconds`` before they are killed
+- with more than one worker, Prometheus metrics are aggregated over the workers through
+  ``PROMETHEUS_MULTIPROC_DIR`` (see metrics.py)
+"""
+import os
+import math
+import shutil
+
+DEFAULT_SETTINGS = {
+    'workers': 'auto',
+    'workers_per_cpu': 1,
+    'threads': 8,
+    'preload': True,
+    'graceful_timeout_seconds': 25,
+    'timeout_seconds': 60,
+    'keepalive_seconds': 5,
+    'max_requests': 0,
+    'max_requests_jitter': 0,
+    'metrics_dir': '/tmp/prometheus_multiproc',
+}
+
+
+def _read(path):
+    with open(path) as f:
+        return f.read().strip()
+
+
+def cpu_quota():
+    """CPUs granted by the container's cgroup limit, or None if unlimited or unknown."""
+    try:
+        quota, period = _read('/sys/fs/cgroup/cpu.max').split()
+        return int(quota) / int(period) if quota != 'max' else None
+    except (OSError, ValueError):
+        pass
+    try:
+        quota = int(_read('/sys/fs/cgroup/cpu/cpu.cfs_quota_us'))
+        period = int(_read('/sys/fs/cgroup/cpu/cpu.cfs_period_us'))
+        return quota / period if quota > 0 else None
+    except (OSError, ValueError):
+        return None
+
+
+def available_cpus():
+    """The CPU quota, capped by the cores this process may run on."""
+    cores = len(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else (os.cpu_count() or 1)
+    quota = cpu_quota()
+    return min(quota, cores) if quota else cores
+
+
+def settings(conf):
+    """Merges the ``serving`` section with the defaults and resolves the worker count."""
+    merged = dict(DEFAULT_SETTINGS)
+    merged.update({key: value for key, value in (conf or {}).items() if key in DEFAULT_SETTINGS})
+    workers = os.environ.get('WEB_CONCURRENCY') or merged['workers']
+    if workers == 'auto':
+        # 配额不足一个核时也至少一个 worker
+        workers = max(1, math.ceil(available_cpus() * merged['workers_per_cpu']))
+    merged['workers'] = int(workers)
+    return merged
+
+
+def prepare_metrics_dir(serving_settings):
+    """
+    Points prometheus_client at an emptied multiprocess directory when there is more than one
+    worker. Must run before prometheus_client is imported, i.e. in gunicorn.conf.py.
+    """
+    if serving_settings['workers'] < 2:
+        return
+    path = os.environ.setdefault('PROMETHEUS_MULTIPROC_DIR', serving_settings['metrics_dir'])
+    shutil.rmtree(path, ignore_errors=True)
+    os.makedirs(path, exist_ok=True)
+
+
+def worker_exited(pid):
+    """gunicorn child_exit hook: drops the live gauges of a dead worker from the aggregated metrics."""
+    if 'PROMETHEUS_MULTIPROC_DIR' in os.environ:
+        from prometheus_client import multiprocess
+        multiprocess.mark_process_dead(pid)
+
+
+async def limit_threadpool(threads):
+    """Sets the size of the thread pool that runs sync views on the event loop (call in the lifespan)."""
+    import anyio.to_thread
+    anyio.to_thread.current_default_thread_limiter().total_tokens = threads
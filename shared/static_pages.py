@@ -0,0 +1,53 @@
+"""
+Pre-rendered, pre-compressed HTML pages.
+
+Pages whose output never changes are rendered once at startup and served from bytes:
+- gzip (and brotli, when the brotli package is installed) variants are compressed once
+- each variant has a strong ETag, so revalidation answers 304 without a body
+- Cache-Control: pages behind a login are ``private, no-cache`` (the browser keeps them but
+  revalidates every use, so a logged-out user is sent to the login page and an unchanged page
+  costs a 304); only public pages get a ``max-age``. Vary: Accept-Encoding keeps caches per encoding
+
+Pages with per-request values are compiled once (``app.jinja_env.from_string``) and only
+rendered per request.
+"""
+import gzip
+import hashlib
+from flask import request, Response
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# 服务器偏好顺序：优先 br，其次 gzip
+ENCODINGS = ('br', 'gzip', 'identity')
+
+
+class StaticPage:
+
+    def __init__(self, body, content_type='text/html; charset=utf-8', max_age=None):
+        """``max_age``: seconds browsers may reuse a public page without asking; None revalidates every time."""
+        if isinstance(body, str):
+            body = body.encode('utf-8')
+        digest = hashlib.sha256(body).hexdigest()[:32]
+        self.content_type = content_type
+        self.cache_control = "private, no-cache" if max_age is None else f"private, max-age={max_age}"
+        # encoding -> (bytes, unquoted etag)
+        self.variants = {'identity': (body, digest), 'gzip': (gzip.compress(body, 9, mtime=0), f"{digest}-gzip")}
+        if brotli is not None:
+            self.variants['br'] = (brotli.compress(body, quality=11), f"{digest}-br")
+
+    def response(self):
+        """Serves the variant the client accepts best, or 304 if it already has the page."""
+        available = [encoding for encoding in ENCODINGS if encoding in self.variants]
+        encoding = request.accept_encodings.best_match(available, default='identity')
+        body, etag = self.variants[encoding]
+        headers = {'ETag': f'"{etag}"', 'Cache-Control': self.cache_control, 'Vary': 'Accept-Encoding'}
+
+        if any(request.if_none_match.contains_weak(tag) for _, tag in self.variants.values()) or request.if_none_match.star_tag:
+            return Response(status=304, headers=headers)
+
+        if encoding != 'identity':
+            headers['Content-Encoding'] = encoding
+        return Response(body, headers=headers, content_type=self.content_type)
@@ -0,0 +1,58 @@
+"""
+Copies the shared helper modules into the services that use them.
+
+Every service is built from its own directory (docker build context ./<service>) and runs from
+it, so each one carries a copy of the helpers it imports. shared/ holds the only copies that are
+edited; the per-service files are generated and must stay byte-identical:
+
+    edit shared/<module>.py, then run   python shared/sync_shared.py
+    check for drift (e.g. in CI)        python shared/sync_shared.py --check
+
+To give a service a helper, add the service to MODULES (and a COPY line to its dockerfile).
+"""
+import os
+import sys
+import shutil
+import filecmp
+import argparse
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SHARED = os.path.join(ROOT, 'shared')
+
+MODULES = {
+    'metrics.py': ['api_gateway', 'data_entry_web', 'processing', 'storage'],
+    'serving.py': ['api_gateway', 'data_entry_web', 'processing', 'storage'],
+    'health.py': ['api_gateway', 'data_entry_web', 'processing', 'storage'],
+    'log_pipeline.py': ['api_gateway', 'data_entry_web', 'processing', 'storage'],
+    'tracing.py': ['api_gateway', 'data_entry_web', 'storage'],
+    'static_pages.py': ['api_gateway', 'data_entry_web'],
+    'fast_json.py': ['processing', 'storage'],
+}
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument('--check', action='store_true', help='only report copies that differ from shared/')
+    args = arg_parser.parse_args()
+
+    drifted = []
+    for module, services in MODULES.items():
+        source = os.path.join(SHARED, module)
+        for service in services:
+            target = os.path.join(ROOT, service, module)
+            if os.path.exists(target) and filecmp.cmp(source, target, shallow=False):
+                continue
+            drifted.append(target)
+            if not args.check:
+                shutil.copyfile(source, target)
+                print(f"updated {os.path.relpath(target, ROOT)}")
+
+    if args.check and drifted:
+        for target in drifted:
+            print(f"out of date: {os.path.relpath(target, ROOT)}")
+        print("Edit shared/ and run: python shared/sync_shared.py")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,289 @@
+"""
+Trace context propagation and span recording for the write path
+(gateway proxy -> data entry web -> storage -> database).
+
+- the context travels between services in the W3C ``traceparent`` header
+  (``00-<trace id>-<parent span id>-<flags>``); inside a service the current span is kept in a
+  contextvar, so it follows the request in Flask threads and in asyncio tasks alike
+- sampling is decided once at the root (``sample_ratio``) and inherited through the sampled flag,
+  so a trace is recorded in every service or in none; unsampled spans only carry ids
+- finished spans are queued and exported in batches by a background thread, so requests never
+  wait on the exporter; when the queue is full spans are dropped and counted
+- exporters are pluggable (``register_exporter``): ``none`` (the default) discards, ``file``
+  appends one OTLP/JSON ExportTraceServiceRequest per line (the format of the OpenTelemetry
+  collector's file exporter) and rotates the file at ``max_bytes`` keeping ``backup_count`` old
+  files, ``otlp_http`` posts the same JSON to a collector's /v1/traces
+"""
+import os
+import re
+import json
+import time
+import queue
+import random
+import atexit
+import logging
+import threading
+import contextvars
+from contextlib import contextmanager
+
+logger = logging.getLogger('basicLogger')
+
+TRACEPARENT_HEADER = 'traceparent'
+TRACEPARENT_PATTERN = re.compile(r'^00-([0-9a-f]{32})-([0-9a-f]{16})-([0-9a-f]{2})$')
+EXPORT_BATCH_SIZE = 512
+
+_current_span = contextvars.ContextVar('current_span', default=None)
+
+
+class SpanContext:
+    __slots__ = ('trace_id', 'span_id', 'sampled')
+
+    def __init__(self, trace_id, span_id, sampled):
+        self.trace_id = trace_id
+        self.span_id = span_id
+        self.sampled = sampled
+
+    def traceparent(self):
+        return f"00-{self.trace_id}-{self.span_id}-{'01' if self.sampled else '00'}"
+
+
+def parse_traceparent(value):
+    """Returns the remote SpanContext of a traceparent header, or None if it is missing or malformed."""
+    match = TRACEPARENT_PATTERN.match(value.strip().lower()) if value else None
+    if match is None or match.group(1) == '0' * 32 or match.group(2) == '0' * 16:
+        return None
+    return SpanContext(match.group(1), match.group(2), int(match.group(3), 16) & 1 == 1)
+
+
+def current_span():
+    return _current_span.get()
+
+
+def _otlp_value(value):
+    if isinstance(value, bool):
+        return {'boolValue': value}
+    if isinstance(value, int):
+        return {'intValue': str(value)}
+    if isinstance(value, float):
+        return {'doubleValue': value}
+    return {'stringValue': str(value)}
+
+
+class Span:
+    __slots__ = ('name', 'context', 'parent_id', 'kind', 'attributes', 'start_ns', 'end_ns', 'error')
+
+    # OTLP SpanKind values
+    KINDS = {'internal': 1, 'server': 2, 'client': 3}
+
+    def __init__(self, name, context, parent_id, kind, attributes):
+        self.name = name
+        self.context = context
+        self.parent_id = parent_id
+        self.kind = kind
+        self.attributes = attributes
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+        self.error = None
+
+    @property
+    def trace_id(self):
+        return self.context.trace_id
+
+    def set_attribute(self, key, value):
+        if self.context.sampled:
+            self.attributes[key] = value
+
+    def record_error(self, error):
+        self.error = str(error) or type(error).__name__
+
+    def to_otlp(self):
+        span = {
+            'traceId': self.context.trace_id,
+            'spanId': self.context.span_id,
+            'name': self.name,
+            'kind': self.KINDS.get(self.kind, 1),
+            'startTimeUnixNano': str(self.start_ns),
+            'endTimeUnixNano': str(self.end_ns),
+            'attributes': [{'key': key, 'value': _otlp_value(value)} for key, value in self.attributes.items()],
+            'status': {'code': 2, 'message': self.error} if self.error else {'code': 1},
+        }
+        if self.parent_id:
+            span['parentSpanId'] = self.parent_id
+        return span
+
+
+def otlp_request(service_name, spans):
+    """Wraps finished spans in an OTLP/JSON ExportTraceServiceRequest."""
+    return {'resourceSpans': [{
+        'resource': {'attributes': [{'key': 'service.name', 'value': {'stringValue': service_name}}]},
+        'scopeSpans': [{'scope': {'name': 'tracing'}, 'spans': [span.to_otlp() for span in spans]}],
+    }]}
+
+
+# --- Exporters ---
+
+class FileSpanExporter:
+
+    def __init__(self, service_name, file_path='./traces.jsonl', max_bytes=100 * 1024 * 1024, backup_count=3, **kwargs):
+        self.service_name = service_name
+        self.file_path = file_path
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+
+    def _rotate(self):
+        """traces.jsonl -> traces.jsonl.1 -> ... -> traces.jsonl.<backup_count>, the oldest is dropped."""
+        for index in range(self.backup_count - 1, 0, -1):
+            if os.path.exists(f"{self.file_path}.{index}"):
+                os.replace(f"{self.file_path}.{index}", f"{self.file_path}.{index + 1}")
+        if self.backup_count > 0:
+            os.replace(self.file_path, f"{self.file_path}.1")
+        else:
+            os.remove(self.file_path)
+
+    def export(self, spans):
+        try:
+            if self.max_bytes and os.path.getsize(self.file_path) >= self.max_bytes:
+                self._rotate()
+        except FileNotFoundError:
+            # 另一个 worker 进程刚刚轮转了文件
+            pass
+        with open(self.file_path, 'a') as f:
+            f.write(json.dumps(otlp_request(self.service_name, spans), separators=(',', ':')) + '\n')
+
+
+class OTLPHttpSpanExporter:
+
+    def __init__(self, service_name, otlp_endpoint='http://localhost:4318/v1/traces', **kwargs):
+        import httpx
+        self.service_name = service_name
+        self.endpoint = otlp_endpoint
+        self.client = httpx.Client(timeout=5)
+
+    def export(self, spans):
+        self.client.post(self.endpoint, json=otlp_request(self.service_name, spans))
+
+
+EXPORTERS = {'file': FileSpanExporter, 'otlp_http': OTLPHttpSpanExporter, 'none': None}
+
+
+def register_exporter(name, exporter_class):
+    """Makes ``exporter: <name>`` in the tracing config build ``exporter_class(service_name, **conf)``."""
+    EXPORTERS[name] = exporter_class
+
+
+# --- Tracer ---
+
+class Tracer:
+
+    def __init__(self, service_name, exporter=None, sample_ratio=1.0, max_queue=10000):
+        self.service_name = service_name
+        self.exporter = exporter
+        self.sample_ratio = sample_ratio
+        self.spans_started = 0
+        self.spans_exported = 0
+        self.spans_dropped = 0
+        self.export_errors = 0
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._worker = None
+        if exporter is not None:
+            self._start_worker()
+            atexit.register(self.shutdown)
+
+    def _start_worker(self):
+        self._worker = threading.Thread(target=self._export_loop, name='span-exporter', daemon=True)
+        self._worker.start()
+
+    def after_fork(self):
+        """Restarts the export thread in a forked worker (threads do not survive fork)."""
+        if self.exporter is not None:
+            self._queue = queue.Queue(maxsize=self._queue.maxsize)
+            self._start_worker()
+
+    def _new_context(self, parent):
+        span_id = f"{random.getrandbits(64):016x}"
+        if parent is None:
+            # 根 span：在这里做一次采样决定，之后通过 traceparent 的 sampled 标志继承
+            return SpanContext(f"{random.getrandbits(128):032x}", span_id, random.random() < self.sample_ratio)
+        return SpanContext(parent.trace_id, span_id, parent.sampled)
+
+    @contextmanager
+    def start_span(self, name, parent=None, kind='internal', attributes=None):
+        """
+        Runs the block as a span that is the current span inside it. ``parent`` is a remote
+        SpanContext (from parse_traceparent); without it the span is a child of the current span,
+        or the root of a new trace.
+        """
+        if parent is None and _current_span.get() is not None:
+            parent = _current_span.get().context
+        span = Span(name, self._new_context(parent), parent.span_id if parent else None, kind, attributes or {})
+        token = _current_span.set(span)
+        try:
+            yield span
+        except BaseException as e:
+            span.record_error(e)
+            raise
+        finally:
+            _current_span.reset(token)
+            self.spans_started += 1
+            if span.context.sampled and self.exporter is not None:
+                span.end_ns = time.time_ns()
+                try:
+                    self._queue.put_nowait(span)
+                except queue.Full:
+                    self.spans_dropped += 1
+
+    def inject(self, headers):
+        """Adds the traceparent of the current span to outgoing request headers."""
+        span = _current_span.get()
+        if span is not None:
+            headers[TRACEPARENT_HEADER] = span.context.traceparent()
+        return headers
+
+    def _export_loop(self):
+        while True:
+            batch = [self._queue.get()]
+            while len(batch) < EXPORT_BATCH_SIZE:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            self._export(batch)
+
+    def _export(self, batch):
+        try:
+            self.exporter.export(batch)
+            self.spans_exported += len(batch)
+        except Exception as e:
+            self.export_errors += 1
+            logger.warning(f"Tracing: failed to export {len(batch)} spans: {e}")
+        finally:
+            for _ in batch:
+                self._queue.task_done()
+
+    def shutdown(self, timeout=2):
+        """Exports the spans still queued (called at exit)."""
+        deadline = time.monotonic() + timeout
+        while self._queue.unfinished_tasks and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+    def stats(self):
+        return {'sample_ratio': self.sample_ratio, 'exporter': type(self.exporter).__name__ if self.exporter else None,
+                'spans_started': self.spans_started, 'spans_exported': self.spans_exported,
+                'spans_dropped': self.spans_dropped, 'export_errors': self.export_errors,
+                'queued': self._queue.qsize()}
+
+
+def tracer_from_config(service_name, conf):
+    """
+    Builds the service's Tracer from the ``tracing`` section of app_conf.yml. When tracing is
+    disabled the context is still propagated, but nothing is recorded.
+    """
+    conf = dict(conf or {})
+    if not conf.pop('enabled', True):
+        return Tracer(service_name, sample_ratio=0.0)
+    exporter_class = EXPORTERS[conf.pop('exporter', 'none')]
+    sample_ratio = conf.pop('sample_ratio', 1.0)
+    max_queue = conf.pop('max_queue', 10000)
+    exporter = exporter_class(service_name, **conf) if exporter_class else None
+    logger.info(f"Tracing: {service_name} samples {sample_ratio:.0%} of new traces, exporter {type(exporter).__name__ if exporter else None}.")
+    return Tracer(service_name, exporter, sample_ratio, max_queue)
@@ -1,11 +1,20 @@
 import connexion,os,json,yaml,logging, logging.config,time
+from flask import request
 from datetime import datetime
 from connexion import NoContent
-from sqlalchemy import create_engine,select
+from sqlalchemy import create_engine,select,event,insert,text
 from sqlalchemy.orm import sessionmaker
 import functools
-from models import GradeReading, ActivityReading
+from contextlib import asynccontextmanager
+from models import GradeReading, ActivityReading, GradeRecord, ActivityRecord, record_columns
 from dateutil import parser
+import metrics
+import tracing
+import serving
+import health
+import log_pipeline
+import fast_json
+import archive
 
 with open('./app_conf.yml','r') as f:
     app_config = yaml.safe_load(f.read())
@@ -16,20 +25,68 @@ hostname = app_config["datastore"]['hostname']
 port = app_config["datastore"]['port']
 db = app_config["datastore"]['db']
 
-ENGINE=create_engine(f"mysql+mysqlconnector://{user}:{password}@{hostname}:{port}/{db}",echo=True)
+# Connections are opened on first use, with a short connect timeout so a missing MySQL fails fast
+# SQL statements are logged only with datastore.echo_sql (see below), not through echo=True
+ENGINE=create_engine(f"mysql+mysqlconnector://{user}:{password}@{hostname}:{port}/{db}",
+                     connect_args={'connection_timeout': app_config["datastore"].get('connect_timeout', 5)})
 def make_session():
     return sessionmaker(bind=ENGINE)()
 
+# Columns read by get_grades/get_activities, in the field order of their record DTOs
+GRADE_COLUMNS = record_columns(GradeReading, GradeRecord)
+ACTIVITY_COLUMNS = record_columns(ActivityReading, ActivityRecord)
+
+# Prometheus: latency of every SQL statement by operation (select, insert, ...) and pool usage
+@event.listens_for(ENGINE, "before_cursor_execute")
+def start_query_timer(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_started', []).append(time.perf_counter())
+
+@event.listens_for(ENGINE, "after_cursor_execute")
+def observe_query_time(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info['query_started'].pop()
+    operation = statement.lstrip().split(None, 1)[0].lower() if statement.strip() else 'unknown'
+    metrics.DB_QUERY_LATENCY.labels('mysql', operation).observe(elapsed)
+
+def pool_gauges():
+    pool = ENGINE.pool
+    yield ('size',), pool.size()
+    yield ('checked_out',), pool.checkedout()
+    yield ('checked_in',), pool.checkedin()
+    yield ('overflow',), pool.overflow()
+
+metrics.register_gauges('db_pool_connections', 'SQLAlchemy connection pool usage', ['state'], pool_gauges)
+
 with open("log_conf.yml", "r") as f:
   LOG_CONFIG = yaml.safe_load(f.read())
-  logging.config.dictConfig(LOG_CONFIG)
+
+# Records are written by a background thread (log_pipeline.py), not by the request threads
+LOG_PIPELINE = log_pipeline.pipeline_from_config(LOG_CONFIG, app_config.get('logging'))
+metrics.register_gauges('log_records', 'Log records queued, dropped on a full queue or sampled out',
+                        ['event'], LOG_PIPELINE.counters, kind='counter')
+
+# echo_sql: every statement at INFO through the same queue (echo=True would write them synchronously)
+if app_config["datastore"].get('echo_sql', False):
+  logging.getLogger('sqlalchemy.engine').setLevel(logging.INFO)
 
 logger = logging.getLogger('basicLogger')
 
+# Trace spans of the store operations and their DB insert/commit, continuing the caller's trace
+tracer = tracing.tracer_from_config('storage', app_config.get('tracing'))
+
+# Months moved out of MySQL by archive_tables.py are read from the Parquet archive (archive.py)
+ARCHIVE = archive.archive_from_config(app_config.get('archive'))
+
+def archive_gauges():
+    for table, stats in (ARCHIVE.stats() if ARCHIVE is not None else {}).items():
+        for field, value in stats.items():
+            yield (table, field), value
+
+metrics.register_gauges('storage_archive', 'Cold-data archive: archived_until (ms), part files and bytes per table',
+                        ['table', 'field'], archive_gauges)
+
 # Stored event snow_report with a trace id of 123456789
 def logging_debug(event_name,trace_id):
-    msg = f"Stored event {event_name} with a trace id of {trace_id}"
-    logger.debug(msg)
+    logger.debug("Stored event %s with a trace id of %s", event_name, trace_id)
 
 
 # def user_db_session(func):
@@ -48,94 +105,193 @@ def user_db_session(func):
         with make_session() as session:
             return func(session, *args, **kwargs)
     return wrapper
+
+def traced(span_name):
+    """Runs the operation in a server span that continues the trace of the traceparent header."""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            parent = tracing.parse_traceparent(request.headers.get(tracing.TRACEPARENT_HEADER))
+            with tracer.start_span(span_name, parent=parent, kind='server'):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
 # MAX_BATCH_EVENTS = 5
 # GRADES_FILE = "grades.json"
 # ACTIVITIES_FILE = "activities.json"
 
 
-@user_db_session
-def report_grade(session,body):
-    event_name = "grade"
-    seconds_since_epoch = time.time()
-    ms_since_epoch = int(seconds_since_epoch * 1000)
-    timestamp_obj = parser.isoparse(body['timestamp'])
-    reporting_date = datetime.strptime(body['reporting_date'], "%Y-%m-%d")
-    grade = GradeReading(
+def grade_values(body, ms_since_epoch):
+    return dict(
         school_id = body["school_id"],
         school_name = body['school_name'],
-        reporting_date = reporting_date,
+        reporting_date = datetime.strptime(body['reporting_date'], "%Y-%m-%d"),
         student_id = body['student_id'],
         student_name = body['student_name'],
         course = body['course'],
         assignment = body['assignment'],
         score = body['score'],
-        timestamp = timestamp_obj,
+        timestamp = parser.isoparse(body['timestamp']),
         date_created = ms_since_epoch,
         trace_id = body['trace_id']
     )
+
+def store_batch(session, model, rows, skip_stored=False):
+    """
+    Inserts many rows with one executemany and commits them in one transaction; returns the rows inserted.
+    With ``skip_stored`` rows whose trace_id is already stored are left out, so a sender that retries
+    a batch (the data entry spool, one trace id per submission) does not store it twice. The SELECT
+    ... FOR UPDATE locks the trace_id index range: a concurrent retry of the same batch waits or is
+    rolled back as a deadlock and retried, then finds the rows.
+    """
+    if skip_stored:
+        with tracer.start_span('db select', attributes={'db.table': model.__tablename__, 'db.rows': len(rows)}):
+            stored = set(session.execute(select(model.trace_id).where(model.trace_id.in_({row['trace_id'] for row in rows}))
+                                         .with_for_update()).scalars())
+        rows = [row for row in rows if row['trace_id'] not in stored]
+    if rows:
+        with tracer.start_span('db insert', attributes={'db.table': model.__tablename__, 'db.rows': len(rows)}):
+            session.execute(insert(model), rows)
+    with tracer.start_span('db commit'), metrics.DB_QUERY_LATENCY.labels('mysql', 'commit').time():
+        session.commit()
+    return len(rows)
+
+@traced('report_grade')
+@user_db_session
+def report_grade(session,body):
+    event_name = "grade"
+    seconds_since_epoch = time.time()
+    ms_since_epoch = int(seconds_since_epoch * 1000)
+    grade = GradeReading(**grade_values(body, ms_since_epoch))
     session.add(grade)
-    session.commit()
+    with tracer.start_span('db insert', attributes={'db.table': GradeReading.__tablename__}):
+        session.flush()
+    with tracer.start_span('db commit'), metrics.DB_QUERY_LATENCY.labels('mysql', 'commit').time():
+        session.commit()
     logging_debug(event_name,body['trace_id'])
     # print("Successfully committed grade to database.")
     return NoContent, 201
 
+@traced('report_grade_batch')
+@user_db_session
+def report_grade_batch(session,body,skip_stored=False):
+    ms_since_epoch = int(time.time() * 1000)
+    stored = store_batch(session, GradeReading, [grade_values(item, ms_since_epoch) for item in body], skip_stored)
+    logger.debug("Stored %d grade events in one batch (%d already stored)", stored, len(body) - stored)
+    return NoContent, 201
+
+def read_window(session, model, record_class, columns, start, end):
+    """Records of [start, end): the archived part from the Parquet archive, the rest from MySQL."""
+    results = []
+    table = model.__tablename__
+    if ARCHIVE is not None and start < ARCHIVE.boundary(table):
+        with tracer.start_span('archive read', attributes={'db.table': table}), \
+                metrics.DB_QUERY_LATENCY.labels('archive', 'read').time():
+            results = ARCHIVE.read(table, record_class, start, end)
+        start = max(start, ARCHIVE.boundary(table))
+    if start < end:
+        statement = select(*columns).where(model.date_created >= start).where(model.date_created < end)
+        results.extend(record_class(*row) for row in session.execute(statement))
+    return results
+
 @user_db_session
 def get_grades(session,start_timestamp,end_timestamp):
     start = start_timestamp
     end = end_timestamp
-    statement = select(GradeReading).where(GradeReading.date_created >= start).where(GradeReading.date_created < end)
-    # results = [ result.to_dict() for result in session.execute(statement).scalars().all()]
-    results = []
-    for result in session.execute(statement).scalars().all():
-        results.append(result.to_dict())
-        
-    logger.debug(f"Found {len(results)} grade readings (start: {start}, end {end}")
+    results = read_window(session, GradeReading, GradeRecord, GRADE_COLUMNS, start, end)
+    logger.debug("Found %d grade readings (start: %s, end %s)", len(results), start, end)
     return results,200
 # http://localhost:8090/store/grade?start_timestamp=1759690422296&end_timestamp=1759690433310
 
-@user_db_session
-def report_activity(session,body):
-    event_name = "activity"
-    seconds_since_epoch = time.time()
-    ms_since_epoch = int(seconds_since_epoch * 1000)
-    timestamp_obj = parser.isoparse(body['timestamp'])
-    reporting_date = datetime.strptime(body['reporting_date'], "%Y-%m-%d")
-    activity = ActivityReading(
+def activity_values(body, ms_since_epoch):
+    return dict(
         school_id = body["school_id"],
         school_name = body['school_name'],
-        reporting_date = reporting_date,
+        reporting_date = datetime.strptime(body['reporting_date'], "%Y-%m-%d"),
         student_id = body['student_id'],
         student_name = body['student_name'],
         activity_type = body['activity_type'],
         activity_name = body['activity_name'],
         hours = body['hours'],
-        timestamp = timestamp_obj,
+        timestamp = parser.isoparse(body['timestamp']),
         date_created = ms_since_epoch,
         trace_id = body['trace_id']
     )
+
+@traced('report_activity')
+@user_db_session
+def report_activity(session,body):
+    event_name = "activity"
+    seconds_since_epoch = time.time()
+    ms_since_epoch = int(seconds_since_epoch * 1000)
+    activity = ActivityReading(**activity_values(body, ms_since_epoch))
     session.add(activity)
-    session.commit()
+    with tracer.start_span('db insert', attributes={'db.table': ActivityReading.__tablename__}):
+        session.flush()
+    with tracer.start_span('db commit'), metrics.DB_QUERY_LATENCY.labels('mysql', 'commit').time():
+        session.commit()
     logging_debug(event_name,body['trace_id'])
     # print("Successfully committed activity to database.")
     return NoContent, 201
 
+@traced('report_activity_batch')
+@user_db_session
+def report_activity_batch(session,body,skip_stored=False):
+    ms_since_epoch = int(time.time() * 1000)
+    stored = store_batch(session, ActivityReading, [activity_values(item, ms_since_epoch) for item in body], skip_stored)
+    logger.debug("Stored %d activity events in one batch (%d already stored)", stored, len(body) - stored)
+    return NoContent, 201
+
 @user_db_session
 def get_activities(session,start_timestamp,end_timestamp):
     # return {"status": "Route is working!", "start": start_timestamp,"end":end_timestamp}
     start = start_timestamp
     end = end_timestamp
-    statement = select(ActivityReading).where(ActivityReading.date_created >= start).where(ActivityReading.date_created < end)
-    # results = [ result.to_dict() for result in session.execute(statement).scalars().all()]
-    results = []
-    for result in session.execute(statement).scalars().all():
-        results.append(result.to_dict())
-        
-    logger.debug(f"Found {len(results)} activity readings (start: {start}, end {end}")
+    results = read_window(session, ActivityReading, ActivityRecord, ACTIVITY_COLUMNS, start, end)
+    logger.debug("Found %d activity readings (start: %s, end %s)", len(results), start, end)
     return results,200
 # http://localhost:8090/store/activity?start_timestamp=1759689552678&end_timestamp=1759690433310
 
-app = connexion.FlaskApp(__name__, specification_dir='')
-app.add_api('bcit-142-student_reports_storage_api-1.0.0-swagger.yaml',strict_validation=True, validate_responses=True)
+# Multi-process serving (gunicorn.conf.py): the app is imported in the gunicorn master, then forked
+SERVING_CONF = serving.settings(app_config.get('serving'))
+
+def post_fork():
+    """Per-worker setup after the fork: a fresh connection pool, span export and log writer threads."""
+    ENGINE.dispose(close=False)
+    tracer.after_fork()
+    LOG_PIPELINE.after_fork()
+
+# Readiness: MySQL reachable and the tables created by the create_tables job
+health_monitor = health.monitor_from_config(app_config.get('health'))
+
+def check_mysql():
+    with ENGINE.connect() as connection:
+        connection.execute(text('SELECT 1 FROM grades WHERE 1 = 0'))
+        connection.execute(text('SELECT 1 FROM activities WHERE 1 = 0'))
+
+health_monitor.add('mysql', check_mysql)
+
+@asynccontextmanager
+async def lifespan(app):
+    """Sizes the sync view thread pool, starts the dependency checks; closes the DB connections on shutdown."""
+    await serving.limit_threadpool(SERVING_CONF['threads'])
+    health_monitor.start()
+    yield
+    health_monitor.stop()
+    ENGINE.dispose()
+
+# Responses: serialized by fast_json.py; validated against the spec only where enabled (development)
+RESPONSES_CONF = app_config.get('responses', {})
+JSONIFIER = fast_json.jsonifier_from_config(RESPONSES_CONF)
+
+app = connexion.FlaskApp(__name__, specification_dir='', lifespan=lifespan, jsonifier=JSONIFIER)
+fast_json.install_flask_provider(app.app, JSONIFIER)
+app.add_api('bcit-142-student_reports_storage_api-1.0.0-swagger.yaml',strict_validation=True,
+            validate_responses=RESPONSES_CONF.get('validate', False))
+app.app.add_url_rule('/metrics', 'get_prometheus_metrics', metrics.metrics_view, methods=['GET'])
+app.app.add_url_rule('/healthz', 'healthz', health_monitor.healthz, methods=['GET'])
+app.app.add_url_rule('/readyz', 'readyz', health_monitor.readyz, methods=['GET'])
+metrics.instrument_flask(app.app)
 
 if __name__ == "__main__":
     app.run(port=8090,host='0.0.0.0')
@@ -0,0 +1,262 @@
+"""
+Cold-data archive: grades and activities older than ``older_than_days`` move from MySQL to
+zstd-compressed Parquet files, one directory per table and month; get_grades/get_activities
+read the archived part of a query window from those files.
+
+Layout under ``path``:
+    <table>/month=YYYY-MM/part-<first id>-<last id>.parquet   sorted by date_created, in row
+                                                               groups of ``row_group_size`` rows
+    <table>/_archived_until                                    date_created (ms) below which the
+                                                               table is read from the archive
+
+Archiving (archive_tables.py, a scheduled job) works in whole UTC months, oldest first, and can
+be interrupted at any point:
+1. rows of the month not yet in a part file (id above the month's last archived id) are written
+   to a temporary file, fsynced and renamed to a new part file
+2. _archived_until moves to the end of the month: from now on reads of the month use the files
+3. the month's rows are deleted from MySQL in batches of ``delete_batch`` rows
+A rerun skips the rows already in part files and finishes the deletes of an interrupted run.
+
+Reads memory-map the part files of the months a window overlaps, read only the record columns
+and skip the row groups whose date_created statistics fall outside the window.
+Needs pyarrow; without it the archive is disabled.
+"""
+import os
+import re
+import glob
+import logging
+from dataclasses import fields
+from datetime import datetime, timezone
+from sqlalchemy import select, delete, func, Integer, Float, DateTime
+from models import record_columns
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = pq = None
+
+logger = logging.getLogger('basicLogger')
+
+BOUNDARY_FILE = '_archived_until'
+PART_PATTERN = re.compile(r'part-(\d+)-(\d+)\.parquet$')
+
+
+def month_start(ms):
+    """Start (ms since epoch) of the UTC month that contains ``ms``."""
+    day = datetime.fromtimestamp(ms / 1000, tz=timezone.utc)
+    return int(datetime(day.year, day.month, 1, tzinfo=timezone.utc).timestamp() * 1000)
+
+
+def next_month(ms):
+    day = datetime.fromtimestamp(ms / 1000, tz=timezone.utc)
+    year, month = (day.year + 1, 1) if day.month == 12 else (day.year, day.month + 1)
+    return int(datetime(year, month, 1, tzinfo=timezone.utc).timestamp() * 1000)
+
+
+def month_name(ms):
+    return datetime.fromtimestamp(ms / 1000, tz=timezone.utc).strftime('%Y-%m')
+
+
+def arrow_schema(model, record_class):
+    """Parquet schema of a record: the model's column types, in the record's field order."""
+    arrow_fields = []
+    for field in fields(record_class):
+        column_type = model.__table__.columns[field.name].type
+        if isinstance(column_type, DateTime):
+            arrow_type = pa.timestamp('us')
+        elif isinstance(column_type, Float):
+            arrow_type = pa.float64()
+        elif isinstance(column_type, Integer):
+            arrow_type = pa.int64()
+        else:
+            arrow_type = pa.string()
+        arrow_fields.append(pa.field(field.name, arrow_type))
+    return pa.schema(arrow_fields)
+
+
+def _fsync(path):
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+class ColdArchive:
+
+    def __init__(self, path, compression='zstd', row_group_size=65536, delete_batch=10000):
+        self.path = path
+        self.compression = compression
+        self.row_group_size = row_group_size
+        self.delete_batch = delete_batch
+        self._boundaries = {}
+
+    def _table_dir(self, table):
+        return os.path.join(self.path, table)
+
+    def _month_dir(self, table, month):
+        return os.path.join(self.path, table, f"month={month_name(month)}")
+
+    # --- Reads ---
+
+    def boundary(self, table):
+        """date_created (ms) below which ``table`` is archived; 0 if nothing is."""
+        boundary_path = os.path.join(self._table_dir(table), BOUNDARY_FILE)
+        try:
+            mtime = os.stat(boundary_path).st_mtime_ns
+        except FileNotFoundError:
+            return 0
+        cached = self._boundaries.get(table)
+        if cached is None or cached[0] != mtime:
+            # 文件被归档任务替换（mtime 变化）时才重新读取
+            with open(boundary_path) as f:
+                cached = (mtime, int(f.read().strip() or 0))
+            self._boundaries[table] = cached
+        return cached[1]
+
+    def _parts(self, table, month):
+        """[(first id, last id, path)] of the month's part files."""
+        parts = []
+        for path in glob.glob(os.path.join(self._month_dir(table, month), 'part-*.parquet')):
+            match = PART_PATTERN.search(path)
+            if match:
+                parts.append((int(match.group(1)), int(match.group(2)), path))
+        return sorted(parts)
+
+    def _months(self, table):
+        """Start (ms) of every month directory of ``table``."""
+        months = []
+        for month_dir in glob.glob(os.path.join(self._table_dir(table), 'month=*')):
+            year, month = os.path.basename(month_dir)[len('month='):].split('-')
+            months.append(int(datetime(int(year), int(month), 1, tzinfo=timezone.utc).timestamp() * 1000))
+        return sorted(months)
+
+    def read(self, table, record_class, start, end):
+        """Records of the archived part of [start, end), as ``record_class`` instances."""
+        end = min(end, self.boundary(table))
+        columns = [field.name for field in fields(record_class)]
+        records = []
+        for month in self._months(table):
+            if month >= end or next_month(month) <= start:
+                continue
+            for _, _, path in self._parts(table, month):
+                data = pq.read_table(path, columns=columns, memory_map=True,
+                                     filters=[('date_created', '>=', start), ('date_created', '<', end)])
+                records.extend(map(record_class, *(data.column(name).to_pylist() for name in columns)))
+        return records
+
+    def stats(self):
+        tables = {}
+        for table_dir in sorted(glob.glob(os.path.join(self.path, '*'))):
+            table = os.path.basename(table_dir)
+            part_files = glob.glob(os.path.join(table_dir, 'month=*', 'part-*.parquet'))
+            tables[table] = {'archived_until': self.boundary(table), 'part_files': len(part_files),
+                             'bytes': sum(os.path.getsize(path) for path in part_files)}
+        return tables
+
+    # --- Archiving ---
+
+    def _set_boundary(self, table, until):
+        if until <= self.boundary(table):
+            return
+        boundary_path = os.path.join(self._table_dir(table), BOUNDARY_FILE)
+        with open(f"{boundary_path}.tmp", 'w') as f:
+            f.write(str(until))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(f"{boundary_path}.tmp", boundary_path)
+
+    def _write_month(self, engine, model, record_class, month):
+        """Writes the month's rows that are not in a part file yet to a new part; returns the row count."""
+        table = model.__tablename__
+        month_dir = self._month_dir(table, month)
+        os.makedirs(month_dir, exist_ok=True)
+        last_archived_id = max((last_id for _, last_id, _ in self._parts(table, month)), default=0)
+        statement = (select(*record_columns(model, record_class))
+                     .where(model.date_created >= month, model.date_created < next_month(month), model.id > last_archived_id)
+                     .order_by(model.date_created, model.id))
+        schema = arrow_schema(model, record_class)
+        temporary_path = os.path.join(month_dir, f".part-{os.getpid()}.parquet.tmp")
+        rows, first_id, last_id, writer = 0, None, None, None
+        try:
+            with engine.connect() as connection:
+                result = connection.execution_options(stream_results=True, yield_per=self.row_group_size).execute(statement)
+                for chunk in result.partitions():
+                    columns = list(zip(*chunk))
+                    batch = pa.Table.from_arrays([pa.array(values, type=field.type) for values, field in zip(columns, schema)],
+                                                 schema=schema)
+                    if writer is None:
+                        writer = pq.ParquetWriter(temporary_path, schema, compression=self.compression)
+                    writer.write_table(batch, row_group_size=self.row_group_size)
+                    ids = columns[0]
+                    first_id = min(ids) if first_id is None else min(first_id, min(ids))
+                    last_id = max(ids) if last_id is None else max(last_id, max(ids))
+                    rows += len(chunk)
+            if writer is None:
+                return 0
+            writer.close()
+            writer = None
+            # 先落盘再改名：MySQL 中的行只在归档文件完整写入后才删除
+            _fsync(temporary_path)
+            os.replace(temporary_path, os.path.join(month_dir, f"part-{first_id}-{last_id}.parquet"))
+            _fsync(month_dir)
+            return rows
+        finally:
+            if writer is not None:
+                writer.close()
+            if os.path.exists(temporary_path):
+                os.remove(temporary_path)
+
+    def _delete_archived(self, engine, model, until):
+        """Deletes the rows below ``until`` from MySQL in short transactions; returns the row count."""
+        deleted = 0
+        while True:
+            with engine.begin() as connection:
+                ids = connection.execute(select(model.id).where(model.date_created < until)
+                                         .limit(self.delete_batch)).scalars().all()
+                if not ids:
+                    return deleted
+                connection.execute(delete(model).where(model.id.in_(ids)))
+            deleted += len(ids)
+
+    def pending_months(self, engine, model, cutoff_ms):
+        """[(month start, rows in MySQL)] of the whole months before the month of ``cutoff_ms``."""
+        until = month_start(cutoff_ms)
+        with engine.connect() as connection:
+            oldest = connection.execute(select(func.min(model.date_created)).where(model.date_created < until)).scalar()
+            months = []
+            month = month_start(oldest) if oldest is not None else until
+            while month < until:
+                end = next_month(month)
+                count = connection.execute(select(func.count()).select_from(model)
+                                           .where(model.date_created >= month, model.date_created < end)).scalar()
+                if count:
+                    months.append((month, count))
+                month = end
+        return months
+
+    def archive_table(self, engine, model, record_class, cutoff_ms):
+        """Archives the whole months of ``model`` before the month of ``cutoff_ms``; returns {month: rows}."""
+        table = model.__tablename__
+        os.makedirs(self._table_dir(table), exist_ok=True)
+        archived = {}
+        for month, _ in self.pending_months(engine, model, cutoff_ms):
+            written = self._write_month(engine, model, record_class, month)
+            self._set_boundary(table, next_month(month))
+            deleted = self._delete_archived(engine, model, next_month(month))
+            logger.info(f"Archive: {table} {month_name(month)}: {written} rows written, {deleted} rows deleted from MySQL.")
+            archived[month_name(month)] = written
+        return archived
+
+
+def archive_from_config(conf):
+    """The ColdArchive of the ``archive`` section of app_conf.yml, or None if disabled."""
+    conf = conf or {}
+    if not conf.get('enabled', False):
+        return None
+    if pa is None:
+        logger.error("Archive: enabled but pyarrow is not installed; archived time ranges will not be read.")
+        return None
+    return ColdArchive(conf.get('path', './archive'), conf.get('compression', 'zstd'),
+                       conf.get('row_group_size', 65536), conf.get('delete_batch', 10000))
@@ -0,0 +1,54 @@
+"""
+Moves the grades and activities of whole months older than archive.older_than_days from MySQL to
+the Parquet archive (archive.py). Runs as a scheduled job (k8s CronJob storage-archive,
+``docker compose run --rm storage_archive``) or by hand:
+    python archive_tables.py
+    python archive_tables.py --older-than-days 365 --dry-run
+"""
+import time
+import logging
+import argparse
+import yaml
+from sqlalchemy import create_engine
+from models import GradeReading, ActivityReading, GradeRecord, ActivityRecord
+import archive
+
+with open('./app_conf.yml','r') as f:
+    app_config = yaml.safe_load(f.read())
+
+user = app_config["datastore"]['user']
+password = app_config["datastore"]['password']
+hostname = app_config["datastore"]['hostname']
+port = app_config["datastore"]['port']
+db = app_config["datastore"]['db']
+
+ENGINE=create_engine(f"mysql+mysqlconnector://{user}:{password}@{hostname}:{port}/{db}",
+                     connect_args={'connection_timeout': app_config["datastore"].get('connect_timeout', 5)})
+
+TABLES = [(GradeReading, GradeRecord), (ActivityReading, ActivityRecord)]
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument('--older-than-days', type=float,
+                            default=app_config.get('archive', {}).get('older_than_days', 180))
+    arg_parser.add_argument('--dry-run', action='store_true', help='only list the months that would be archived')
+    args = arg_parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    cold_archive = archive.archive_from_config({**app_config.get('archive', {}), 'enabled': True})
+    if cold_archive is None:
+        raise SystemExit("Archive: pyarrow is required to archive.")
+    cutoff_ms = int((time.time() - args.older_than_days * 86400) * 1000)
+    print(f"Archiving whole months before {archive.month_name(archive.month_start(cutoff_ms))} to {cold_archive.path} ...")
+    for model, record_class in TABLES:
+        if args.dry_run:
+            for month, rows in cold_archive.pending_months(ENGINE, model, cutoff_ms):
+                print(f"{model.__tablename__} {archive.month_name(month)}: {rows} rows")
+            continue
+        archived = cold_archive.archive_table(ENGINE, model, record_class, cutoff_ms)
+        print(f"{model.__tablename__}: {sum(archived.values())} rows archived in {len(archived)} months.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,147 @@
+"""
+Microbenchmark: per-request logging overhead of synchronous handlers vs. log_pipeline.py.
+
+Each simulated request logs what a storage/gateway request logs: two per-request INFO lines,
+two DEBUG lines and (with --echo-sql) the SQL statements SQLAlchemy echoes. The handlers are the
+ones of log_conf.yml (console + app.log), both writing to files in a temporary directory.
+
+sync      - log_conf.yml handlers called on the request thread, f-string messages
+            (what the services did before log_pipeline.py)
+pipeline  - records queued for the background writer thread, lazy %-style messages,
+            per-request lines sampled above the burst
+
+"request" is the time spent in the request threads; "drained" includes waiting until the
+writer thread has written every queued record.
+
+Runs without any service:
+    python bench_logging.py --requests 20000 --threads 8 --echo-sql
+    python bench_logging.py --level INFO
+"""
+import os
+import time
+import logging
+import logging.config
+import argparse
+import tempfile
+import statistics
+import threading
+import log_pipeline
+
+
+def log_config(directory, level):
+    return {
+        'version': 1,
+        'formatters': {'simple': {'format': '%(asctime)s - %(name)s - %(levelname)s - %(message)s'}},
+        'handlers': {
+            'console': {'class': 'logging.FileHandler', 'level': 'DEBUG', 'formatter': 'simple',
+                        'filename': os.path.join(directory, 'console.log')},
+            'file': {'class': 'logging.FileHandler', 'level': 'DEBUG', 'formatter': 'simple',
+                     'filename': os.path.join(directory, 'app.log')},
+        },
+        'loggers': {'basicLogger': {'level': level, 'handlers': ['console', 'file'], 'propagate': False}},
+        'root': {'level': 'DEBUG', 'handlers': ['console']},
+        'disable_existing_loggers': False,
+    }
+
+
+def eager_request(i, logger, sql_logger, echo_sql):
+    start, end = 1759690422296 + i, 1759690433310 + i
+    logger.info(f"Proxying Data Entry Web request (POST) from /submit to TARGET: http://data-entry:8071/submit?id={i}")
+    logger.debug(f"Stored event grade with a trace id of {i:032x}")
+    if echo_sql:
+        sql_logger.info(f"SELECT grades.id, grades.score FROM grades WHERE grades.date_created >= {start} AND grades.date_created < {end}")
+        sql_logger.info("COMMIT")
+    logger.debug(f"Found {i % 500} grade readings (start: {start}, end {end})")
+    logger.info(f"Proxy received status 200 from Data Entry Web for path 'submit?id={i}'.")
+
+
+def lazy_request(i, logger, request_logger, sql_logger, echo_sql):
+    start, end = 1759690422296 + i, 1759690433310 + i
+    request_logger.info("Proxying Data Entry Web request (%s) from %s to TARGET: %s", 'POST', '/submit',
+                        f"http://data-entry:8071/submit?id={i}")
+    logger.debug("Stored event %s with a trace id of %032x", 'grade', i)
+    if echo_sql:
+        sql_logger.info("SELECT grades.id, grades.score FROM grades WHERE grades.date_created >= %s AND grades.date_created < %s", start, end)
+        sql_logger.info("COMMIT")
+    logger.debug("Found %d grade readings (start: %s, end %s)", i % 500, start, end)
+    request_logger.info("Proxy received status %d from Data Entry Web for path '%s'.", 200, f"submit?id={i}")
+
+
+def run(args, mode, directory):
+    config = log_config(directory, args.level)
+    logger = logging.getLogger('basicLogger')
+    request_logger = log_pipeline.request_logger()
+    sql_logger = logging.getLogger('sqlalchemy.engine.Engine')
+    sql_logger.setLevel(logging.INFO)
+    for log_filter in list(request_logger.filters):
+        request_logger.removeFilter(log_filter)
+
+    pipeline = None
+    if mode == 'sync':
+        logging.config.dictConfig(config)
+        handle = lambda i: eager_request(i, logger, sql_logger, args.echo_sql)
+    else:
+        pipeline = log_pipeline.pipeline_from_config(config, {'request_burst_per_second': args.burst,
+                                                              'request_sample_ratio': args.sample_ratio,
+                                                              'max_queue': args.max_queue})
+        handle = lambda i: lazy_request(i, logger, request_logger, sql_logger, args.echo_sql)
+
+    per_thread = args.requests // args.threads
+    latencies = [[] for _ in range(args.threads)]
+
+    def worker(index):
+        samples = latencies[index]
+        for i in range(index * per_thread, (index + 1) * per_thread):
+            started = time.perf_counter()
+            handle(i)
+            samples.append(time.perf_counter() - started)
+
+    threads = [threading.Thread(target=worker, args=(index,)) for index in range(args.threads)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    request_seconds = time.perf_counter() - started
+    stats = None
+    if pipeline is not None:
+        stats = pipeline.stats()
+        pipeline.stop()
+    drained_seconds = time.perf_counter() - started
+
+    samples = sorted(sample for thread_samples in latencies for sample in thread_samples)
+    return {
+        'mean_us': statistics.fmean(samples) * 1e6,
+        'p99_us': samples[int(len(samples) * 0.99) - 1] * 1e6,
+        'request_seconds': request_seconds,
+        'drained_seconds': drained_seconds,
+        'stats': stats,
+    }
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument('--requests', type=int, default=20000)
+    arg_parser.add_argument('--threads', type=int, default=8)
+    arg_parser.add_argument('--level', default='DEBUG', help='level of basicLogger (DEBUG as in log_conf.yml, or INFO)')
+    arg_parser.add_argument('--echo-sql', action='store_true')
+    arg_parser.add_argument('--burst', type=int, default=50)
+    arg_parser.add_argument('--sample-ratio', type=float, default=0.1)
+    arg_parser.add_argument('--max-queue', type=int, default=100000)
+    args = arg_parser.parse_args()
+
+    print(f"{args.requests} requests on {args.threads} threads, basicLogger at {args.level}, "
+          f"SQL echo {'on' if args.echo_sql else 'off'}")
+    results = {}
+    for mode in ('sync', 'pipeline'):
+        with tempfile.TemporaryDirectory() as directory:
+            results[mode] = result = run(args, mode, directory)
+        print(f"{mode:9s} per request mean {result['mean_us']:7.1f} us  p99 {result['p99_us']:8.1f} us  "
+              f"requests {result['request_seconds']:.3f}s  drained {result['drained_seconds']:.3f}s")
+        if result['stats']:
+            print(f"          {result['stats']}")
+    print(f"per-request overhead: {results['sync']['mean_us'] / results['pipeline']['mean_us']:.1f}x lower with the pipeline")
+
+
+if __name__ == '__main__':
+    main()
@@ -16,6 +16,10 @@ ENGINE=create_engine(f"mysql+mysqlconnector://{user}:{password}@{hostname}:{port
 def create_all_tables():
     print("Creating tables...")
     Base.metadata.create_all(ENGINE)
+    # create_all 不修改已存在的表：补建之后新增的索引（如 trace_id）
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(ENGINE, checkfirst=True)
     print("Tables created successfully!")
 
 if __name__ == "__main__":
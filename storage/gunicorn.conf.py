@@ -0,0 +1,27 @@
+# Gunicorn settings of the Storage Service: gunicorn -c gunicorn.conf.py app:app
+# Worker count, threads and timeouts come from the serving section of app_conf.yml (see serving.py).
+import yaml
+import serving
+
+with open('./app_conf.yml', 'r') as f:
+    SERVING_CONF = serving.settings(yaml.safe_load(f.read()).get('serving'))
+serving.prepare_metrics_dir(SERVING_CONF)
+
+bind = '0.0.0.0:8090'
+worker_class = 'uvicorn_worker.UvicornWorker'
+workers = SERVING_CONF['workers']
+preload_app = SERVING_CONF['preload']
+graceful_timeout = SERVING_CONF['graceful_timeout_seconds']
+timeout = SERVING_CONF['timeout_seconds']
+keepalive = SERVING_CONF['keepalive_seconds']
+max_requests = SERVING_CONF['max_requests']
+max_requests_jitter = SERVING_CONF['max_requests_jitter']
+
+
+def post_fork(server, worker):
+    import app
+    app.post_fork()
+
+
+def child_exit(server, worker):
+    serving.worker_exited(worker.pid)
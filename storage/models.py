@@ -1,5 +1,7 @@
 from sqlalchemy.orm import DeclarativeBase, mapped_column
 from sqlalchemy import Integer, String, DateTime, func, Float,BigInteger
+from dataclasses import dataclass, fields
+from datetime import datetime
 
 class Base(DeclarativeBase):
     pass
@@ -17,8 +19,8 @@ class GradeReading(Base):
     score = mapped_column(Float, nullable=False)
     timestamp = mapped_column(DateTime,nullable=False)
     # date_created = mapped_column(BigInteger, server_default=func.round(func.unix_timestamp(func.now()) * 1000))
-    date_created = mapped_column(BigInteger, nullable=False)
-    trace_id = mapped_column(String(250),nullable=False)
+    date_created = mapped_column(BigInteger, nullable=False, index=True)
+    trace_id = mapped_column(String(250),nullable=False, index=True)
     def to_dict(self):
         return {
             'id': self.id,
@@ -50,8 +52,8 @@ class ActivityReading(Base):
     hours = mapped_column(Float, nullable=False)
     timestamp = mapped_column(DateTime, nullable=False)
     # date_created= mapped_column(DateTime, server_default=func.now())
-    date_created = mapped_column(BigInteger, nullable=False)
-    trace_id = mapped_column(String(250),nullable=False)
+    date_created = mapped_column(BigInteger, nullable=False, index=True)
+    trace_id = mapped_column(String(250),nullable=False, index=True)
     def to_dict(self):
         return {
             'id': self.id,
@@ -66,4 +68,43 @@ class ActivityReading(Base):
             'timestamp': self.timestamp,
             'date_created': self.date_created,
             'trace_id': self.trace_id
-        }
\ No newline at end of file
+        }
+
+
+# Read path DTOs: GET /store/grade and /store/activity select these columns as row tuples and
+# build one slotted record per row, no ORM entity and no dict (the JSON library serializes them)
+@dataclass(slots=True)
+class GradeRecord:
+    id: int
+    school_id: str
+    school_name: str
+    reporting_date: datetime
+    student_id: str
+    student_name: str
+    course: str
+    assignment: str
+    score: float
+    timestamp: datetime
+    date_created: int
+    trace_id: str
+
+
+@dataclass(slots=True)
+class ActivityRecord:
+    id: int
+    school_id: str
+    school_name: str
+    reporting_date: datetime
+    student_id: str
+    student_name: str
+    activity_type: str
+    activity_name: str
+    hours: float
+    timestamp: datetime
+    date_created: int
+    trace_id: str
+
+
+def record_columns(model, record_class):
+    """The model's columns in the field order of the record, for select(*columns)."""
+    return [getattr(model, field.name) for field in fields(record_class)]